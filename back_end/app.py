@@ -60,12 +60,33 @@ from sms import (
     sms_control
 )
 from payment import create_donation
+from monitoring import get_pool_stats, get_mail_stats, get_cache_stats, get_audit_log_stats, get_performance_stats, get_scheduler_stats
+import pgpool
+import querystats
+import compression
+import scheduler
+import auditlog
+from listing import paginated
+from bulkimport import import_recipients, import_menu_items
+from menucache import cached_menu
+from directory import cached_directory
+from jsonprovider import make_json_provider
+from credit_refresh import CreditRefreshJob
+from jwtcache import decode_cached
+from pg.pginstance import PgInstance
 from flask import Flask, jsonify, request, render_template, g
 from flask_jwt_extended import JWTManager, jwt_required, decode_token
 from flask_cors import CORS
+import click
 
 app = Flask(__name__)  # Initialize Flask app
+app.json = make_json_provider(app)  # orjson when installed; sends bodies built by Postgres as is
 CORS(app)
+pgpool.init_app(app)  # return each request's pooled db connection on teardown
+auditlog.init_app(app)  # drop the audit log entries of requests that never committed
+querystats.init_app(app)  # per-route latency and Server-Timing
+compression.init_app(app)  # gzip/brotli for large responses, counted in the route latency
+scheduler.init_app(app)  # maintenance jobs in this process when SCHEDULER=1
 
 # authentication
 app.add_url_rule("/api/login",               view_func=login,                 methods=["POST"])
@@ -94,7 +115,7 @@ app.add_url_rule('/api/recipient/upload-id', view_func=update_id,             me
 app.add_url_rule('/api/sms-control',                                 view_func=sms_control,                  methods=['POST'])
 
 # restaurant
-app.add_url_rule('/api/restaurant',                                  view_func=get_restaurants,              methods=['GET'])
+app.add_url_rule('/api/restaurant',                                  view_func=cached_directory(get_restaurants), methods=['GET'])
 app.add_url_rule('/api/restaurant/<restaurant_id>',                  view_func=restaurant_get,               methods=['GET'])   # might need to change function name
 app.add_url_rule('/api/restaurant/<restaurant_id>/order',            view_func=create_donation_claim,        methods=['POST'])
 app.add_url_rule('/api/restaurant/<restaurant_id>/order/<order_id>', view_func=verify_pickup_code,           methods=['POST'])
@@ -105,13 +126,13 @@ app.add_url_rule('/api/restaurant/available',                        view_func=r
 app.add_url_rule('/api/restaurant/cancel/<order_id>',                view_func=cancel_order,                 methods=['DELETE'])
 
 # menu
-app.add_url_rule('/api/menu/<restaurant_id>',     view_func=get_all_menu_items,         methods=['GET'])
+app.add_url_rule('/api/menu/<restaurant_id>',     view_func=cached_menu(get_all_menu_items), methods=['GET'])
 app.add_url_rule('/api/menu/add',                 view_func=add_menu_item,              methods=['POST'])
 app.add_url_rule('/api/menu/update',              view_func=update_menu_item,           methods=['PUT'])
 app.add_url_rule('/api/menu/delete',              view_func=delete_menu_item,           methods=['POST'])
 
 # social
-app.add_url_rule('/api/social/feed',              view_func=get_feed,                   methods=['GET'])
+app.add_url_rule('/api/social/feed',              view_func=paginated(get_feed, 'feed_item'), methods=['GET'])
 
 # metric
 app.add_url_rule('/api/metric',                   view_func=get_all_metrics,            methods=['GET'])
@@ -129,10 +150,18 @@ app.add_url_rule('/api/upload_image_url',         view_func=upload_item_photo_to
 app.add_url_rule('/api/payment',                  view_func=create_donation,            methods=['POST'])
 
 # admin
-app.add_url_rule('/api/admin/recipients',         view_func=get_all_recipients,         methods=['GET'])
+app.add_url_rule('/api/admin/recipients',         view_func=paginated(get_all_recipients, 'recipient', admin_only=True), methods=['GET'])
 app.add_url_rule('/api/admin/edit-recipient',     view_func=edit_recipient,             methods=['PUT'])
 app.add_url_rule('/api/admin/recipient-approval', view_func=set_recipient_approval,     methods=['PUT'])
-app.add_url_rule('/api/admin/log',                view_func=get_logger,                 methods=['GET'])
+app.add_url_rule('/api/admin/log',                view_func=paginated(get_logger, 'logger', admin_only=True), methods=['GET'])
+app.add_url_rule('/api/admin/pool',               view_func=get_pool_stats,             methods=['GET'])
+app.add_url_rule('/api/admin/mail',               view_func=get_mail_stats,             methods=['GET'])
+app.add_url_rule('/api/admin/cache',              view_func=get_cache_stats,            methods=['GET'])
+app.add_url_rule('/api/admin/audit-log',          view_func=get_audit_log_stats,        methods=['GET'])
+app.add_url_rule('/api/admin/performance',        view_func=get_performance_stats,      methods=['GET'])
+app.add_url_rule('/api/admin/scheduler',          view_func=get_scheduler_stats,        methods=['GET'])
+app.add_url_rule('/api/admin/import/recipients',  view_func=import_recipients,          methods=['POST'])
+app.add_url_rule('/api/admin/import/menu/<restaurant_id>', view_func=import_menu_items, methods=['POST'])
 
 
 # middleware
@@ -141,7 +170,7 @@ def parse_jwt():
     if request.headers.has_key("AUTH_TOKEN"):
         authToken = request.headers["AUTH_TOKEN"]
         try:
-            loginInfo = decode_token(authToken[7:])
+            loginInfo = decode_cached(authToken[7:])
             g.email = loginInfo['identity'][0]
             g.user_type = loginInfo['identity'][1]
             g.logged_in = True
@@ -155,5 +184,82 @@ def parse_jwt():
         g.logged_in = False
 
 
+@app.cli.command("install-metric-counters")
+def install_metric_counters():
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        print(err)
+        return
+    db.install_metric_counters()
+    db.disconnect()
+
+
+@app.cli.command("install-menu-versions")
+def install_menu_versions():
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        print(err)
+        return
+    db.create_menu_version_table()
+    db.disconnect()
+
+
+@app.cli.command("install-restaurant-directory")
+def install_restaurant_directory():
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        print(err)
+        return
+    db.install_restaurant_directory_trigger()
+    db.disconnect()
+
+
+@app.cli.command("install-job-runs")
+def install_job_runs():
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        print(err)
+        return
+    db.create_job_run_table()
+    db.create_job_progress_table()
+    db.disconnect()
+
+
+@app.cli.command("cancel-stale-claims")
+def cancel_stale_claims():
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        print(err)
+        return
+    report = db.cancel_and_refund_day_old_donation_claims()
+    db.disconnect()
+    print(report)
+
+
+@app.cli.command("refresh-credits")
+@click.option("--chunk-size", default=500, help="recipients per committed range")
+def refresh_credits(chunk_size):
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        print(err)
+        return
+    job = CreditRefreshJob(db, chunk_size)
+    for change in job.run():
+        print("%s,%s,%s,%s" % tuple(change))
+    db.disconnect()
+    print(job.report)
+
+
+@app.cli.command("run-scheduler")
+def run_scheduler():
+    scheduler.scheduler.run_forever()
+
+
 if __name__ == "__main__":
     app.run()
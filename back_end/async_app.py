@@ -0,0 +1,62 @@
+from async_authentication import login, sign_up_diner, sign_up_restaurant, token_app
+import async_pgpool
+from jwtcache import decode_cached
+from quart import Quart, g, jsonify, request
+
+# Async (ASGI) app for the I/O-bound routes that have moved to AsyncPgInstance. One process
+# serves many concurrent requests from a single event loop instead of a thread per request:
+#
+#     hypercorn async_app:app --bind 0.0.0.0:8000
+#
+# The paths are the same as in app.py, so the proxy in front can route them here while every
+# other route stays on the sync app.
+
+app = Quart(__name__)
+async_pgpool.init_app(app)  # return each request's pooled db connection on teardown
+# audit log entries are left to auditlog's timer thread; flushing in teardown would block the loop
+
+# authentication
+app.add_url_rule("/api/login",              view_func=login,              methods=["POST"])
+app.add_url_rule("/api/signup/diner",       view_func=sign_up_diner,      methods=["POST"])
+app.add_url_rule("/api/signup/restaurant",  view_func=sign_up_restaurant, methods=["POST"])
+
+
+def get_pool_stats():
+    if not (g.logged_in and g.user_type == "Admin"):
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(async_pgpool.get_pool().stats()), 200
+
+
+# admin
+app.add_url_rule("/api/admin/async-pool",   view_func=get_pool_stats,     methods=["GET"])
+
+
+# middleware
+@app.before_request
+def parse_jwt():
+    if "AUTH_TOKEN" in request.headers:
+        authToken = request.headers["AUTH_TOKEN"]
+        try:
+            with token_app.app_context():
+                loginInfo = decode_cached(authToken[7:])
+            g.email = loginInfo['identity'][0]
+            g.user_type = loginInfo['identity'][1]
+            g.logged_in = True
+        except Exception:
+            g.logged_in = False
+    else:
+        g.logged_in = False
+
+
+# same as flask_cors' defaults in app.py
+@app.after_request
+def allow_cors(response):
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    if request.method == "OPTIONS":
+        response.headers["Access-Control-Allow-Headers"] = request.headers.get("Access-Control-Request-Headers", "*")
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+    return response
+
+
+if __name__ == "__main__":
+    app.run()
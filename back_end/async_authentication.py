@@ -0,0 +1,137 @@
+import datetime
+import os
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from quart import jsonify, request
+
+import hashing
+from async_pginstance import AsyncPgInstance
+from async_pgpool import release_request_connection
+from authentication import contact_open_meal, jwt_lifespan_minutes, server_busy
+from hashing import HashingBusy
+from validation import diner_schema, restaurant_schema
+
+# async versions of the authentication.py handlers served by async_app.py. Same requests,
+# responses and rules; database calls go through AsyncPgInstance and bcrypt is awaited from
+# the hashing process pool.
+
+# flask_jwt_extended needs a Flask app context to sign tokens; this app is only used for that
+token_app = Flask(__name__)
+token_app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY")
+token_app.config["JWT_IDENTITY_CLAIM"] = "identity"
+JWTManager(token_app)
+
+
+def create_token(identity):
+    with token_app.app_context():
+        return "Bearer " + create_access_token(identity=identity,
+                                               expires_delta=datetime.timedelta(minutes=jwt_lifespan_minutes))
+
+
+def hashing_busy():
+    return jsonify({"error": "hashing queue full", "errorMessage": server_busy}), 503
+
+
+async def sign_up_diner():
+    data = await request.get_json()
+    validation_errors = diner_schema.errors(data)
+    if len(validation_errors) > 0:
+        err = " | ".join(validation_errors)
+        return jsonify({"error": err, "errorMessage": err}), 400
+
+    name, email, phone, password, image_url = \
+        (data[field] for field in ('name', 'email', 'phone', 'password', 'imageURL'))
+
+    try:
+        password_hash = await hashing.hash_password_async(password)
+    except HashingBusy:
+        return hashing_busy()
+
+    db = AsyncPgInstance()
+    err = await db.connect()
+    if err != None:
+        print("ERROR: could not connect to database trying to sign up diner:\n", err)
+        return jsonify({"error": str(err), "errorMessage": contact_open_meal}), 500
+
+    err, err_source = await db.sign_up("recipient", email.lower(), name, [phone], password_hash, image_url=image_url)
+
+    await db.disconnect()
+    if not err:
+        return jsonify({"success": "Diner successfully created"}), 201
+    else:
+        return jsonify({"error": f"{err} ({err_source} table)", "errorMessage": err}), 400
+
+
+async def sign_up_restaurant():
+    data = await request.get_json()
+    validation_errors = restaurant_schema.errors(data)
+    if len(validation_errors) > 0:
+        err = " | ".join(validation_errors)
+        return jsonify({"error": err, "errorMessage": err}), 400
+
+    restaurant_name, address, name, email, phone = \
+        (data[field] for field in ('restaurantName', 'restaurantAddress', 'name', 'email', 'phone'))
+
+    try:
+        password_hash = await hashing.hash_password_async("password")
+    except HashingBusy:
+        return hashing_busy()
+
+    db = AsyncPgInstance()
+    err = await db.connect()
+    if err != None:
+        print("ERROR: could not connect to database trying to sign up restaurant:\n", err)
+        return jsonify({"error": str(err), "errorMessage": contact_open_meal}), 500
+
+    err, err_source = await db.sign_up("restaurant", email.lower(), name, [phone], password_hash, False,
+                                       address1=address, restaurant_name=restaurant_name)
+
+    await db.disconnect()
+    if not err:
+        return jsonify({"token": create_token([email, "Business"])}), 201
+    else:
+        return jsonify({"error": err + " (" + err_source + " table)", "errorMessage": err}), 400
+
+
+async def login():
+    data = await request.get_json()
+    db = AsyncPgInstance()
+    err = await db.connect()
+    if err is not None:
+        print(err)
+        return jsonify({"error": "could not connect to database"}), 500
+    customer = await db.get_customer_by_email(data["email"])
+
+    if customer == None:
+        await db.disconnect()
+        return jsonify({"error": "incorrect credentials"}), 403
+    email = getattr(customer, "email")
+    password_hash = getattr(customer, "password")
+
+    role = await db.get_role(email)
+    await db.disconnect()
+    # give the connection back before verifying; bcrypt takes far longer than the queries
+    await release_request_connection()
+
+    if role == None:
+        return jsonify({"error": "incorrect credentials"}), 403
+
+    try:
+        correctPassword = await hashing.verify_password_async(data["password"], password_hash)
+    except HashingBusy:
+        return hashing_busy()
+
+    if correctPassword and hashing.needs_rehash(password_hash):
+        # bcrypt cost was changed since this hash was made, upgrade it transparently
+        try:
+            new_hash = await hashing.hash_password_async(data["password"])
+        except HashingBusy:
+            new_hash = None
+        if new_hash is not None and await db.connect() is None:
+            await db.update_customer_password(email, new_hash)
+            await db.disconnect()
+
+    if correctPassword:
+        return jsonify({"token": create_token([email, role])}), 200
+    return jsonify({"error": "incorrect credentials"}), 403
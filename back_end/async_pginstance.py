@@ -0,0 +1,627 @@
+import sys
+import time
+from datetime import datetime
+
+import psycopg.errors
+import pytz
+from psycopg import pq
+from psycopg.rows import namedtuple_row
+from quart import g, has_app_context
+
+import async_pgpool
+from pg.pginstance import PgInstance, role_cache, role_key, menu_versions, metrics_cache, SumRow, CountRow
+from querystats import record_query, wrapper_names
+from auditlog import audit_log
+from jsonprovider import RawJSON
+from metrics import METRIC_COUNTER_ROLLUP, METRIC_TOTALS, metric_value
+
+# psycopg 3 / asyncio counterpart of PgInstance for the async routes. Methods keep the names,
+# arguments and return values of their PgInstance versions and share its SQL and caches.
+#
+# Ported: accounts and roles, donation claims and orders, credits, donations and the feed,
+# restaurants, menus and metrics. Left on PgInstance, for the sync app and CLI only: schema
+# installs (install_*, create_*_table), scheduler and job bookkeeping, bulk imports (COPY and
+# execute_values), paged and streamed whole-table reads (get_all_customers, get_logger,
+# stream_table, ...) and the testing helpers. There is no replica routing; every read goes to
+# the primary.
+
+
+class AsyncPgInstance:
+    def __init__(self):
+        # Current connection object, None if no connection
+        self.conn = None
+        # Current cursor object, None if no cursor/connection
+        self.curs = None
+        # True when conn belongs to the current request and is released by its teardown
+        self.request_scoped = False
+        # role memberships read by this instance, cached once its transaction commits
+        self.pending_roles = {}
+
+    """
+    Check out a pooled connection and initialize cursor.
+    Within a request every AsyncPgInstance shares the request's connection.
+    Returns:
+        None, or error if no connection could be obtained
+    """
+
+    async def connect(self):
+        try:
+            if has_app_context():
+                self.conn = await async_pgpool.request_connection()
+                self.request_scoped = True
+            else:
+                self.conn = await async_pgpool.get_pool().getconn()
+                self.request_scoped = False
+            self.curs = self.conn.cursor(row_factory=namedtuple_row)
+        except Exception as e:
+            return e
+
+    async def commit(self):
+        try:  # make changes persist
+            await self.conn.commit()
+        except Exception as e:
+            return e
+        self.cache_pending_roles()
+
+    async def rollback(self):
+        try:
+            self.pending_roles.clear()
+            await self.conn.rollback()
+        except Exception as e:
+            return e
+
+    def cache_pending_roles(self):
+        for key, roles in self.pending_roles.items():
+            role_cache.set(key, roles)
+        self.pending_roles.clear()
+
+    def forget_roles(self, email):
+        role_cache.pop(role_key(email))
+        self.pending_roles.pop(role_key(email), None)
+
+    """
+    Commit, close cursor and hand the connection back to the pool (request-scoped connections
+    are returned by the request teardown instead); like PgInstance.disconnect, a connection
+    whose commit failed is rolled back and discarded
+    Returns:
+        None if successful disconnection, else error message
+    """
+
+    async def disconnect(self):
+        if self.conn == None or self.curs == None:
+            return "No connection or cursor to disconnect from."
+        err = None
+        try:  # make changes persist
+            await self.conn.commit()
+            self.cache_pending_roles()
+        except Exception as e:
+            err = str(e)
+            await self.rollback()
+        finally:
+            try:
+                await self.curs.close()
+            except Exception:
+                pass
+            if not self.request_scoped:
+                await async_pgpool.get_pool().putconn(self.conn, discard=err != None)
+            self.curs = None
+            self.conn = None
+        return err
+
+    # timed under the calling method's name, like querystats.InstrumentedCursor
+    async def execute(self, query, params=None, prepare=None):
+        frame = sys._getframe(1)
+        while frame.f_code.co_name in wrapper_names:
+            frame = frame.f_back
+        caller = frame.f_code.co_name
+        start = time.perf_counter()
+        try:
+            await self.curs.execute(query, params, prepare=prepare)
+        except Exception:
+            record_query(caller, time.perf_counter() - start, 0, True)
+            raise
+        record_query(caller, time.perf_counter() - start, self.curs.rowcount, False)
+
+    async def fetchone(self, query, params=None):
+        await self.execute(query, params)
+        return await self.curs.fetchone()
+
+    async def fetchall(self, query, params=None):
+        await self.execute(query, params)
+        return await self.curs.fetchall()
+
+    """
+    Run one of PgInstance.prepared_statements. psycopg prepares it on the connection the
+    first time and executes it by name afterwards; with PG_PREPARED=0 it is sent as plain SQL.
+    psycopg forgets its prepared statements on rollback, so after an ALTER TABLE made the plan
+    stale the statement is prepared again, and run again right away when nothing else ran in
+    the transaction.
+    """
+
+    async def execute_prepared(self, name, params):
+        idle = self.conn.info.transaction_status == pq.TransactionStatus.IDLE
+        try:
+            await self.execute(PgInstance.prepared_statements[name], params, prepare=PgInstance.use_prepared)
+        except psycopg.errors.FeatureNotSupported:
+            if not idle:
+                raise
+            await self.conn.rollback()
+            await self.execute(PgInstance.prepared_statements[name], params, prepare=PgInstance.use_prepared)
+
+    async def fetch_json(self, query, params=None, order_by=None):
+        return RawJSON(getattr(await self.fetchone(PgInstance.json_query(query, order_by), params), "body"))
+
+    'restaurant.py routing helpers'
+
+    async def get_all_restaurants(self):
+        return await self.fetchall("SELECT * FROM restaurant")
+
+    async def get_restaurant(self, restaurant_id=None):
+        if restaurant_id == None:
+            restaurant_id = await self.get_restaurant_id_from_user_info()
+        return await self.fetchone("SELECT * FROM restaurant WHERE id = %s", (restaurant_id,))
+
+    async def set_availability(self, available):
+        await self.execute("UPDATE restaurant SET available = %s WHERE id = %s",
+                           (available, await self.get_restaurant_id_from_user_info()))
+
+    async def set_hours(self, times):
+        await self.execute("UPDATE restaurant SET operating_hours = %s  WHERE id = %s",
+                           (times, await self.get_restaurant_id_from_user_info()))
+
+    async def get_restaurant_id_from_user_info(self):
+        await self.execute_prepared("restaurant_id_by_email", (g.email,))
+        return getattr(await self.curs.fetchone(), "id")
+
+    async def get_restaurant_id_from_email(self, email):
+        return getattr(await self.fetchone("SELECT id FROM restaurant WHERE email = %s", (email,)), "id")
+
+    async def get_restaurant_phones(self):
+        return await self.fetchall("SELECT restaurant.id, customer.email, customer.phone \
+                                    FROM restaurant LEFT JOIN customer USING (email)")
+
+    'customer.py routing helpers'
+
+    async def get_customer(self, email):
+        return await self.fetchone("SELECT * FROM customer WHERE email = %s", (email,))
+
+    async def delete_customer(self, email):
+        self.forget_roles(email)
+        for table in ("recipient", "restaurant", "donor", "customer"):
+            await self.execute("DELETE FROM {0} WHERE email = %s".format(table), (email,))
+        return None
+
+    async def get_customer_by_email(self, email):
+        await self.execute_prepared("customer_by_email", (email,))
+        return await self.curs.fetchone()  # We should never get more than one
+
+    async def get_donor_by_email(self, email):
+        return await self.fetchone("SELECT * FROM donor WHERE email=%s", (email,))
+
+    async def get_restaurant_by_email(self, email):
+        await self.execute_prepared("restaurant_by_email", (email,))
+        return await self.curs.fetchone()
+
+    async def get_restaurant_by_id(self, id):
+        return await self.fetchone("SELECT * FROM restaurant WHERE id=%s", (id,))
+
+    async def get_recipient_by_email(self, email):
+        await self.execute_prepared("recipient_by_email", (email,))
+        return await self.curs.fetchone()
+
+    async def get_admin_by_email(self, email):
+        return await self.fetchone("SELECT * FROM admin WHERE email=%s", (email,))
+
+    async def get_donor_by_venmo(self, venmo):
+        return await self.fetchone("SELECT * FROM donor WHERE venmo=%s", (venmo,))
+
+    async def get_diner_by_email(self, email):
+        return await self.fetchone("SELECT c.name, c.email, c.phone, r.image_url FROM customer c \
+                                    LEFT JOIN recipient r ON c.email = r.email WHERE c.email=%s", (email,))
+
+    async def is_eligible_email(self, email):
+        return PgInstance.eligible(await self.get_role_memberships(email))
+
+    async def get_role_memberships(self, email):
+        found, roles = role_cache.lookup(role_key(email))
+        if found:
+            return roles
+        roles = await self.fetchone(PgInstance.role_memberships_query, {"email": email})
+        if any(roles):  # see role_cache
+            self.pending_roles[role_key(email)] = roles
+        return roles
+
+    async def get_role(self, email):
+        return PgInstance.role_name(await self.get_role_memberships(email))
+
+    async def create_customer(self, email, name, phone, password_hash=None, verified=False):
+        self.forget_roles(email)
+        row = await self.get_customer_by_email(email)
+        if row != None and getattr(row, "password") != None:
+            return "invalid email, already taken"
+        if row != None:
+            await self.execute("DELETE FROM customer WHERE id=%s", (getattr(row, "id"),))
+        if password_hash == None:
+            await self.execute("INSERT INTO customer (email, name, phone, verified) VALUES (%s, %s, %s, %s)",
+                               (email, name, phone, verified))
+        else:
+            await self.execute("INSERT INTO customer (email, name, phone, password, verified) VALUES (%s, %s, %s, %s, %s)",
+                               (email, name, phone, password_hash, verified))
+        return None
+
+    async def create_donor(self, email, venmo):
+        if not await self.is_eligible_email(email):
+            return "invalid email, already taken"
+        self.forget_roles(email)
+        await self.execute("INSERT INTO donor (email, venmo) VALUES (%s, %s)", (email, venmo))
+        return None
+
+    async def create_recipient(self, email, image_url=None):
+        if not await self.is_eligible_email(email):
+            return "invalid email, already taken"
+        self.forget_roles(email)
+        if image_url == None:
+            await self.execute("INSERT INTO recipient (email) VALUES (%s)", (email,))
+        else:
+            await self.execute("INSERT INTO recipient (email, image_url) VALUES (%s, %s)", (email, image_url))
+        return None
+
+    async def create_restaurant(self, email, address, restaurant_name):
+        if not await self.is_eligible_email(email):
+            return "invalid email, already taken"
+        self.forget_roles(email)
+        await self.execute("INSERT INTO restaurant (email, address1, restaurant_name) VALUES (%s, %s, %s)",
+                           (email, address, restaurant_name))
+        return None
+
+    async def sign_up(self, role, email, name, phone, password_hash, verified=False, **role_fields):
+        self.forget_roles(email)
+        # separate statements, psycopg 3 binds parameters server-side
+        await self.execute("SAVEPOINT sign_up")
+        await self.execute(PgInstance.sign_up_query(role),
+                           dict(role_fields, email=email, name=name, phone=phone, password=password_hash, verified=verified))
+        err, err_source = PgInstance.sign_up_error(role, await self.curs.fetchone())
+        if err_source != None:
+            await self.execute("ROLLBACK TO SAVEPOINT sign_up")  # don't keep a customer row without its role row
+        return err, err_source
+
+    async def update_customer_name(self, email, name):
+        await self.execute("UPDATE customer SET name=%s WHERE email=%s", (name, email))
+
+    async def update_customer_phone(self, email, phone):
+        await self.execute("UPDATE customer SET phone=%s WHERE email=%s", (phone, email))
+
+    async def update_customer_password(self, email, password):
+        await self.execute(
+            "UPDATE customer SET password=%s WHERE email=%s", (password, email))
+
+    async def get_customer_password(self, email):
+        return await self.fetchone("SELECT password FROM customer WHERE email=%s", (email,))
+
+    async def is_signed_up(self, email):
+        return await self.fetchone("SELECT * FROM customer WHERE email = %s", (email,)) is not None
+
+    async def save_verification_code(self, email, code, expiresAt):
+        await self.execute("INSERT INTO email_otp (email, code, expiresAt) VALUES (%s, %s, %s)",
+                           (email, code, expiresAt))
+
+    async def verify_otp(self, email, otp):
+        await self.execute_prepared("verify_otp", (email, otp))
+        return await self.curs.fetchone() is not None
+
+    async def get_otp_email(self, code):
+        return await self.fetchone("SELECT email FROM email_otp WHERE code = %s", (code,))
+
+    'recipient credits'
+
+    async def update_recipient(self, email, available_credits, extra_credits, credit_limit, approval):
+        await self.execute(
+            "UPDATE recipient SET available_credits=%s, extra_credits=%s, credit_limit=%s, approved=%s WHERE email=%s",
+            (available_credits, extra_credits, credit_limit, approval, email))
+
+    async def update_recipient_status(self, email, approval):
+        await self.execute("UPDATE recipient SET approved=%s WHERE email=%s", (approval, email))
+
+    async def get_recipient_approval_status(self, email):
+        row = await self.fetchone("SELECT approved FROM recipient WHERE email = %s", (email,))
+        if row == None:
+            return False
+        return row[0]
+
+    async def restaurant_credit_cancel(self, restaurant_id, amount):
+        await self.execute("UPDATE restaurant SET available_credits=available_credits + %s WHERE id=%s",
+                           (amount, restaurant_id))
+
+    async def recipient_credit_cancel(self, recipient_email, amount):
+        await self.execute("UPDATE recipient SET available_credits=available_credits + %s WHERE email=%s",
+                           (amount, recipient_email))
+
+    async def update_recipient_credits(self, available_credits, email):
+        await self.execute("UPDATE recipient SET available_credits=%s WHERE email=%s", (available_credits, email))
+
+    async def update_recipient_extra_credits(self, extra_credits, email):
+        await self.execute("UPDATE recipient SET extra_credits=%s WHERE email=%s", (extra_credits, email))
+
+    async def update_recipient_responses(self, email, responses):
+        await self.execute("UPDATE recipient SET responses=%s WHERE email=%s", (responses, email))
+
+    async def get_recipient_responses(self, email):
+        row = await self.fetchone("SELECT responses FROM recipient WHERE email=%s", (email,))
+        return None if row == None else row[0]
+
+    async def get_recipient_available_credits(self, email):
+        return await self.fetchone(
+            "SELECT available_credits, credit_limit, extra_credits FROM recipient WHERE email = %s", (email,))
+
+    async def update_restaurant_credits(self, available_credits, restaurant_id):
+        await self.execute("UPDATE restaurant SET available_credits=%s WHERE id=%s", (available_credits, restaurant_id))
+
+    async def get_restaurant_credits(self, restaurant_id):
+        return await self.fetchone("SELECT available_credits FROM restaurant WHERE id=%s", (restaurant_id,))
+
+    async def update_id(self, email, image_url):
+        await self.execute("UPDATE recipient SET image_url=%s WHERE email=%s", (image_url, email))
+
+    async def get_recipient_phones(self):
+        return await self.fetchall("SELECT recipient.id, customer.email, customer.phone \
+                                    FROM recipient LEFT JOIN customer USING (email)")
+
+    'donation claims and orders'
+
+    async def get_order_by_id(self, id):
+        return await self.fetchone("SELECT * FROM donation_claim WHERE id=%s", (id,))
+
+    async def get_pickup_code(self, restaurant_id, donation_claim_id):
+        donation_claim = await self.fetchone("SELECT pickup_code FROM donation_claim WHERE id=%s AND restaurant_id=%s",
+                                             (donation_claim_id, restaurant_id))
+        return None if donation_claim == None else getattr(donation_claim, "pickup_code")
+
+    async def create_donation_claim(self, restaurant_id, feed_item_id, recipient_email, meal_items, pickup_code, o,
+                                    pickup_time, create_time, timezone):
+        return await self.fetchone(
+            "INSERT INTO donation_claim (restaurant_id, feed_item_id, recipient_email, meal_items, pickup_code, amount, pickup_time, created, timezone) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
+            (restaurant_id, feed_item_id, recipient_email, meal_items, pickup_code, o, pickup_time, create_time, timezone))
+
+    async def get_donation_claim_by_id(self, donation_claim_id):
+        return await self.fetchone("SELECT * FROM donation_claim WHERE id=%s", (donation_claim_id,))
+
+    async def get_donation_claim_by_feed_id(self, feed_id):
+        return await self.fetchone("SELECT * FROM donation_claim WHERE feed_item_id=%s", (feed_id,))
+
+    async def set_donation_claim_verified(self, donation_claim_id):
+        await self.execute("UPDATE donation_claim SET verified=TRUE, active=FALSE WHERE id=%s", (donation_claim_id,))
+
+    async def get_active_donation_claims(self, restaurant_id):
+        return await self.fetchall("SELECT * FROM donation_claim WHERE restaurant_id = %s AND active=TRUE",
+                                   (restaurant_id,))
+
+    async def get_active_donation_claims_json(self, restaurant_id):
+        return await self.fetch_json("SELECT * FROM donation_claim WHERE restaurant_id = %s AND active=TRUE",
+                                     (restaurant_id,))
+
+    async def get_inactive_donation_claims(self, restaurant_id):
+        return await self.fetchall("SELECT * FROM donation_claim WHERE restaurant_id = %s AND active=FALSE",
+                                   (restaurant_id,))
+
+    async def get_inactive_donation_claims_json(self, restaurant_id):
+        return await self.fetch_json("SELECT * FROM donation_claim WHERE restaurant_id = %s AND active=FALSE",
+                                     (restaurant_id,))
+
+    async def get_past_orders_by_recipient(self, email):
+        return await self.fetchall("select row_to_json(row) from (SELECT * FROM donation_claim \
+                                    WHERE recipient_email = %s ORDER BY created DESC) row", (email,))
+
+    async def get_past_orders_by_recipient_json(self, email):
+        row = await self.fetchone("SELECT COALESCE(json_agg(json_build_array(row_to_json(row)) ORDER BY created DESC), '[]')::text \
+                                        AS body FROM donation_claim row WHERE recipient_email = %s", (email,))
+        return RawJSON(getattr(row, "body"))
+
+    async def cancel_order(self, order_id, canceled_by=None):
+        if canceled_by:
+            await self.execute("UPDATE donation_claim SET active = FALSE, canceled_by = %s where id = %s",
+                               (canceled_by, order_id))
+        else:
+            await self.execute("UPDATE donation_claim SET active = FALSE where id = %s", (order_id,))
+
+    async def cancel_and_refund_day_old_donation_claims(self):
+        start = time.perf_counter()
+        report = (await self.fetchone(PgInstance.cancel_and_refund_query,
+                                      {"now": datetime.now(pytz.timezone("UTC"))}))._asdict()
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+    async def restaurant_recipient_refund(self, order):
+        # refund restaurant and recipient, with logging to confirm
+        restaurant_id = getattr(order, 'restaurant_id')
+        recipient_email = getattr(order, 'recipient_email')
+        amount = getattr(order, 'amount')
+        restaurant = await self.get_restaurant(restaurant_id)
+
+        restaurant_credits_before = getattr(restaurant, 'available_credits')
+        recipient_credits_before = getattr(await self.get_recipient_by_email(recipient_email), 'available_credits')
+
+        await self.restaurant_credit_cancel(restaurant_id, amount)
+        await self.recipient_credit_cancel(recipient_email, amount)
+
+        recipient_credits_after = getattr(await self.get_recipient_by_email(recipient_email), 'available_credits')
+        restaurant_credits_after = getattr(await self.get_restaurant_credits(restaurant_id), 'available_credits')
+
+        self.log(getattr(restaurant, 'email'), "cancel", "cancel #%s: restaurant credit: %s -> %s" % (getattr(order, 'id'), restaurant_credits_before, restaurant_credits_after))
+        self.log(recipient_email, "cancel", "cancel #%s: recipient credit: %s -> %s" % (getattr(order, 'id'), recipient_credits_before, recipient_credits_after))
+
+        return {
+            "recipient_credit": recipient_credits_after,
+            "restaurant_credit": restaurant_credits_after
+        }
+
+    'donations and feed'
+
+    async def add_donation(self, feed_item_id, donor_email, amount):
+        await self.execute("INSERT INTO donation (feed_item_id, donor_email, amount_left) VALUES (%s, %s, %s)",
+                           (feed_item_id, donor_email, amount))
+        return None
+
+    async def create_donation(self, feed_item_id, venmo_username, venmo_transaction_id, amount_left):
+        if await self.get_donation(venmo_transaction_id) != None:
+            return
+        donor_row = await self.get_donor_by_venmo(venmo_username)
+        if donor_row == None:
+            await self.execute("INSERT INTO donation (feed_item_id, venmo_username, venmo_transaction_id, amount_left) VALUES (%s, %s, %s, %s) RETURNING id",
+                               (feed_item_id, venmo_username, venmo_transaction_id, amount_left))
+        else:
+            await self.execute("INSERT INTO donation (feed_item_id, venmo_username, venmo_transaction_id, amount_left, donor_email) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                               (feed_item_id, venmo_username, venmo_transaction_id, amount_left, getattr(donor_row, "email")))
+
+    async def get_donation(self, venmo_transaction_id):
+        return await self.fetchone("SELECT * FROM donation WHERE venmo_transaction_id=%s", (venmo_transaction_id,))
+
+    async def get_all_donations(self):
+        return await self.fetchall("SELECT * FROM donation")
+
+    async def get_donation_by_feed_id(self, feed_id):
+        return await self.fetchone("SELECT * FROM donation WHERE feed_item_id=%s", (feed_id,))
+
+    async def create_feed_item(self, feed_item_type, msg, amount):
+        return await self.fetchone("INSERT INTO feed_item (feed_item_type, msg, amount) VALUES (%s, %s, %s) RETURNING id",
+                                   (feed_item_type, msg, amount))
+
+    async def get_feed_limited(self):
+        return await self.fetchall("SELECT * FROM feed_item ORDER BY created ASC LIMIT 7")
+
+    async def create_distribution(self, distributed_credits, restaurants_json):
+        await self.execute("INSERT INTO distribution (distributed_credits, restaurants) VALUES (%s, %s)",
+                           (distributed_credits, restaurants_json))
+
+    'menu.py routing helpers'
+
+    async def add_menu_item(self, menu_item):
+        restaurant_id = await self.get_restaurant_id_from_user_info()
+        row = await self.fetchone("INSERT INTO menu_item (restaurant_id, name, description, imageUrl, baseCost, "
+                                  "category, customizations, available) "
+                                  "VALUES (%s, %s, %s, %s, %s, %s, %s, True) RETURNING id",
+                                  (restaurant_id, menu_item["name"], menu_item["description"],
+                                   menu_item["imageUrl"], menu_item["baseCost"], menu_item["category"], []))
+        await self.bump_menu_version(restaurant_id)
+        return row
+
+    async def delete_menu_item(self, menu_item_id):
+        restaurant_id = await self.get_restaurant_id_from_user_info()
+        await self.execute("DELETE FROM menu_item WHERE restaurant_id = %s AND id = %s", (restaurant_id, menu_item_id))
+        await self.bump_menu_version(restaurant_id)
+
+    async def update_menu_item(self, menu_item_id, updated_menu_item):
+        restaurant_id = await self.get_restaurant_id_from_user_info()
+        await self.execute("UPDATE menu_item SET name = %s, description = %s, imageUrl = %s, baseCost = %s, "
+                           "category = %s, customizations = %s, available = %s "
+                           "WHERE restaurant_id = %s AND id = %s",
+                           (updated_menu_item["name"], updated_menu_item["description"], updated_menu_item["imageUrl"],
+                            updated_menu_item["baseCost"], updated_menu_item["category"],
+                            updated_menu_item['customizations'], updated_menu_item['available'],
+                            restaurant_id, menu_item_id))
+        await self.bump_menu_version(restaurant_id)
+
+    async def has_menu_version_table(self):
+        if not PgInstance.menu_versions_installed:
+            row = await self.fetchone("SELECT to_regclass('menu_version') IS NOT NULL AS installed")
+            PgInstance.menu_versions_installed = getattr(row, "installed")
+        return PgInstance.menu_versions_installed
+
+    async def get_menu_version(self, restaurant_id):
+        found, version = menu_versions.lookup(restaurant_id)
+        if found:
+            return version
+        if not await self.has_menu_version_table():
+            return None
+        row = await self.fetchone("SELECT version FROM menu_version WHERE restaurant_id = %s", (restaurant_id,))
+        version = 0 if row == None else getattr(row, "version")
+        menu_versions.set(restaurant_id, version)
+        return version
+
+    async def bump_menu_version(self, restaurant_id):
+        menu_versions.pop(restaurant_id)
+        if not await self.has_menu_version_table():
+            return
+        await self.execute("INSERT INTO menu_version (restaurant_id, version) VALUES (%s, 1) \
+                            ON CONFLICT (restaurant_id) DO UPDATE SET version = menu_version.version + 1",
+                           (restaurant_id,))
+
+    async def get_all_menu_items(self, restaurant_id, bottom=0):
+        return await self.fetchall("SELECT * FROM menu_item WHERE restaurant_id = %s AND id > %s LIMIT 49",
+                                   (restaurant_id, bottom))
+
+    async def get_all_menu_items_json(self, restaurant_id, bottom=0):
+        return await self.fetch_json("SELECT * FROM menu_item WHERE restaurant_id = %s AND id > %s LIMIT 49",
+                                     (restaurant_id, bottom))
+
+    async def get_menu_item_price(self, restaurant_id, item_id):
+        try:
+            row = await self.fetchone("SELECT * FROM menu_item WHERE restaurant_id = %s AND id = %s",
+                                      (restaurant_id, item_id))
+            return getattr(row, "basecost")
+        except Exception:
+            return None
+
+    async def get_menu_item_price_open(self, item_id):
+        try:
+            return getattr(await self.fetchone("SELECT * FROM menu_item WHERE id = %s", (item_id,)), "basecost")
+        except Exception as e:
+            print(e)
+            return None
+
+    'metrics'
+
+    async def has_metric_counters(self):
+        if not PgInstance.metric_counters_installed:
+            row = await self.fetchone("SELECT to_regclass('metric_counter_delta') IS NOT NULL AS installed")
+            PgInstance.metric_counters_installed = getattr(row, "installed")
+        return PgInstance.metric_counters_installed
+
+    # shares metrics_cache with PgInstance, but tasks that miss it each load the counters
+    async def get_metric_counters(self):
+        found, counters = metrics_cache.lookup()
+        if found:
+            return counters
+        if not await self.has_metric_counters():
+            counters = {getattr(row, "name"): getattr(row, "value") for row in await self.fetchall(METRIC_TOTALS)}
+        else:
+            rows = await self.fetchall(PgInstance.metric_counters_query)
+            counters = {getattr(row, "name"): getattr(row, "value") for row in rows}
+            if sum(getattr(row, "pending") for row in rows) >= PgInstance.metric_rollup_threshold:
+                await self.try_roll_up_metric_counters()
+        metrics_cache.set(counters)
+        return counters
+
+    async def try_roll_up_metric_counters(self):
+        await self.execute("SAVEPOINT metric_rollup")
+        try:
+            await self.execute(METRIC_COUNTER_ROLLUP)
+        except Exception as e:
+            print("ERROR: metric roll-up failed: %s" % e)
+            await self.execute("ROLLBACK TO SAVEPOINT metric_rollup")
+            return
+        await self.execute("RELEASE SAVEPOINT metric_rollup")
+
+    async def get_metric(self, name):
+        return metric_value(await self.get_metric_counters(), name)
+
+    async def get_num_meals(self):
+        return SumRow(await self.get_metric("num_meals"))
+
+    async def get_num_restaurants(self):
+        return CountRow(await self.get_metric("num_restaurants"))
+
+    async def get_num_donors(self):
+        return CountRow(await self.get_metric("num_donors"))
+
+    async def get_num_recipients(self):
+        return CountRow(await self.get_metric("num_recipients"))
+
+    async def get_num_children(self):
+        return SumRow(await self.get_metric("num_children"))
+
+    async def get_distribution_total(self):
+        return SumRow(await self.get_metric("distribution_total"))
+
+    # buffered and written in bulk by auditlog.audit_log on its own connection, not part of this transaction
+    def log(self, email, category, message):
+        audit_log.add(email, category, message)
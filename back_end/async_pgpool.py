@@ -0,0 +1,165 @@
+import asyncio
+import os
+from collections import deque
+
+import psycopg
+from psycopg import pq
+from pgpool import PoolTimeout
+from quart import g
+
+# asyncio counterpart of pgpool.PgPool for the async routes (async_app.py): a bounded pool of
+# psycopg 3 AsyncConnections. Waiting for a connection suspends the task instead of blocking
+# a thread. Inside a request one connection is kept on `g` and handed back on teardown.
+
+
+class AsyncPgPool:
+    def __init__(self, dsn=None, max_size=10, timeout=5.0, factory=None, **connect_kwargs):
+        self.dsn = dsn
+        self.max_size = max_size
+        # seconds a caller waits for a free connection before PoolTimeout
+        self.timeout = timeout
+        self.factory = factory or psycopg.AsyncConnection.connect
+        self.connect_kwargs = connect_kwargs
+        self._idle = deque()
+        # futures of callers waiting for a connection, oldest first; putconn hands a returned
+        # connection straight to the oldest one so late arrivals can't jump the queue
+        self._waiters = deque()
+        self._size = 0  # connections opened and not yet discarded
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+
+    """
+    Check out a connection, opening a new one if the pool is below max_size, otherwise
+    waiting until one is returned.
+    Returns:
+        psycopg AsyncConnection, raises PoolTimeout if none became free within timeout
+    """
+
+    async def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        while self._idle and not self._waiters:
+            conn = self._idle.pop()
+            if not conn.closed:
+                self._checkouts += 1
+                return conn
+            self._size -= 1
+        if self._size >= self.max_size:
+            self._waits += 1
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                conn = await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                raise PoolTimeout("no database connection available after %ss" % timeout)
+            except asyncio.CancelledError:
+                # cancelled just after being handed a connection or slot: pass it on
+                if waiter.done() and not waiter.cancelled():
+                    if waiter.result() is None:
+                        self._release_slot()
+                    elif not self._hand_over(waiter.result()):
+                        self._idle.append(waiter.result())
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            if conn is not None:
+                self._checkouts += 1
+                return conn
+            # a connection was discarded, its slot was handed over instead
+        else:
+            self._size += 1
+        try:
+            conn = await self.factory(self.dsn, **self.connect_kwargs)
+        except Exception:
+            self._release_slot()
+            raise
+        self._checkouts += 1
+        return conn
+
+    def _hand_over(self, conn):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(conn)
+                return True
+        return False
+
+    def _release_slot(self):
+        if not self._hand_over(None):
+            self._size -= 1
+
+    """
+    Return a connection to the pool. Any open transaction is rolled back so the next
+    borrower starts clean; broken connections are closed and their slot freed.
+    """
+
+    async def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != pq.TransactionStatus.IDLE:
+                    await conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed:
+            if not conn.closed:
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+            self._release_slot()
+        elif not self._hand_over(conn):
+            self._idle.append(conn)
+
+    async def closeall(self):
+        idle, self._idle = list(self._idle), deque()
+        self._size -= len(idle)
+        for conn in idle:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        return {
+            "max_size": self.max_size,
+            "timeout": self.timeout,
+            "size": self._size,
+            "in_use": self._size - len(self._idle),
+            "idle": len(self._idle),
+            "waiting": len(self._waiters),
+            "checkouts": self._checkouts,
+            "waits": self._waits,
+            "timeouts": self._timeouts,
+        }
+
+
+_pool = None
+
+
+# one pool per process, created on first use inside the serving event loop
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = AsyncPgPool(os.environ["DATABASE_URL"],
+                            max_size=int(os.environ.get("DB_POOL_SIZE", 10)),
+                            timeout=float(os.environ.get("DB_POOL_TIMEOUT", 5)),
+                            sslmode='require')
+    return _pool
+
+
+async def request_connection():
+    if "pg_conn" not in g:
+        g.pg_conn = await get_pool().getconn()
+    return g.pg_conn
+
+
+async def release_request_connection(exc=None):
+    conn = g.pop("pg_conn", None)
+    if conn is not None:
+        await get_pool().putconn(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_request_connection)
@@ -0,0 +1,169 @@
+import atexit
+import os
+import threading
+import weakref
+from datetime import datetime
+
+import psycopg2.extras
+import pytz
+from flask import g
+from pgpool import get_pool
+
+# PgInstance.log entries belong to the transaction they were logged in: they wait in
+# pending_log, per connection, and commit() writes them to logger with one multi-row insert just
+# before committing, so a rolled-back refund leaves no entry saying it happened.
+#
+# AuditLogWriter buffers the entries of code without such a transaction (AsyncPgInstance.log)
+# and writes them on its own pooled connection when max_entries have piled up, every
+# flush_interval seconds and at interpreter exit.
+
+
+def insert_entries(curs, entries, page_size=500):
+    psycopg2.extras.execute_values(
+        curs, "INSERT INTO logger (email, time, category, message) VALUES %s", entries, page_size=page_size)
+
+
+class PendingLog:
+    def __init__(self):
+        # connection -> entries logged in its open transaction
+        self._entries = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.written = 0
+        self.inserts = 0
+        self.discarded = 0
+
+    def add(self, conn, email, category, message):
+        entry = (email, datetime.now(pytz.timezone("UTC")), category, message)
+        with self._lock:
+            self._entries.setdefault(conn, []).append(entry)
+
+    """
+    Insert the entries of curs's connection in its transaction; called right before commit
+    """
+
+    def write(self, curs):
+        with self._lock:
+            entries = self._entries.pop(curs.connection, None)
+        if entries:
+            self.insert(curs, entries)
+            self.written += len(entries)
+            self.inserts += 1
+
+    def insert(self, curs, entries):
+        insert_entries(curs, entries)
+
+    """
+    Drop the entries of conn's transaction, which is being rolled back
+    """
+
+    def discard(self, conn):
+        with self._lock:
+            entries = self._entries.pop(conn, None)
+        if entries:
+            self.discarded += len(entries)
+
+    def pending(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._entries.values())
+
+    def stats(self):
+        return {"pending": self.pending(), "written": self.written, "inserts": self.inserts,
+                "discarded": self.discarded}
+
+
+class AuditLogWriter:
+    def __init__(self, max_entries=500, flush_interval=2.0, max_buffered=100000):
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        # entries kept for retry while the database is unreachable, oldest dropped beyond this
+        self.max_buffered = max_buffered
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        self.written = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    def add(self, email, category, message):
+        entry = (email, datetime.now(pytz.timezone("UTC")), category, message)
+        with self._lock:
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.max_entries
+            if not full and self._timer is None and self.flush_interval:
+                self._timer = threading.Timer(self.flush_interval, self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    """
+    Write every buffered entry. Entries are put back if the insert fails.
+    Returns:
+        None if successful, else Exception
+    """
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                entries, self._buffer = self._buffer, []
+            if not entries:
+                return None
+            try:
+                self.write(entries)
+            except Exception as e:
+                print("ERROR: could not write %s audit log entries: %s" % (len(entries), e))
+                with self._lock:
+                    self._buffer[:0] = entries
+                    overflow = len(self._buffer) - self.max_buffered
+                    if overflow > 0:
+                        del self._buffer[:overflow]
+                        self.dropped += overflow
+                return e
+            self.written += len(entries)
+            self.flushes += 1
+            return None
+
+    def write(self, entries):
+        pool = get_pool()
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as curs:
+                insert_entries(curs, entries, page_size=self.max_entries)
+            conn.commit()
+        finally:
+            pool.putconn(conn)
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def stats(self):
+        return {"pending": self.pending(), "written": self.written, "flushes": self.flushes, "dropped": self.dropped}
+
+
+pending_log = PendingLog()
+audit_log = AuditLogWriter(max_entries=int(os.environ.get("AUDIT_LOG_BATCH", 500)),
+                           flush_interval=float(os.environ.get("AUDIT_LOG_FLUSH_INTERVAL", 2)))
+atexit.register(audit_log.flush)
+
+
+"""
+Drop the entries of a request that ended without committing; the pool rolls its transaction back
+"""
+
+
+def discard_request_entries(exc=None):
+    conn = g.get("pg_conn")
+    if conn is not None:
+        pending_log.discard(conn)
+
+
+def init_app(app):
+    # registered after pgpool.init_app, so it runs before the connection is released
+    app.teardown_appcontext(discard_request_entries)
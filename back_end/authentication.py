@@ -1,34 +1,38 @@
 import datetime
-import re
 import random
 import names
 import sys
 import os
 import json
 import mail
-import smtplib
-import phonenumbers
 
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from flask import current_app as app, g
 from flask import jsonify, request, Response
 from flask_jwt_extended import create_access_token, get_jwt_identity
 from flask_mail import Mail, Message
 from pg.pginstance import PgInstance
-from passlib.hash import bcrypt
-from validate_email import validate_email
+from validation import diner_schema, customer_schema, restaurant_schema, is_password
+from pgpool import release_request_connection
+import hashing
+from hashing import HashingBusy
+from outbox import outbox
 
 jwt_lifespan_minutes = 360
 contact_open_meal = 'Ooops! Something went wrong on our end.  Please contact hello@openmeal.org for assistance.'
+server_busy = 'We are handling a lot of requests right now.  Please try again in a moment.'
 
 
+# bcrypt work is done by the hashing process pool, see hashing.py
 def hash_password(password):
-    return bcrypt.hash(password)
+    return hashing.hash_password(password)
 
 
 def verify_password(password, password_hash):
-    return bcrypt.verify(password, password_hash)
+    return hashing.verify_password(password, password_hash)
+
+
+def hashing_busy():
+    return jsonify({"error": "hashing queue full", "errorMessage": server_busy}), 503
 
 
 def generate_code(length):
@@ -39,47 +43,36 @@ def generate_code(length):
 
 
 def validate_password(password):
-    if re.match(r'[A-Za-z0-9@#$%^&+=]{8,32}', password):
+    if is_password(password):
         return None
     else:
         return "must between 8 and 32 characters and contain alphanumeric characters or @#$%^&+="
 
 def sign_up_diner():
-    name, email, phone, password, image_url = \
-        (request.json[field] for field in ('name', 'email', 'phone', 'password', 'imageURL')) 
-
     # validate data
     # (already done on front end but 2nd level of safety here in case FE/BE mismatch)
-    validation_errors = []
-    if not validate_email(email):  # , verify=True):
-        validation_errors.append("Invalid Email")
-    if len(name) < 1 or len(name) > 72:
-        validation_errors.append("Name must be between 1 and 72 characters")
-    if not phonenumbers.is_valid_number(phonenumbers.parse("+1" + str(phone), None)):
-        validation_errors.append("Invalid phone number")
-    if validate_password(password) != None:
-        validation_errors.append("Invalid password")
-    if not image_url:
-        validation_errors.append("No image provided")
-
+    validation_errors = diner_schema.errors(request.json)
     if len(validation_errors) > 0:
         err = " | ".join(validation_errors)
         return jsonify({"error": err, "errorMessage": err}), 400
-    
+
+    name, email, phone, password, image_url = \
+        (request.json[field] for field in ('name', 'email', 'phone', 'password', 'imageURL'))
+
+    # hash before taking a db connection so it isn't held while bcrypt runs
+    try:
+        password_hash = hash_password(password)
+    except HashingBusy:
+        return hashing_busy()
+
     db = PgInstance()
     err = db.connect()
     if err != None:
         print("ERROR: could not connect to database trying to sign up diner:\n", err)
         return jsonify({"error": err, "errorMessage": contact_open_meal}), 500
 
-    # create Customer
-    err = db.create_customer(email.lower(), name, [phone],hash_password(password))  # by default single phone #, only restaurants should have multiple
-    err_source = "customer"
-
-    if not err:
-        # create Recipient
-        err = status = db.create_recipient(email, image_url)
-        err_source = "recipient"
+    # create Customer and Recipient together, by default single phone #, only restaurants should have multiple
+    err, err_source = db.sign_up("recipient", email.lower(), name, [phone], password_hash, image_url=image_url)
 
     db.disconnect()
     if not err:
@@ -90,20 +83,10 @@ def sign_up_diner():
 
 def sign_up_customer():
     # Create customer
-    errors = {}
-    # email sanitization
-    if not validate_email(request.json["email"]):  # , verify=True):
-        errors["email"] = "must be valid"
-    # name sanitization
-    name = request.json["name"]
-    if len(name) < 1 or len(name) > 72:
-        errors["name"] = "must be between 1 and 72 characters"
-    # phone sanitization
-    phone = request.json["phone"]
-    if not phonenumbers.is_valid_number(phonenumbers.parse("+1" + str(phone), None)):
-        errors["phone"] = "must be valid"
+    errors = customer_schema.errors_by_field(request.json)
     if len(errors) > 0:
         return jsonify(errors), 400
+    phone = request.json["phone"]
 
     db = PgInstance()
     err = db.connect()
@@ -191,40 +174,28 @@ def sign_up_donor():
 
 
 def sign_up_restaurant():
-    restaurant_name, address, name, email, phone = \
-        (request.json[field] for field in ('restaurantName', 'restaurantAddress', 'name', 'email', 'phone'))
-
-    validation_errors = []
-    if len(restaurant_name) < 1 or len(restaurant_name) > 72:
-        validation_errors.append("Restaurant Name must be between 1 and 72 characters")
-    # better address validation?
-    if len(name) < 1 or len(name) > 72:
-        validation_errors.append("Must be a valid US address")
-    if len(name) < 1 or len(name) > 72:
-        validation_errors.append("Name must be between 1 and 72 characters")
-    if not validate_email(email):
-        validation_errors.append("Invalid Email")
-    if not phonenumbers.is_valid_number(phonenumbers.parse("+1" + str(phone), None)):
-        validation_errors.append("Invalid phone number")
-
+    validation_errors = restaurant_schema.errors(request.json)
     if len(validation_errors) > 0:
         err = " | ".join(validation_errors)
         return jsonify({"error": err, "errorMessage": err}), 400
 
+    restaurant_name, address, name, email, phone = \
+        (request.json[field] for field in ('restaurantName', 'restaurantAddress', 'name', 'email', 'phone'))
+
+    try:
+        password_hash = hash_password("password")
+    except HashingBusy:
+        return hashing_busy()
+
     db = PgInstance()
     err = db.connect()
     if err != None:
         print("ERROR: could not connect to database trying to sign up restaurant:\n", err)
         return jsonify({"error": err, "errorMessage": contact_open_meal}), 500
 
-    # create Customer
-    err = db.create_customer(email.lower(), name, [phone], hash_password("password"), False)
-    err_source = "customer"
-
-    if not err:
-        # create Restaurant
-        err = db.create_restaurant(email, address, restaurant_name)
-        err_source = "restaurant"
+    # create Customer and Restaurant together
+    err, err_source = db.sign_up("restaurant", email.lower(), name, [phone], password_hash, False,
+                                 address1=address, restaurant_name=restaurant_name)
 
     db.disconnect()
     if not err:
@@ -234,26 +205,14 @@ def sign_up_restaurant():
 
 
 def send_email(to_addr, subject, body):
-    try:
-        sender = "openmealio@outlook.com"
-        receiver = to_addr if type(to_addr) is list else [to_addr]
-        msg = MIMEMultipart()
-        msg['From'] = sender
-        msg['To'] = ','.join(to_addr) if type(to_addr) is list else to_addr
-        msg['Subject'] = subject
-        message = body
-        msg.attach(MIMEText(message))
-
-        session = smtplib.SMTP('smtp.office365.com', 587)
-        session.ehlo()
-        session.starttls()
-        session.ehlo()
-        session.login(sender, 'Openme@li0')
-        session.sendmail(sender, receiver, msg.as_string())
-        session.quit()
-    except Exception as e:
-        print("Error: %s" % e.__class__)
-        return {"error": str(e.__class__)}
+    # delivered in the background by outbox workers, see outbox.py
+    if not outbox.enabled:
+        print("Error: outbound mail is disabled, SMTP_PASSWORD is not set")
+        return {"error": "mail disabled"}
+    message_id = outbox.send(to_addr, subject, body)
+    if message_id is None:
+        print("Error: outbound mail queue is full")
+        return {"error": "mail queue full"}
     return None
 
 
@@ -301,15 +260,31 @@ def login():
         return jsonify({"error": "incorrect credentials"}), 403
     email = getattr(customer, "email")
     password_hash = getattr(customer, "password")
-    correctPassword = verify_password(request.json["password"], password_hash)
 
     role = db.get_role(email)
     db.disconnect()
+    # give the connection back before verifying; bcrypt takes far longer than the queries
+    release_request_connection()
 
     if role == None:
         print(err)
         return jsonify({"error": "incorrect credentials"}), 403
 
+    try:
+        correctPassword = verify_password(request.json["password"], password_hash)
+    except HashingBusy:
+        return hashing_busy()
+
+    if correctPassword and hashing.needs_rehash(password_hash):
+        # bcrypt cost was changed since this hash was made, upgrade it transparently
+        try:
+            new_hash = hash_password(request.json["password"])
+        except HashingBusy:
+            new_hash = None
+        if new_hash is not None and db.connect() is None:
+            db.update_customer_password(email, new_hash)
+            db.disconnect()
+
     if correctPassword:
         return jsonify({"token": "Bearer " + create_access_token(identity=[email, role],
                                                                  expires_delta=datetime.timedelta(
@@ -0,0 +1,190 @@
+"""
+Concurrency of the sync app (app.py on a thread-per-connection WSGI server) against the async
+app (async_app.py on hypercorn, one event loop) for the routes both serve. Each server runs in
+its own process; at every --concurrency level that many keep-alive clients hit it for
+--duration seconds while its resident memory and thread count are sampled. Needs a seeded
+DATABASE_URL (pg/seed-local-tables.sh) and JWT_SECRET_KEY; Linux only (reads /proc).
+
+    DATABASE_URL=postgresql://localhost/openmeal JWT_SECRET_KEY=... \
+        python -m benchmarks.bench_async --concurrency 10 100 500 --scenario unknown_login
+
+Scenarios: login (one lookup, then bcrypt in the hashing pool) and unknown_login (a single
+customer lookup that misses, so the request is nothing but a database round trip).
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+scenarios = {
+    "login": lambda options: {"email": options.email, "password": options.password},
+    "unknown_login": lambda options: {"email": "nobody@example.com", "password": options.password},
+}
+
+
+def serve(mode, port):
+    if mode == "sync":
+        from werkzeug.serving import WSGIRequestHandler, make_server
+        from app import app
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args):
+                pass
+
+        make_server("127.0.0.1", port, app, threaded=True, request_handler=QuietHandler).serve_forever()
+    else:
+        from hypercorn.asyncio import serve as hypercorn_serve
+        from hypercorn.config import Config
+        from async_app import app
+
+        config = Config()
+        config.bind = ["127.0.0.1:%s" % port]
+        config.accesslog = None
+        config.backlog = 4096
+        asyncio.run(hypercorn_serve(app, config))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit("server on port %s did not start" % port)
+
+
+class ProcessSampler(threading.Thread):
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.peak_threads = 0
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            try:
+                with open("/proc/%s/status" % self.pid) as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            self.peak_rss_kb = max(self.peak_rss_kb, int(line.split()[1]))
+                        elif line.startswith("Threads:"):
+                            self.peak_threads = max(self.peak_threads, int(line.split()[1]))
+            except OSError:
+                return
+
+
+async def client(port, payload, deadline, latencies, statuses):
+    request = ("POST /api/login HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+               "Content-Length: %s\r\n\r\n" % len(payload)).encode() + payload
+    writer = None
+    try:
+        while time.perf_counter() < deadline:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = (await reader.readline()).split()[1].decode()
+            length = 0
+            keep_alive = True
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.partition(b":")
+                name = name.strip().lower()
+                if name == b"content-length":
+                    length = int(value)
+                elif name == b"connection" and value.strip().lower() == b"close":
+                    keep_alive = False
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if not keep_alive:
+                # the sync server answers HTTP/1.0-style, one request per connection
+                writer.close()
+                writer = None
+    except (OSError, IndexError, asyncio.IncompleteReadError):
+        statuses["connection error"] = statuses.get("connection error", 0) + 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def load(port, payload, concurrency, duration):
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*[client(port, payload, deadline, latencies, statuses) for _ in range(concurrency)])
+    return latencies, statuses
+
+
+def run(mode, options):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_async", "--serve", mode, "--port", str(port)],
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        wait_for_port(port)
+        payload = json.dumps(scenarios[options.scenario](options)).encode()
+        asyncio.run(load(port, payload, 4, 1))  # warm up pools and caches
+        for concurrency in options.concurrency:
+            sampler = ProcessSampler(server.pid)
+            sampler.start()
+            start = time.perf_counter()
+            latencies, statuses = asyncio.run(load(port, payload, concurrency, options.duration))
+            elapsed = time.perf_counter() - start
+            sampler.done.set()
+            sampler.join()
+            latencies.sort()
+            pct = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000, 2) \
+                if latencies else None
+            print(json.dumps({
+                "server": mode,
+                "concurrency": concurrency,
+                "requests_per_sec": round(len(latencies) / elapsed, 1),
+                "p50_ms": pct(50),
+                "p99_ms": pct(99),
+                "statuses": statuses,
+                "peak_rss_mb": round(sampler.peak_rss_kb / 1024, 1),
+                "peak_threads": sampler.peak_threads,
+            }))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", choices=("sync", "async"), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--servers", nargs="+", choices=("sync", "async"), default=["sync", "async"])
+    parser.add_argument("--scenario", choices=list(scenarios), default="unknown_login")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--email", default="john.doe@example.com", help="seeded account used to log in")
+    parser.add_argument("--password", default="mYp@55worD")
+    options = parser.parse_args()
+    if options.serve:
+        serve(options.serve, options.port)
+        return
+    for mode in options.servers:
+        run(mode, options)
+
+
+if __name__ == "__main__":
+    main()
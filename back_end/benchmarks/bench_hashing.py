@@ -0,0 +1,64 @@
+"""
+Throughput of the bcrypt hashing pool and login latency under a login storm.
+
+    python -m benchmarks.bench_hashing --rounds 10 11 12 --clients 32 --logins 256
+
+For every bcrypt cost, `clients` threads each verify passwords through hashing.executor,
+as login() does, and we report hashes/sec plus p50/p99 latency seen by a single login.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import hashing
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(rounds, clients, logins):
+    password = "mYp@55worD"
+    password_hash = hashing.hash_password(password, rounds)
+    hashing.verify_password(password, password_hash)  # warm up the worker processes
+
+    def login(_):
+        start = time.perf_counter()
+        try:
+            hashing.verify_password(password, password_hash)
+        except hashing.HashingBusy:
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    latencies = [r for r in results if r is not None]
+    return {
+        "rounds": rounds,
+        "clients": clients,
+        "logins": logins,
+        "rejected": len(results) - len(latencies),
+        "hashes_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--logins", type=int, default=256)
+    args = parser.parse_args()
+    print(json.dumps(hashing.executor.stats()))
+    for rounds in args.rounds:
+        print(json.dumps(run(rounds, args.clients, args.logins)))
+    hashing.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
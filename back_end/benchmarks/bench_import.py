@@ -0,0 +1,57 @@
+"""
+Rows per second loading recipients and menu items with the bulk import methods, against one
+add_menu_item-style insert per row. Needs DATABASE_URL and an existing restaurant; everything
+is rolled back at the end.
+
+    DATABASE_URL=postgresql://localhost/openmeal python -m benchmarks.bench_import --restaurant-id 1 --rows 10000
+"""
+import argparse
+import json
+import time
+import uuid
+
+from pg.pginstance import PgInstance
+
+
+def timed(name, rows, fn):
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    return {"method": name, "rows": rows, "seconds": round(seconds, 3), "rows_per_sec": round(rows / seconds)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--restaurant-id", type=int, required=True)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--per-row", type=int, default=1000, help="rows for the one-insert-per-row baseline")
+    args = parser.parse_args()
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        raise SystemExit(err)
+
+    run = uuid.uuid4().hex[:8]
+    recipients = [(line, "bench-%s-%s@example.com" % (run, line), "Diner %s" % line, "4155551234", None)
+                  for line in range(args.rows)]
+    items = [("Item %s" % i, "bench item", None, "12.50", "Mains") for i in range(args.rows)]
+
+    def per_row():
+        for name, description, image_url, base_cost, category in items[:args.per_row]:
+            db.curs.execute("INSERT INTO menu_item (restaurant_id, name, description, imageUrl, baseCost, "
+                            "category, customizations, available) VALUES (%s, %s, %s, %s, %s, %s, %s, True) RETURNING id",
+                            (args.restaurant_id, name, description, image_url, base_cost, category, []))
+            db.bump_menu_version(args.restaurant_id)
+
+    try:
+        print(json.dumps(timed("import_recipients", args.rows, lambda: db.import_recipients(recipients))))
+        print(json.dumps(timed("import_menu_items", args.rows,
+                               lambda: db.import_menu_items(args.restaurant_id, items))))
+        print(json.dumps(timed("insert per row", args.per_row, per_row)))
+    finally:
+        db.rollback()
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+CPU time per request to build a list response the two PgInstance ways: fetch the rows and
+jsonify them in Python, or have Postgres build the body (fetch_json) and pass it through.
+Needs DATABASE_URL; the rows come from generate_series shaped like a donation_claim row, so no
+table has to be seeded.
+
+    DATABASE_URL=postgresql://localhost/openmeal python -m benchmarks.bench_json --rows 50 --requests 2000
+"""
+import argparse
+import json
+import time
+
+from flask import Flask, jsonify
+
+from jsonprovider import PassThroughJSONProvider
+from pg.pginstance import PgInstance
+
+query = "SELECT g AS id, 1 AS restaurant_id, NULL::int AS feed_item_id, 'diner' || g || '@example.com' AS recipient_email, \
+                '[1, 2, 3]'::json AS meal_items, NULL AS pickup_code, g * 1.5 AS amount, NOW() AS pickup_time, \
+                NOW() AS created, 'America/Los_Angeles' AS timezone, TRUE AS active, FALSE AS verified, NULL AS canceled_by \
+         FROM generate_series(1, %s) g"
+
+
+def run(db, mode, rows, requests):
+    def respond():
+        if mode == "json_agg":
+            return jsonify(db.fetch_json(query, (rows,))).get_data()
+        return jsonify(db.fetch_list(query, (rows,))).get_data()
+
+    respond()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(requests):
+        body = respond()
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    return {
+        "mode": mode,
+        "rows": rows,
+        "requests": requests,
+        "cpu_us_per_request": round(cpu / requests * 1e6),
+        "wall_us_per_request": round(wall / requests * 1e6),
+        "body_bytes": len(body),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    app = Flask(__name__)
+    app.json = PassThroughJSONProvider(app)
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        raise SystemExit(err)
+    with app.app_context():
+        for mode in ("python", "json_agg"):
+            print(json.dumps(run(db, mode, args.rows, args.requests)))
+    db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Per-request cost of the parse_jwt middleware with and without the decoded-token cache.
+
+    python -m benchmarks.bench_jwt --requests 5000
+
+Runs the same before_request hook as app.py on a bare Flask app, so the difference between
+the two runs is the signature verification that token_cache saves.
+"""
+import argparse
+import datetime
+import json
+import time
+
+from flask import Flask, g, request
+from flask_jwt_extended import JWTManager, create_access_token, decode_token
+
+import jwtcache
+
+
+def make_app(decode):
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "benchmark-secret-key-of-at-least-32-bytes"
+    JWTManager(app)
+
+    @app.before_request
+    def parse_jwt():
+        try:
+            g.login_info = decode(request.headers["AUTH_TOKEN"][7:])
+            g.logged_in = True
+        except Exception:
+            g.logged_in = False
+
+    @app.route("/ping")
+    def ping():
+        return "", 204
+
+    return app
+
+
+def run(name, decode, requests):
+    app = make_app(decode)
+    with app.app_context():
+        token = create_access_token(identity="john.doe@example.com",
+                                    expires_delta=datetime.timedelta(minutes=360))
+    client = app.test_client()
+    headers = {"AUTH_TOKEN": "Bearer " + token}
+    client.get("/ping", headers=headers)
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get("/ping", headers=headers)
+    elapsed = time.perf_counter() - start
+    return {"mode": name, "requests": requests, "us_per_request": round(elapsed / requests * 1e6, 1),
+            "requests_per_sec": round(requests / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps(run("uncached", decode_token, args.requests)))
+    print(json.dumps(run("cached", jwtcache.decode_cached, args.requests)))
+    print(json.dumps(jwtcache.token_cache.stats()))
+
+
+if __name__ == "__main__":
+    main()
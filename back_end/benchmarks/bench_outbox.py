@@ -0,0 +1,74 @@
+"""
+Outbound mail throughput and queue latency against a local SMTP stand-in.
+
+    python -m benchmarks.bench_outbox --messages 2000 --workers 1 2 4 --delay 0.002
+
+Compares the outbox (persistent sessions, batched) with the old one-connection-per-email
+send for the same number of messages.
+"""
+import argparse
+import json
+import smtplib
+import time
+from functools import partial
+
+from outbox import Outbox, OutboundMessage, SmtpSession
+from benchmarks.smtp_standin import SmtpStandIn
+
+
+def run_outbox(messages, workers, delay):
+    with SmtpStandIn(delay) as server:
+        box = Outbox(workers=workers, max_queue=messages,
+                     session_factory=partial(SmtpSession, "127.0.0.1", server.port, starttls=False, password=None))
+        start = time.perf_counter()
+        for n in range(messages):
+            box.send("diner%s@example.com" % n, "Welcome to OpenMeal!", "Your one-time password is: x")
+        enqueued = time.perf_counter() - start
+        box.join()
+        elapsed = time.perf_counter() - start
+        box.stop()
+        stats = box.stats()
+        return {
+            "mode": "outbox",
+            "workers": workers,
+            "messages": len(server.messages),
+            "smtp_sessions": server.sessions,
+            "enqueue_us_per_msg": round(enqueued / messages * 1e6, 1),
+            "msgs_per_sec": round(messages / elapsed, 1),
+            "avg_queue_latency_ms": round(stats["avg_queue_latency"] * 1000, 1),
+            "max_queue_latency_ms": round(stats["max_queue_latency"] * 1000, 1),
+        }
+
+
+def run_per_message(messages, delay):
+    with SmtpStandIn(delay) as server:
+        start = time.perf_counter()
+        for n in range(messages):
+            message = OutboundMessage(n, "diner%s@example.com" % n, "Welcome to OpenMeal!", "x")
+            session = smtplib.SMTP("127.0.0.1", server.port)
+            session.ehlo()
+            session.sendmail("openmealio@outlook.com", message.receivers(), message.as_string("openmealio@outlook.com"))
+            session.quit()
+        elapsed = time.perf_counter() - start
+        return {
+            "mode": "connection per message",
+            "messages": len(server.messages),
+            "smtp_sessions": server.sessions,
+            "msgs_per_sec": round(messages / elapsed, 1),
+            "request_blocked_ms_per_msg": round(elapsed / messages * 1000, 2),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--delay", type=float, default=0.0)
+    args = parser.parse_args()
+    print(json.dumps(run_per_message(args.messages, args.delay)))
+    for workers in args.workers:
+        print(json.dumps(run_outbox(args.messages, workers, args.delay)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Per-query latency of the hot PgInstance lookups with and without server-side prepared
+statements. Needs DATABASE_URL; looks up rows that the seed data is expected to contain but
+works (timing empty results) when it doesn't.
+
+    DATABASE_URL=postgresql://localhost/openmeal python -m benchmarks.bench_prepared --iterations 5000
+"""
+import argparse
+import json
+import time
+
+from pg.pginstance import PgInstance
+
+
+def lookups(db, email):
+    return {
+        "get_customer_by_email": lambda: db.get_customer_by_email(email),
+        "get_recipient_by_email": lambda: db.get_recipient_by_email(email),
+        "get_restaurant_by_email": lambda: db.get_restaurant_by_email(email),
+        "verify_otp": lambda: db.verify_otp(email, "JohnDoe"),
+    }
+
+
+def run(use_prepared, iterations, email):
+    PgInstance.use_prepared = use_prepared
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        raise SystemExit(err)
+    results = {}
+    for name, lookup in lookups(db, email).items():
+        lookup()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            lookup()
+        results[name] = round((time.perf_counter() - start) / iterations * 1e6, 1)
+    db.disconnect()
+    return {"prepared": use_prepared, "us_per_query": results}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--email", default="john.doe@example.com")
+    args = parser.parse_args()
+    for use_prepared in (False, True):
+        print(json.dumps(run(use_prepared, args.iterations, args.email)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Time and peak Python memory to fetch and JSON-encode N rows with each PgInstance row mode.
+Needs DATABASE_URL; the rows come from generate_series shaped like a logger/recipient row,
+so no table has to be seeded.
+
+    DATABASE_URL=postgresql://localhost/openmeal python -m benchmarks.bench_rows --rows 100000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from flask import Flask
+
+from pg.pginstance import PgInstance
+
+query = "SELECT g AS id, 'diner' || g || '@example.com' AS email, NOW() AS time, \
+                'cancel' AS category, 'cancel #' || g AS message, g * 1.5 AS credits \
+         FROM generate_series(1, %s) g"
+
+
+def run(db, row_mode, rows, dumps):
+    start = time.perf_counter()
+    result = db.fetch_list(query, (rows,), row_mode=row_mode)
+    fetched = time.perf_counter() - start
+    body = dumps(result)
+    encoded = time.perf_counter() - start - fetched
+    del result
+
+    # second pass for memory, tracemalloc slows allocation down too much to time the first
+    tracemalloc.start()
+    db.fetch_list(query, (rows,), row_mode=row_mode)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "row_mode": row_mode,
+        "rows": rows,
+        "fetch_ms": round(fetched * 1000, 1),
+        "encode_ms": round(encoded * 1000, 1),
+        "rows_per_sec": round(rows / fetched),
+        "peak_mb": round(peak / 2 ** 20, 1),
+        "body_mb": round(len(body) / 2 ** 20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+    app = Flask(__name__)
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        raise SystemExit(err)
+    db.fetch_list(query, (1000,))
+    with app.app_context():
+        for row_mode in PgInstance.row_cursor_factories:
+            print(json.dumps(run(db, row_mode, args.rows, app.json.dumps)))
+    db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Time to turn list payloads shaped like the recipient, logger, feed and restaurant listings into
+a response body with each JSON provider, and the size and time of compressing it with each
+encoding (brotli only when installed). Rows are built in memory, no database is needed.
+
+    python -m benchmarks.bench_serialize --rows 5000
+"""
+import argparse
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from flask import Flask
+
+import compression
+from jsonprovider import FastJSONProvider, PassThroughJSONProvider, orjson
+
+Recipient = namedtuple("Recipient", "id email first_name last_name phone_number credits approved created")
+Logger = namedtuple("Logger", "id email time category message")
+FeedItem = namedtuple("FeedItem", "id restaurant_id recipient_email message amount created")
+Restaurant = namedtuple("Restaurant", "id name address city state zip phone_number description")
+
+start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def payloads(rows):
+    return {
+        "recipients": [Recipient(i, "recipient%s@example.com" % i, "First%s" % i, "Last%s" % i,
+                                 ["415555%04d" % (i % 10000)], Decimal("%s.50" % (i % 40)), i % 3 != 0,
+                                 start + timedelta(minutes=i)) for i in range(rows)],
+        "logger": [Logger(i, "diner%s@example.com" % i, start + timedelta(seconds=i), "cancel",
+                          "canceled donation claim #%s" % i) for i in range(rows)],
+        "feed": [FeedItem(i, i % 50, "recipient%s@example.com" % i, "Thanks for the meal! #%s" % i,
+                          Decimal("12.50"), start + timedelta(minutes=i)) for i in range(rows)],
+        "restaurants": [Restaurant(i, "Restaurant %s" % i, "%s Main St" % i, "San Francisco", "CA",
+                                   "94103", "415555%04d" % i, "Family-run kitchen serving dinner")
+                        for i in range(rows)],
+    }
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start_time)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    app = Flask(__name__)
+    providers = {"json": PassThroughJSONProvider(app)}
+    if orjson is not None:
+        providers["orjson"] = FastJSONProvider(app)
+
+    with app.app_context():
+        for name, payload in payloads(args.rows).items():
+            result = {"payload": name, "rows": args.rows}
+            body = None
+            for provider_name, provider in providers.items():
+                seconds, response = best_of(args.repeat, lambda: provider.response(payload))
+                body = response.get_data()
+                result[provider_name + "_ms"] = round(seconds * 1000, 2)
+            result["body_kb"] = round(len(body) / 1024, 1)
+            for encoding in compression.offered_encodings():
+                seconds, compressed = best_of(args.repeat, lambda: compression.compress(body, encoding))
+                result[encoding + "_ms"] = round(seconds * 1000, 2)
+                result[encoding + "_kb"] = round(len(compressed) / 1024, 1)
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
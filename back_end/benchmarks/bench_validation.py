@@ -0,0 +1,45 @@
+"""
+Sign-up payloads validated per second by the shared schemas, without any database work.
+
+    python -m benchmarks.bench_validation --payloads 20000
+"""
+import argparse
+import json
+import random
+import time
+
+from validation import diner_schema, restaurant_schema
+
+
+def payloads(count):
+    for n in range(count):
+        yield {
+            "name": "Diner %s" % n,
+            "email": "diner%s@example.com" % n if n % 10 else "diner%s" % n,
+            # the same few hundred numbers keep coming back, as real sign-ups retry
+            "phone": "415555%04d" % random.randrange(300),
+            "password": "mYp@55worD",
+            "imageURL": "https://picsum.photos/seed/picsum/200/300",
+            "restaurantName": "Kitchen %s" % n,
+            "restaurantAddress": "%s Market St" % n,
+        }
+
+
+def run(name, schema, count):
+    bodies = list(payloads(count))
+    start = time.perf_counter()
+    failed = sum(1 for body in bodies if schema.errors(body))
+    elapsed = time.perf_counter() - start
+    return {"schema": name, "payloads": count, "invalid": failed, "per_sec": round(count / elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payloads", type=int, default=20000)
+    args = parser.parse_args()
+    print(json.dumps(run("diner", diner_schema, args.payloads)))
+    print(json.dumps(run("restaurant", restaurant_schema, args.payloads)))
+
+
+if __name__ == "__main__":
+    main()
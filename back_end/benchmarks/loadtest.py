@@ -0,0 +1,244 @@
+"""
+HTTP load test of the real Flask app against a local, seeded Postgres (pg/seed-local-tables.sh).
+
+    DATABASE_URL=postgresql://localhost/openmeal JWT_SECRET_KEY=... \
+        python -m benchmarks.loadtest --transport wsgi --concurrency 8 --iterations 200
+    python -m benchmarks.loadtest --compare results/old.json results/new.json
+
+Each scenario is run by `concurrency` threads, `iterations` times each, either through
+app.test_client() (--transport client) or over HTTP to a threaded WSGI server started in this
+process (--transport wsgi). Per scenario it reports requests/sec, p50/p95/p99 latency, status
+codes and db queries per request (read from the Server-Timing header, so SERVER_TIMING is
+turned on), and writes everything to a JSON file named after the current commit.
+"""
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["SERVER_TIMING"] = "1"
+
+server_timing_queries = re.compile(r'db;dur=[0-9.]+;desc="(\d+) queries"')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else None
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.queries = 0
+
+    def add(self, seconds, status, server_timing):
+        match = server_timing_queries.search(server_timing or "")
+        with self.lock:
+            self.latencies.append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.queries += int(match.group(1)) if match else 0
+
+
+class ClientSession:
+    def __init__(self, app, recorder):
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.token = None
+
+    def request(self, method, path, body=None):
+        headers = {"AUTH_TOKEN": self.token} if self.token else {}
+        start = time.perf_counter()
+        res = self.client.open(path, method=method, json=body, headers=headers)
+        self.recorder.add(time.perf_counter() - start, res.status_code, ", ".join(res.headers.getlist("Server-Timing")))
+        return res.status_code, res.get_json(silent=True)
+
+
+class HttpSession:
+    def __init__(self, port, recorder):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port)
+        self.recorder = recorder
+        self.token = None
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["AUTH_TOKEN"] = self.token
+        start = time.perf_counter()
+        self.conn.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+        res = self.conn.getresponse()
+        data = res.read()
+        self.recorder.add(time.perf_counter() - start, res.status, ", ".join(res.headers.get_all("Server-Timing") or ()))
+        try:
+            return res.status, json.loads(data)
+        except ValueError:
+            return res.status, None
+
+
+'scenarios: each makes one iteration of requests through session'
+
+sequence = itertools.count()
+
+
+def login(session, options):
+    status, body = session.request("POST", "/api/login", {"email": options.email, "password": options.password})
+    if status == 200:
+        session.token = body["token"]
+
+
+def signup_diner(session, options):
+    session.request("POST", "/api/signup/diner", {
+        "name": "Load Test",
+        "email": "loadtest-%s-%s@example.com" % (options.run_id, next(sequence)),
+        "phone": "4155551234",
+        "password": "mYp@55worD",
+        "imageURL": "https://picsum.photos/seed/picsum/200/300",
+    })
+
+
+def metric(session, options):
+    session.request("GET", "/api/metric")
+
+
+def restaurants(session, options):
+    session.request("GET", "/api/restaurant")
+
+
+def order_flow(session, options):
+    if session.token is None:
+        login(session, options)
+    status, listing = session.request("GET", "/api/restaurant")
+    if status != 200 or not listing:
+        return
+    restaurant_id = options.restaurant_id or listing[0][0]
+    status, menu = session.request("GET", "/api/menu/%s" % restaurant_id)
+    if status != 200 or not menu:
+        return
+    body = dict(json.loads(options.order_body), meal_items=[menu[0][0]])
+    session.request("POST", "/api/restaurant/%s/order" % restaurant_id, body)
+
+
+scenarios = {
+    "login": login,
+    "signup_diner": signup_diner,
+    "metric": metric,
+    "restaurant": restaurants,
+    "order_flow": order_flow,
+}
+
+
+def run_scenario(name, make_session, options):
+    recorder = Recorder()
+
+    def worker(_):
+        session = make_session(recorder)
+        for _ in range(options.iterations):
+            scenarios[name](session, options)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as pool:
+        list(pool.map(worker, range(options.concurrency)))
+    elapsed = time.perf_counter() - start
+    requests = len(recorder.latencies)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 2)
+    return {
+        "requests": requests,
+        "requests_per_sec": round(requests / elapsed, 1),
+        "p50_ms": ms(percentile(recorder.latencies, 50)),
+        "p95_ms": ms(percentile(recorder.latencies, 95)),
+        "p99_ms": ms(percentile(recorder.latencies, 99)),
+        "statuses": {str(status): n for status, n in sorted(recorder.statuses.items())},
+        "db_queries_per_request": round(recorder.queries / requests, 2) if requests else None,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print("%-14s %-18s %12s %12s %8s" % ("scenario", "metric", old["commit"], new["commit"], "change"))
+    for name, result in new["scenarios"].items():
+        before = old["scenarios"].get(name)
+        if before is None:
+            continue
+        for key in ("requests_per_sec", "p50_ms", "p95_ms", "p99_ms", "db_queries_per_request"):
+            if before[key] and result[key] is not None:
+                print("%-14s %-18s %12s %12s %+7.1f%%" % (
+                    name, key, before[key], result[key], (result[key] - before[key]) / before[key] * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transport", choices=("client", "wsgi"), default="client")
+    parser.add_argument("--scenarios", nargs="+", default=list(scenarios), choices=list(scenarios))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--email", default="john.doe@example.com", help="seeded account used to log in")
+    parser.add_argument("--password", default="mYp@55worD")
+    parser.add_argument("--restaurant-id", help="restaurant to order from, default the first listed")
+    parser.add_argument("--order-body", default='{"pickup_time": "12:00", "timezone": "America/Los_Angeles"}',
+                        help="JSON fields sent with each order besides meal_items")
+    parser.add_argument("--out", help="result file, default benchmarks/results/<time>-<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    options = parser.parse_args()
+    if options.compare:
+        compare(*options.compare)
+        return
+
+    from app import app
+    options.run_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    server = None
+    if options.transport == "wsgi":
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args):
+                pass
+
+        server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        make_session = lambda recorder: HttpSession(server.server_port, recorder)
+    else:
+        make_session = lambda recorder: ClientSession(app, recorder)
+
+    commit = current_commit()
+    results = {
+        "commit": commit,
+        "time": options.run_id,
+        "transport": options.transport,
+        "concurrency": options.concurrency,
+        "iterations": options.iterations,
+        "scenarios": {},
+    }
+    for name in options.scenarios:
+        results["scenarios"][name] = run_scenario(name, make_session, options)
+        print(name, json.dumps(results["scenarios"][name]))
+    if server is not None:
+        server.shutdown()
+
+    out = options.out or os.path.join(os.path.dirname(__file__), "results", "%s-%s.json" % (options.run_id, commit))
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("saved", out)
+
+
+if __name__ == "__main__":
+    main()
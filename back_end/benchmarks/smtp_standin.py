@@ -0,0 +1,79 @@
+"""
+Minimal local SMTP server for exercising outbox.py without a real mail provider.
+Speaks just enough SMTP (EHLO/HELO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT) and
+keeps every accepted message in `messages`. Any password is accepted once `failing_logins`
+logins have been refused. No STARTTLS, so pair it with SmtpSession(starttls=False).
+"""
+import socketserver
+import threading
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        server = self.server
+        self.reply("220 standin ready")
+        server.sessions += 1
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250-standin")
+                self.reply("250 AUTH PLAIN")
+            elif command.startswith("AUTH"):
+                with server.lock:
+                    refused = server.failing_logins > 0
+                    server.failing_logins -= refused
+                    server.logins += not refused
+                self.reply("535 authentication failed" if refused else "235 authenticated")
+            elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                data = []
+                for raw in self.rfile:
+                    if raw in (b".\r\n", b".\n"):
+                        break
+                    data.append(raw)
+                if server.delay:
+                    server.delay_event.wait(server.delay)
+                with server.lock:
+                    server.messages.append(b"".join(data))
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay=0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        # seconds to stall on each DATA, to imitate a slow remote server
+        self.delay = delay
+        self.delay_event = threading.Event()
+        self.lock = threading.Lock()
+        self.messages = []
+        self.sessions = 0
+        self.logins = 0
+        self.failing_logins = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
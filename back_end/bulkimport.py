@@ -0,0 +1,207 @@
+import csv
+import io
+import os
+import time
+
+from flask import current_app, jsonify, request
+from monitoring import is_admin
+from pg.pginstance import PgInstance
+from validation import recipient_import_schema, menu_item_import_schema
+
+# Admin bulk imports. The body is CSV with a header row (text/csv) or one JSON object per line
+# (application/x-ndjson), with the field names of the import schemas in validation.py. Rows
+# are validated as they are read; the valid ones are written in one transaction and the others
+# reported by line number, so a file can be corrected and the rejected lines sent again.
+
+import_max_rows = int(os.environ.get("IMPORT_MAX_ROWS", 100000))
+# errors listed in the response; all of them are counted in "rejected"
+import_max_errors = int(os.environ.get("IMPORT_MAX_ERRORS", 100))
+ndjson_types = ("application/x-ndjson", "application/jsonl")
+
+
+class TooManyRows(Exception):
+    pass
+
+
+class BadBody(Exception):
+    def __init__(self, line, message):
+        super().__init__("line %s: %s" % (line, message))
+        self.line = line
+
+
+"""
+Yields:
+    each line of the request body, decoded as UTF-8
+"""
+
+
+def body_lines():
+    stream = io.BufferedReader(request.stream)
+    try:
+        for line, data in enumerate(stream, 1):
+            try:
+                # utf-8-sig: spreadsheet exports often start with a byte order mark
+                yield data.decode("utf-8-sig" if line == 1 else "utf-8")
+            except UnicodeDecodeError:
+                raise BadBody(line, "is not valid UTF-8")
+    finally:
+        stream.detach()  # leave the request stream open for the server
+
+
+"""
+Yields:
+    (line number, dict of fields or None if the line isn't a JSON object) per record of the body,
+    raises BadBody for a body that can't be read
+"""
+
+
+def read_rows():
+    if request.mimetype == "text/csv":
+        # strict: a stray quote is reported instead of silently merging fields
+        reader = csv.DictReader(body_lines(), strict=True)
+        try:
+            for record in reader:
+                yield reader.line_num, record
+        except csv.Error as e:
+            raise BadBody(reader.reader.line_num, "is not valid CSV (%s)" % e)
+        return
+    loads = current_app.json.loads
+    for line, record_text in enumerate(body_lines(), 1):
+        if not record_text.strip():
+            continue
+        try:
+            record = loads(record_text)
+        except ValueError:
+            record = None
+        yield line, record if isinstance(record, dict) else None
+
+
+"""
+Validate every record of the body against schema, converting the valid ones with to_row.
+Records whose unique(record) was already seen in the body are rejected.
+Returns:
+    (valid rows as (line, row), errors as (line, {field: message}))
+"""
+
+
+def validate_rows(schema, to_row, unique=None):
+    rows, errors, seen = [], [], set()
+    for count, (line, record) in enumerate(read_rows(), 1):
+        if count > import_max_rows:
+            raise TooManyRows("at most %s rows can be imported at once" % import_max_rows)
+        if record == None:
+            errors.append((line, {"row": "must be a JSON object"}))
+            continue
+        problems = schema.errors_by_field(record)
+        if not problems and unique != None:
+            key = unique(record)
+            if key in seen:
+                problems = {"row": "repeats an earlier row"}
+            seen.add(key)
+        if problems:
+            errors.append((line, problems))
+        else:
+            rows.append((line, to_row(record)))
+    return rows, errors
+
+
+def import_report(imported, errors, start):
+    seconds = time.perf_counter() - start
+    errors.sort(key=lambda error: error[0])
+    return jsonify({
+        "imported": imported,
+        "rejected": len(errors),
+        "errors": [{"line": line, "errors": problems} for line, problems in errors[:import_max_errors]],
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round((imported + len(errors)) / seconds) if seconds else None,
+    }), 200
+
+
+def check_request():
+    if not is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    if request.mimetype != "text/csv" and request.mimetype not in ndjson_types:
+        return jsonify({"error": "send text/csv or application/x-ndjson"}), 415
+    return None
+
+
+def blank_to_none(value):
+    return None if value == "" else value
+
+
+def recipient_row(record):
+    return (record["email"].lower(), record["name"], str(record["phone"]), blank_to_none(record.get("imageURL")))
+
+
+def import_recipients():
+    refused = check_request()
+    if refused != None:
+        return refused
+    start = time.perf_counter()
+    try:
+        rows, errors = validate_rows(recipient_import_schema, recipient_row,
+                                     unique=lambda record: record["email"].lower())
+    except TooManyRows as e:
+        return jsonify({"error": str(e)}), 413
+    except BadBody as e:
+        return jsonify({"error": str(e), "line": e.line}), 400
+
+    imported = 0
+    if rows:
+        db = PgInstance()
+        err = db.connect()
+        if err != None:
+            print(err)
+            return jsonify({"error": "could not connect to database"}), 500
+        try:
+            imported, taken_lines = db.import_recipients([(line,) + row for line, row in rows])
+        except Exception as e:
+            db.rollback()
+            db.disconnect()
+            print("ERROR: import failed: %s" % e)
+            return jsonify({"error": "import failed, nothing was imported"}), 500
+        db.disconnect()
+        errors.extend((line, {"email": "is already registered"}) for line in taken_lines)
+    return import_report(imported, errors, start)
+
+
+def menu_item_row(record):
+    return (record["name"], blank_to_none(record.get("description")), blank_to_none(record.get("imageUrl")),
+            str(record["baseCost"]), blank_to_none(record.get("category")))
+
+
+def import_menu_items(restaurant_id):
+    refused = check_request()
+    if refused != None:
+        return refused
+    try:
+        restaurant_id = int(restaurant_id)
+    except ValueError:
+        return jsonify({"error": "restaurant id must be an integer"}), 400
+    start = time.perf_counter()
+    try:
+        rows, errors = validate_rows(menu_item_import_schema, menu_item_row)
+    except TooManyRows as e:
+        return jsonify({"error": str(e)}), 413
+    except BadBody as e:
+        return jsonify({"error": str(e), "line": e.line}), 400
+
+    db = PgInstance()
+    err = db.connect()
+    if err != None:
+        print(err)
+        return jsonify({"error": "could not connect to database"}), 500
+    if db.get_restaurant(restaurant_id) == None:
+        db.disconnect()
+        return jsonify({"error": "no such restaurant"}), 404
+    imported = 0
+    if rows:
+        try:
+            imported = db.import_menu_items(restaurant_id, [row for line, row in rows])
+        except Exception as e:
+            db.rollback()
+            db.disconnect()
+            print("ERROR: import failed: %s" % e)
+            return jsonify({"error": "import failed, nothing was imported"}), 500
+    db.disconnect()
+    return import_report(imported, errors, start)
@@ -0,0 +1,135 @@
+import os
+import zlib
+
+from flask import request
+
+from ttlcache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compresses text responses for clients that accept it, brotli preferred over gzip as the
+# Accept-Encoding weights allow. Bodies smaller than COMPRESS_MIN_SIZE are sent as is; streamed
+# bodies are compressed chunk by chunk as they are sent. Levels are kept low enough for
+# compressing on every request rather than once ahead of time. Responses that carry a strong
+# ETag (the cached directory and menu pages) always have the same body for that ETag, so their
+# compressed bodies are kept per (ETag, encoding) and compressed once.
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 4))
+
+# (ETag, encoding) -> compressed body
+compressed_bodies = TTLCache(maxsize=int(os.environ.get("COMPRESS_CACHE_SIZE", 256)),
+                             ttl=float(os.environ.get("COMPRESS_CACHE_TTL", 3600)))
+
+compressible_types = {"application/json", "text/html", "text/plain", "text/csv", "text/css",
+                      "application/javascript"}
+
+
+class CompressionStats:
+    def __init__(self):
+        self.responses = 0
+        self.streamed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # responses whose compressed body came from compressed_bodies
+        self.cached = 0
+
+    def as_dict(self):
+        return {
+            "responses": self.responses,
+            "streamed": self.streamed,
+            "cached": self.cached,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+        }
+
+
+compression_stats = CompressionStats()
+
+
+def offered_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+"""
+Returns:
+    (compress, finish) functions of a new compressor for encoding
+"""
+
+
+def compressor(encoding):
+    if encoding == "br":
+        c = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        return c.process, c.finish
+    c = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress, c.flush
+
+
+def compress(data, encoding):
+    process, finish = compressor(encoding)
+    return process(data) + finish()
+
+
+def compress_chunks(chunks, source, encoding):
+    process, finish = compressor(encoding)
+    try:
+        for chunk in chunks:
+            compression_stats.bytes_in += len(chunk)
+            data = process(chunk)
+            if data:
+                compression_stats.bytes_out += len(data)
+                yield data
+        data = finish()
+        compression_stats.bytes_out += len(data)
+        yield data
+    finally:
+        # the server closes our generator, which must close the view's (releasing its connection)
+        if hasattr(source, "close"):
+            source.close()
+
+
+def compress_response(response):
+    if response.mimetype not in compressible_types or response.direct_passthrough \
+            or response.status_code < 200 or response.status_code in (204, 304) \
+            or "Content-Encoding" in response.headers or request.method == "HEAD":
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(offered_encodings())
+    if encoding == None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.iter_encoded(), response.response, encoding)
+        response.headers.pop("Content-Length", None)
+        compression_stats.streamed += 1
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        etag, weak = response.get_etag()
+        body = compressed_bodies.get((etag, encoding)) if etag != None and not weak else None
+        if body is not None:
+            compression_stats.cached += 1
+        else:
+            body = compress(data, encoding)
+            if etag != None and not weak:
+                compressed_bodies.set((etag, encoding), body)
+        response.set_data(body)
+        compression_stats.bytes_in += len(data)
+        compression_stats.bytes_out += len(body)
+    compression_stats.responses += 1
+    response.headers["Content-Encoding"] = encoding
+    # the compressed body is a different representation of the same resource
+    etag, weak = response.get_etag()
+    if etag != None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
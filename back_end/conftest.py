@@ -0,0 +1,175 @@
+import hashlib
+import os
+import subprocess
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import pgpool
+
+# Database fixtures for the tests that talk to Postgres (test_diner.py). The seed script runs
+# once into a template database, shared by every pytest-xdist worker and reused between runs
+# until anything under pg/ changes; each worker clones it into its own database, and each test
+# runs inside a transaction on one connection that is rolled back afterwards.
+#
+#     TEST_DATABASE_URL=postgresql://localhost/openmeal python -m pytest -n auto
+
+seed_script = os.environ.get("TEST_SEED_SCRIPT", "pg/seed-local-tables.sh")
+# any session-level key, so workers seeding the same template wait for each other
+template_lock_key = 4242017
+
+
+def server_dsn():
+    return os.environ.get("TEST_DATABASE_URL") or os.environ["DATABASE_URL"]
+
+
+def database_dsn(name):
+    return psycopg2.extensions.make_dsn(server_dsn(), dbname=name)
+
+
+def seed_fingerprint():
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(os.path.dirname(seed_script) or "."):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as f:
+                digest.update(name.encode() + f.read())
+    return digest.hexdigest()
+
+
+class TestConnection(psycopg2.extensions.connection):
+    """
+    Connection that never ends the transaction the test runs in: commit() moves a savepoint
+    forward and rollback() goes back to it, so code under test behaves as usual and
+    end_test() throws all of it away.
+    """
+
+    def begin_test(self):
+        with self.cursor() as curs:
+            curs.execute("SAVEPOINT test_commit")
+
+    def commit(self):
+        if self.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            # like COMMIT of a failed transaction, which rolls it back
+            return self.rollback()
+        with self.cursor() as curs:
+            curs.execute("RELEASE SAVEPOINT test_commit; SAVEPOINT test_commit")
+
+    def rollback(self):
+        with self.cursor() as curs:
+            curs.execute("ROLLBACK TO SAVEPOINT test_commit")
+
+    def close(self):
+        pass
+
+    def end_test(self):
+        super().rollback()
+
+
+class TestPool:
+    """
+    Stands in for pgpool.PgPool during tests, handing the same connection to every borrower
+    """
+
+    __test__ = False
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.checkouts = 0
+        self.returns = 0
+        self.discards = 0
+
+    def getconn(self, timeout=None):
+        self.checkouts += 1
+        return self.conn
+
+    def putconn(self, conn, discard=False):
+        self.returns += 1
+        if discard:
+            self.discards += 1  # the shared connection stays open for the next test
+            return
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+
+    def closeall(self):
+        pass
+
+    def stats(self):
+        in_use = self.checkouts - self.returns
+        return {"max_size": 1, "size": 1, "in_use": in_use, "idle": 1 - in_use, "checkouts": self.checkouts,
+                "discards": self.discards}
+
+
+@pytest.fixture(scope="session")
+def template_database():
+    base = psycopg2.extensions.parse_dsn(server_dsn()).get("dbname", "openmeal")
+    template = base + "_test_template"
+    fingerprint = seed_fingerprint()
+    admin = psycopg2.connect(database_dsn("postgres"))
+    admin.autocommit = True
+    try:
+        with admin.cursor() as curs:
+            curs.execute("SELECT pg_advisory_lock(%s)", (template_lock_key,))
+            curs.execute("SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = %s",
+                         (template,))
+            row = curs.fetchone()
+            if row == None or row[0] != fingerprint:
+                curs.execute("DROP DATABASE IF EXISTS %s" % template)
+                curs.execute("CREATE DATABASE %s" % template)
+                subprocess.run(['sh', seed_script], check=True,
+                               env=dict(os.environ, DATABASE_URL=database_dsn(template), PGDATABASE=template))
+                curs.execute("COMMENT ON DATABASE %s IS %%s" % template, (fingerprint,))
+            curs.execute("SELECT pg_advisory_unlock(%s)", (template_lock_key,))
+    finally:
+        admin.close()
+    return template
+
+
+@pytest.fixture(scope="session")
+def worker_database(template_database):
+    name = "%s_%s" % (template_database[:-len("_template")], os.environ.get("PYTEST_XDIST_WORKER", "main"))
+    admin = psycopg2.connect(database_dsn("postgres"))
+    admin.autocommit = True
+    with admin.cursor() as curs:
+        curs.execute("DROP DATABASE IF EXISTS %s" % name)
+        curs.execute("SELECT pg_advisory_lock(%s)", (template_lock_key,))
+        try:
+            curs.execute("CREATE DATABASE %s TEMPLATE %s" % (name, template_database))
+        finally:
+            curs.execute("SELECT pg_advisory_unlock(%s)", (template_lock_key,))
+    conn = psycopg2.connect(database_dsn(name), connection_factory=TestConnection)
+    saved_pool, pgpool._pool = pgpool._pool, TestPool(conn)
+    # reads stay on the test's connection, inside its transaction
+    saved_replica, pgpool.replica_url, pgpool._replica_pool = pgpool.replica_url, None, None
+    yield conn
+    pgpool._pool = saved_pool
+    pgpool.replica_url = saved_replica
+    psycopg2.extensions.connection.close(conn)
+    with admin.cursor() as curs:
+        curs.execute("DROP DATABASE IF EXISTS %s" % name)
+    admin.close()
+
+
+@pytest.fixture
+def db_transaction(worker_database):
+    from auditlog import audit_log
+    from pg.pginstance import menu_versions, metrics_cache, role_cache
+    from jwtcache import token_cache
+    from menucache import menu_pages
+    from directory import restaurant_directory
+
+    # caches would otherwise carry rows from one test's rolled-back transaction into the next
+    role_cache.clear()
+    token_cache.clear()
+    menu_versions.clear()
+    menu_pages.clear()
+    metrics_cache.invalidate()
+    # its invalidations are NOTIFYs, which a rolled-back test transaction never delivers
+    restaurant_directory.enabled = False
+    saved_interval, audit_log.flush_interval = audit_log.flush_interval, 0
+    worker_database.begin_test()
+    yield worker_database
+    audit_log.flush()
+    worker_database.end_test()
+    audit_log.flush_interval = saved_interval
@@ -0,0 +1,71 @@
+import os
+import time
+
+# Weekly reset of recipient credits, done in bounded id ranges that are committed one at a time
+# so ordering isn't locked out while it runs. The last committed id is checkpointed in
+# job_progress within the same transaction as the range, so an interrupted run picks up where
+# it stopped the next time it is started. Checkpoints carry the refresh cycle (refresh_interval
+# slots counted from the epoch, like the scheduler's) and only a run in the same cycle resumes
+# one: the first run of a new cycle starts over from the first recipient. job_progress is created
+# by `flask install-job-runs`.
+
+refresh_interval = float(os.environ.get("REFRESH_CREDITS_INTERVAL", 7 * 24 * 3600))
+
+
+"""
+Commit db's transaction, raising the error PgInstance.commit returns instead of going on as if
+the work was saved
+"""
+
+
+def commit(db):
+    err = db.commit()
+    if err != None:
+        raise err
+
+
+class CreditRefreshJob:
+    name = "refresh_recipient_credits"
+
+    def __init__(self, db, chunk_size=500, clock=time.time):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.cycle = int(clock() // refresh_interval)
+        self.report = None
+
+    """
+    Run the refresh to completion, resuming an interrupted run of the same cycle if there is one.
+    Yields:
+        each changed recipient (email, previous_credits, available_credits, credit_limit)
+        as soon as its range is committed; self.report holds the totals once exhausted
+    """
+
+    def run(self):
+        db = self.db
+        resumed_from = db.get_job_progress(self.name, self.cycle)
+        last_id = resumed_from or 0
+        chunks = scanned = updated = 0
+        start = time.perf_counter()
+        while True:
+            range_end, range_size, changes = db.refresh_recipient_credits_range(last_id, self.chunk_size)
+            if range_end == None:
+                break
+            db.set_job_progress(self.name, range_end, self.cycle)
+            commit(db)
+            chunks += 1
+            scanned += range_size
+            updated += len(changes)
+            last_id = range_end
+            for change in changes:
+                yield change
+        db.clear_job_progress(self.name)
+        commit(db)
+        seconds = time.perf_counter() - start
+        self.report = {
+            "resumed_from": resumed_from,
+            "chunks": chunks,
+            "scanned": scanned,
+            "updated": updated,
+            "seconds": seconds,
+            "rows_per_sec": scanned / seconds if seconds else 0,
+        }
@@ -0,0 +1,190 @@
+import functools
+import hashlib
+import os
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+from flask import Response, current_app, request
+from pgpool import get_pool, mark_primary
+
+# The restaurant directory (/api/restaurant) is cached in every worker process as the
+# serialized response of the wrapped view. A statement trigger on restaurant sends a NOTIFY
+# when a transaction that changed the table commits, whichever method or script made the
+# change; each process LISTENs on its own connection and drops its copy. While that connection
+# is down the cache is bypassed, so a process that may have missed a notification never serves
+# an old directory. Requires `flask install-restaurant-directory` to have been run once.
+
+RESTAURANT_DIRECTORY_CHANNEL = "restaurant_directory"
+
+RESTAURANT_DIRECTORY_SCHEMA = """
+CREATE OR REPLACE FUNCTION restaurant_directory_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('restaurant_directory', '');
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS restaurant_directory ON restaurant;
+CREATE TRIGGER restaurant_directory AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON restaurant
+    FOR EACH STATEMENT EXECUTE FUNCTION restaurant_directory_changed();
+"""
+
+
+class NotifyCache:
+    def __init__(self, channel, max_age=60.0, connect=None, clock=time.monotonic):
+        self.channel = channel
+        # upper bound on the age of a cached value, in case a notification is never sent
+        self.max_age = max_age
+        self.connect = connect
+        self.clock = clock
+        self.enabled = True
+        self.listening = False
+        self._value = None
+        self._loaded_at = None
+        # bumped by every invalidation; a load that started before one is not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._listener = None
+        self.hits = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def _cached(self):
+        if self._value is not None and self.clock() - self._loaded_at < self.max_age:
+            return self._value
+        return None
+
+    """
+    Return the cached value, calling loader() when there is none. Only one caller loads at a
+    time; the rest wait for its result. Without a working listener every call loads.
+    """
+
+    def get(self, loader):
+        if not self.enabled:
+            return loader()
+        self.start()
+        if not self.listening:
+            return loader()
+        value = self._cached()
+        if value is not None:
+            self.hits += 1
+            return value
+        with self._load_lock:
+            value = self._cached()
+            if value is not None:
+                self.hits += 1
+                return value
+            generation = self._generation
+            value = loader()
+            self.loads += 1
+            with self._lock:
+                if value is not None and self.listening and generation == self._generation:
+                    self._value = value
+                    self._loaded_at = self.clock()
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._value = None
+            self.invalidations += 1
+
+    def start(self):
+        if self._listener is None and self.connect is not None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, name="listen-" + self.channel,
+                                                      daemon=True)
+                    self._listener.start()
+
+    def _listen(self):
+        delay = 0.5
+        while True:
+            conn = None
+            try:
+                conn = self.connect()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as curs:
+                    curs.execute("LISTEN %s" % self.channel)
+                # anything may have changed while nobody was listening
+                self.invalidate()
+                self.listening = True
+                delay = 0.5
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        with conn.cursor() as curs:
+                            curs.execute("SELECT 1")  # notice a dead connection
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.invalidate()
+            except Exception as e:
+                print("ERROR: %s listener disconnected, retrying in %ss: %s" % (self.channel, delay, e))
+            self.listening = False
+            self.invalidate()
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "listening": self.listening,
+            "hits": self.hits,
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+        }
+
+
+def listener_connection():
+    pool = get_pool()
+    return psycopg2.connect(pool.dsn, **pool.connect_kwargs)
+
+
+# serialized directory response as (body, mimetype, etag)
+restaurant_directory = NotifyCache(RESTAURANT_DIRECTORY_CHANNEL,
+                                   max_age=float(os.environ.get("RESTAURANT_DIRECTORY_MAX_AGE", 60)),
+                                   connect=listener_connection)
+restaurant_directory.enabled = os.environ.get("RESTAURANT_DIRECTORY_CACHE", "1") == "1"
+
+
+"""
+Wrap the directory view so its 200 response is served from restaurant_directory, with an
+ETag made from the body for conditional GET (and for compression.py to reuse its compressed
+body)
+"""
+
+
+def cached_directory(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        error = []
+
+        def load():
+            if restaurant_directory.listening:
+                # the copy kept must have what was notified, which a lagging replica may not
+                mark_primary()
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                error.append(response)
+                return None
+            body = response.get_data()
+            return body, response.mimetype, "directory-" + hashlib.sha1(body).hexdigest()[:16]
+
+        page = restaurant_directory.get(load)
+        if error:
+            return error[0]
+        if request.if_none_match.contains_weak(page[2]):
+            response = Response(status=304)
+        else:
+            response = Response(page[0], mimetype=page[1])
+        response.set_etag(page[2])
+        return response
+    return wrapper
@@ -0,0 +1,133 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.hash import bcrypt
+
+# bcrypt runs in a dedicated process pool so a burst of logins cannot pin the request workers.
+# At most max_pending jobs may be queued or running; further callers wait up to admit_timeout
+# for a slot and then get HashingBusy, which the handlers turn into a 503.
+
+bcrypt_rounds = int(os.environ.get("BCRYPT_ROUNDS", 12))
+# The pool's processes are started by a fork server (spawned where there is none), not forked
+# from the serving process: its other threads (pool, outbox, LISTEN, scheduler) may hold locks
+# at fork time that a forked child would wait on forever.
+hash_start_method = os.environ.get("HASH_START_METHOD", "forkserver"
+                                   if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _hash(password, rounds):
+    return bcrypt.using(rounds=rounds).hash(password)
+
+
+def _verify(password, password_hash):
+    return bcrypt.verify(password, password_hash)
+
+
+def process_pool(max_workers):
+    context = multiprocessing.get_context(hash_start_method)
+    if hash_start_method == "forkserver":
+        context.set_forkserver_preload(["hashing"])  # workers start with passlib imported, not the app
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+class HashExecutor:
+    def __init__(self, workers=None, max_pending=None, admit_timeout=2.0, executor_factory=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.admit_timeout = admit_timeout
+        self.executor_factory = executor_factory or process_pool
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self.executor_factory(max_workers=self.workers)
+        return self._executor
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(timeout=self.admit_timeout):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusy("password hashing queue is full")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    # for the async routes: admission may wait up to admit_timeout, so it runs on a thread
+    async def run_async(self, fn, *args):
+        future = await asyncio.to_thread(self.submit, fn, *args)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+executor = HashExecutor(workers=int(os.environ.get("HASH_WORKERS", 0)) or None,
+                        max_pending=int(os.environ.get("HASH_QUEUE_SIZE", 0)) or None,
+                        admit_timeout=float(os.environ.get("HASH_ADMIT_TIMEOUT", 2)))
+
+
+def hash_password(password, rounds=None):
+    return executor.run(_hash, password, rounds or bcrypt_rounds)
+
+
+def verify_password(password, password_hash):
+    return executor.run(_verify, password, password_hash)
+
+
+async def hash_password_async(password, rounds=None):
+    return await executor.run_async(_hash, password, rounds or bcrypt_rounds)
+
+
+async def verify_password_async(password, password_hash):
+    return await executor.run_async(_verify, password, password_hash)
+
+
+"""
+True if password_hash was made with a different cost than the one currently configured,
+in which case it should be replaced after the next successful login.
+"""
+
+
+def needs_rehash(password_hash, rounds=None):
+    return bcrypt.using(rounds=rounds or bcrypt_rounds).needs_update(password_hash)
@@ -0,0 +1,108 @@
+import json
+import os
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Lets a JSON document that Postgres already encoded (PgInstance.fetch_json) go through
+# jsonify untouched: jsonify(raw) sends its text as the response body as is. Inside a larger
+# structure it is decoded and encoded again like any other value.
+
+
+class RawJSON:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class PassThroughJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, RawJSON):
+            return json.loads(o.text)
+        return DefaultJSONProvider.default(o)
+
+    def response(self, *args, **kwargs):
+        if len(args) == 1 and not kwargs and isinstance(args[0], RawJSON):
+            return self._app.response_class(args[0].text, mimetype=self.mimetype)
+        return super().response(*args, **kwargs)
+
+
+week_days = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+months = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+"""
+Same result as werkzeug.http.http_date (which jsonify uses for dates) without going through
+email.utils: naive datetimes are taken as UTC, dates as midnight UTC
+"""
+
+
+def http_date(o):
+    if isinstance(o, datetime):
+        if o.tzinfo is not None:
+            o = o.astimezone(timezone.utc)
+        hour, minute, second = o.hour, o.minute, o.second
+    else:
+        hour = minute = second = 0
+    return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (
+        week_days[o.weekday()], o.day, months[o.month - 1], o.year, hour, minute, second)
+
+
+# Encodes with orjson, producing the same documents as the json module does for what PgInstance
+# returns: namedtuple rows as arrays, datetimes as HTTP dates, Decimals as strings, keys sorted.
+# Only non-ASCII text differs, written as UTF-8 rather than \u escapes. Calls with json module
+# options (indent in debug mode, etc.) still go through the json module.
+class FastJSONProvider(PassThroughJSONProvider):
+    @staticmethod
+    def fast_default(o):
+        if isinstance(o, tuple):  # namedtuple rows; orjson only encodes plain tuples
+            return list(o)
+        if isinstance(o, date):
+            return http_date(o)
+        if isinstance(o, Decimal):
+            return str(o)
+        return PassThroughJSONProvider.default(o)
+
+    def options(self):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.fast_default, option=self.options()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (len(args) == 1 and not kwargs and isinstance(args[0], RawJSON)) \
+                or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.fast_default, option=self.options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+"""
+Return the JSON provider for app: FastJSONProvider when orjson is installed, unless
+JSON_PROVIDER=json asks for the json module
+"""
+
+
+def make_json_provider(app):
+    if orjson is not None and os.environ.get("JSON_PROVIDER", "orjson") == "orjson":
+        return FastJSONProvider(app)
+    return PassThroughJSONProvider(app)
@@ -0,0 +1,28 @@
+import os
+import time
+
+from flask_jwt_extended import decode_token
+from ttlcache import TTLCache
+
+# Raw AUTH_TOKEN -> decoded claims, so a token reused across requests is verified only once.
+# Entries never outlive the token's own exp claim.
+token_cache = TTLCache(maxsize=int(os.environ.get("JWT_CACHE_SIZE", 10000)),
+                       ttl=float(os.environ.get("JWT_CACHE_TTL", 600)))
+
+
+"""
+Decode and verify a JWT, using token_cache for tokens seen before
+Returns:
+    decoded claims, raises like decode_token if the token is invalid or expired
+"""
+
+
+def decode_cached(token):
+    found, claims = token_cache.lookup(token)
+    if found:
+        return claims
+    claims = decode_token(token)
+    remaining = claims["exp"] - time.time() if "exp" in claims else token_cache.ttl
+    if remaining > 0:
+        token_cache.set(token, claims, min(remaining, token_cache.ttl))
+    return claims
@@ -0,0 +1,72 @@
+import functools
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+from monitoring import is_admin
+from pg.pginstance import PgInstance
+
+max_page_size = 1000
+stream_chunk_size = 1000
+
+
+"""
+Wrap a list view so that
+    ?limit=N[&after=ID]  returns {"items": [...], "next": ID or null}, one keyset page by id
+    ?stream=1            streams the whole table as a JSON array read in chunks
+and any other request is handled by the wrapped view unchanged.
+Rows are encoded the same way jsonify encodes them for the wrapped view.
+"""
+
+
+def paginated(view, table, admin_only=False):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if "limit" not in request.args and "stream" not in request.args:
+            return view(*args, **kwargs)
+        if admin_only and not is_admin():
+            return jsonify({"error": "unauthorized"}), 401
+        if "stream" in request.args:
+            return stream_table(table)
+        return get_page(table)
+    return wrapper
+
+
+def get_page(table):
+    try:
+        limit = min(int(request.args["limit"]), max_page_size)
+        after = int(request.args.get("after", 0))
+    except ValueError:
+        return jsonify({"error": "limit and after must be integers"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        print(err)
+        return jsonify({"error": "could not connect to database"}), 500
+    rows = db.get_page(table, after, limit)
+    db.disconnect()
+    next_after = getattr(rows[-1], "id") if len(rows) == limit else None
+    return jsonify({"items": rows, "next": next_after}), 200
+
+
+def stream_table(table):
+    db = PgInstance()
+    err = db.connect()
+    if err is not None:
+        print(err)
+        return jsonify({"error": "could not connect to database"}), 500
+
+    def generate():
+        dumps = current_app.json.dumps
+        try:
+            separator = "["
+            # plain tuples encode exactly like the namedtuple rows, one dumps call per chunk
+            for rows in db.stream_table(table, stream_chunk_size, row_mode="tuple"):
+                yield separator + dumps(rows)[1:-1]
+                separator = ","
+            yield "[]" if separator == "[" else "]"
+        finally:
+            db.disconnect()
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
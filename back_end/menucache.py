@@ -0,0 +1,69 @@
+import functools
+import hashlib
+import os
+
+from flask import Response, current_app, request
+from pg.pginstance import PgInstance, menu_versions
+from pgpool import mark_primary
+from ttlcache import TTLCache
+
+# Menus only change through the PgInstance menu_item writers, which bump the restaurant's row
+# in menu_version. Responses of /api/menu/<restaurant_id> are cached per (restaurant, menu
+# version, query string) and carry an ETag made from the same key, so a browser revalidating
+# the current menu gets a 304 and other requests are served from memory, neither touching
+# menu_item. Until `flask install-menu-versions` has been run, menus are served uncached.
+
+# (restaurant id, menu version, query string) -> (body, mimetype)
+menu_pages = TTLCache(maxsize=int(os.environ.get("MENU_CACHE_SIZE", 2048)),
+                      ttl=float(os.environ.get("MENU_CACHE_TTL", 3600)))
+
+
+def menu_etag(restaurant_id, version, query):
+    return "menu-%s-%s-%s" % (restaurant_id, version, hashlib.sha1(query).hexdigest()[:12])
+
+
+"""
+Wrap the menu view with version-keyed caching and conditional GET. Only 200 responses are
+cached; the view still runs (and reports errors) for ids that aren't integers.
+"""
+
+
+def cached_menu(view):
+    @functools.wraps(view)
+    def wrapper(restaurant_id, *args, **kwargs):
+        try:
+            menu_id = int(restaurant_id)
+        except ValueError:
+            return view(restaurant_id, *args, **kwargs)
+
+        found, version = menu_versions.lookup(menu_id)
+        if not found:
+            db = PgInstance()
+            err = db.connect()
+            if err is not None:
+                print(err)
+                return view(restaurant_id, *args, **kwargs)
+            version = db.get_menu_version(menu_id)
+            db.disconnect()
+            if version is None:
+                return view(restaurant_id, *args, **kwargs)
+
+        etag = menu_etag(menu_id, version, request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            key = (menu_id, version, request.query_string)
+            page = menu_pages.get(key)
+            if page is not None:
+                response = Response(page[0], mimetype=page[1])
+            else:
+                # a lagging replica could return items older than version
+                mark_primary()
+                response = current_app.make_response(view(restaurant_id, *args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                menu_pages.set(key, (response.get_data(), response.mimetype))
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    return wrapper
@@ -0,0 +1,206 @@
+import threading
+import time
+
+# Public metrics (/api/metric) are read from metric_counter, a one-row-per-metric table, plus
+# the changes appended to metric_counter_delta by triggers on the tables being counted, instead
+# of aggregating those tables on every page view. Triggers only insert, so concurrent claims and
+# sign-ups never wait on the same counter row; roll_up_metric_counters folds the appended changes
+# into metric_counter, as a scheduler job and on the read that finds more than
+# METRIC_ROLLUP_THRESHOLD of them (so the reads stay short without the scheduler too). The
+# counters are cached in-process for a few seconds; when they expire only one caller reloads
+# them while the others keep getting the previous values. Until `flask install-metric-counters`
+# has been run, the metrics are aggregated from the tables like before.
+#
+# Values keep the types of the aggregates they replaced: counts and sums of integer columns are
+# ints, distribution_total a Decimal, and a sum over no rows is None. For that each sum has a
+# companion counter of the rows it adds up (METRIC_ROW_COUNTS).
+
+METRIC_COUNTER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_counter (
+    name TEXT PRIMARY KEY,
+    value NUMERIC NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS metric_counter_delta (
+    name TEXT NOT NULL,
+    delta NUMERIC NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION metric_counter_add(metric TEXT, delta NUMERIC) RETURNS VOID AS $$
+BEGIN
+    IF delta <> 0 THEN
+        INSERT INTO metric_counter_delta (name, delta) VALUES (metric, delta);
+    END IF;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION metric_counter_donation_claim() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM metric_counter_add('num_meals',
+        CASE WHEN TG_OP <> 'DELETE' THEN COALESCE(json_array_length(NEW.meal_items), 0) ELSE 0 END -
+        CASE WHEN TG_OP <> 'INSERT' THEN COALESCE(json_array_length(OLD.meal_items), 0) ELSE 0 END);
+    PERFORM metric_counter_add('claims_with_meals',
+        CASE WHEN TG_OP <> 'DELETE' AND NEW.meal_items IS NOT NULL THEN 1 ELSE 0 END -
+        CASE WHEN TG_OP <> 'INSERT' AND OLD.meal_items IS NOT NULL THEN 1 ELSE 0 END);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION metric_counter_recipient() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM metric_counter_add('num_recipients',
+        CASE WHEN TG_OP <> 'DELETE' AND NEW.approved THEN 1 ELSE 0 END -
+        CASE WHEN TG_OP <> 'INSERT' AND OLD.approved THEN 1 ELSE 0 END);
+    PERFORM metric_counter_add('num_children',
+        CASE WHEN TG_OP <> 'DELETE' AND NEW.approved
+             THEN COALESCE(NEW.num_children_18, 0) + COALESCE(NEW.num_children_13, 0) ELSE 0 END -
+        CASE WHEN TG_OP <> 'INSERT' AND OLD.approved
+             THEN COALESCE(OLD.num_children_18, 0) + COALESCE(OLD.num_children_13, 0) ELSE 0 END);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION metric_counter_rows() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM metric_counter_add(TG_ARGV[0], CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION metric_counter_distribution() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM metric_counter_add('distribution_total',
+        CASE WHEN TG_OP <> 'DELETE' THEN COALESCE(NEW.distributed_credits, 0) ELSE 0 END -
+        CASE WHEN TG_OP <> 'INSERT' THEN COALESCE(OLD.distributed_credits, 0) ELSE 0 END);
+    PERFORM metric_counter_add('distributions',
+        CASE WHEN TG_OP <> 'DELETE' AND NEW.distributed_credits IS NOT NULL THEN 1 ELSE 0 END -
+        CASE WHEN TG_OP <> 'INSERT' AND OLD.distributed_credits IS NOT NULL THEN 1 ELSE 0 END);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS metric_counter ON donation_claim;
+CREATE TRIGGER metric_counter AFTER INSERT OR DELETE OR UPDATE OF meal_items ON donation_claim
+    FOR EACH ROW EXECUTE FUNCTION metric_counter_donation_claim();
+DROP TRIGGER IF EXISTS metric_counter ON recipient;
+CREATE TRIGGER metric_counter AFTER INSERT OR DELETE OR UPDATE OF approved, num_children_18, num_children_13 ON recipient
+    FOR EACH ROW EXECUTE FUNCTION metric_counter_recipient();
+DROP TRIGGER IF EXISTS metric_counter ON donor;
+CREATE TRIGGER metric_counter AFTER INSERT OR DELETE ON donor
+    FOR EACH ROW EXECUTE FUNCTION metric_counter_rows('num_donors');
+DROP TRIGGER IF EXISTS metric_counter ON restaurant;
+CREATE TRIGGER metric_counter AFTER INSERT OR DELETE ON restaurant
+    FOR EACH ROW EXECUTE FUNCTION metric_counter_rows('num_restaurants');
+DROP TRIGGER IF EXISTS metric_counter ON distribution;
+CREATE TRIGGER metric_counter AFTER INSERT OR DELETE OR UPDATE OF distributed_credits ON distribution
+    FOR EACH ROW EXECUTE FUNCTION metric_counter_distribution();
+"""
+
+# Every metric counted from the tables: (name, value) rows
+METRIC_TOTALS = """
+SELECT 'num_meals' AS name, COALESCE(sum(json_array_length(meal_items)), 0) AS value FROM donation_claim
+UNION ALL SELECT 'claims_with_meals', COUNT(meal_items) FROM donation_claim
+UNION ALL SELECT 'num_restaurants', COUNT(*) FROM restaurant
+UNION ALL SELECT 'num_donors', COUNT(*) FROM donor
+UNION ALL SELECT 'num_recipients', COUNT(*) FROM recipient WHERE approved = TRUE
+UNION ALL SELECT 'num_children', COALESCE(sum(COALESCE(num_children_18, 0) + COALESCE(num_children_13, 0)), 0)
+          FROM recipient WHERE approved = TRUE
+UNION ALL SELECT 'distribution_total', COALESCE(SUM(distributed_credits), 0) FROM distribution
+UNION ALL SELECT 'distributions', COUNT(distributed_credits) FROM distribution
+"""
+
+# sum metric -> metric counting the rows it adds up; the sum is None while that count is 0
+METRIC_ROW_COUNTS = {"num_meals": "claims_with_meals", "num_children": "num_recipients",
+                     "distribution_total": "distributions"}
+# metrics whose aggregate was an integer (count, or sum of integer columns)
+INTEGER_METRICS = {"num_meals", "num_restaurants", "num_donors", "num_recipients", "num_children"}
+
+
+"""
+Returns:
+    the value of metric name in counters (metric name -> NUMERIC value), typed like the
+    aggregate it replaced
+"""
+
+
+def metric_value(counters, name):
+    rows = METRIC_ROW_COUNTS.get(name)
+    # counters installed before the row counts existed have none: keep the value until reinstalled
+    if rows in counters and not counters[rows]:
+        return None
+    value = counters.get(name, 0)
+    return int(value) if name in INTEGER_METRICS else value
+
+# Full recount, run once by PgInstance.install_metric_counters in the same transaction that
+# creates the triggers (which locks out writers until it commits)
+METRIC_COUNTER_BACKFILL = """
+DELETE FROM metric_counter_delta;
+INSERT INTO metric_counter (name, value) {0}
+ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+""".format(METRIC_TOTALS)
+
+# Move the appended changes into metric_counter. Changes committed while it runs aren't seen
+# by the DELETE and are left for the next roll-up.
+METRIC_COUNTER_ROLLUP = """
+WITH moved AS (DELETE FROM metric_counter_delta RETURNING name, delta),
+     added AS (INSERT INTO metric_counter (name, value)
+               SELECT name, sum(delta) FROM moved GROUP BY name
+               ON CONFLICT (name) DO UPDATE SET value = metric_counter.value + EXCLUDED.value)
+SELECT count(*) AS moved FROM moved
+"""
+
+
+class SingleFlightCache:
+    def __init__(self, ttl=5, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._value = None
+        self._expires = None
+        self._refresh_lock = threading.Lock()
+        self.hits = 0
+        self.refreshes = 0
+        self.stale_hits = 0
+
+    """
+    Return the cached value, calling loader() to refresh it once it is older than ttl.
+    While one caller refreshes, others get the stale value if there is one, otherwise
+    they wait for the refresh instead of each running loader() themselves.
+    """
+
+    def get(self, loader):
+        if self._expires is not None and self.clock() < self._expires:
+            self.hits += 1
+            return self._value
+        blocking = self._expires is None
+        if not self._refresh_lock.acquire(blocking):
+            self.stale_hits += 1
+            return self._value
+        try:
+            if self._expires is not None and self.clock() < self._expires:
+                self.hits += 1
+                return self._value
+            value = loader()
+            self._value = value
+            self._expires = self.clock() + self.ttl
+            self.refreshes += 1
+            return value
+        finally:
+            self._refresh_lock.release()
+
+    """
+    For callers that load without holding the refresh lock (AsyncPgInstance, which can't block
+    its event loop on it): lookup() returns (True, value) while the value is fresh, and set()
+    stores a freshly loaded one.
+    """
+
+    def lookup(self):
+        if self._expires is not None and self.clock() < self._expires:
+            self.hits += 1
+            return True, self._value
+        return False, None
+
+    def set(self, value):
+        self._value = value
+        self._expires = self.clock() + self.ttl
+        self.refreshes += 1
+
+    def invalidate(self):
+        self._expires = self.clock() if self._expires is not None else None
+
+    def stats(self):
+        return {"ttl": self.ttl, "hits": self.hits, "stale_hits": self.stale_hits, "refreshes": self.refreshes}
@@ -0,0 +1,65 @@
+from flask import g, jsonify
+from auditlog import audit_log, pending_log
+from jwtcache import token_cache
+from outbox import outbox
+from pgpool import get_pool, get_replica_pool, replica_stats
+from querystats import query_timings, route_timings
+from compression import compression_stats
+from pg.pginstance import role_cache, metrics_cache, menu_versions
+from menucache import menu_pages
+from directory import restaurant_directory
+from scheduler import scheduler
+
+
+def is_admin():
+    return g.logged_in and g.user_type == "Admin"
+
+
+def get_pool_stats():
+    if not is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    stats = get_pool().stats()
+    if get_replica_pool() is not None:
+        stats["replica"] = dict(get_replica_pool().stats(), **replica_stats)
+    return jsonify(stats), 200
+
+
+def get_mail_stats():
+    if not is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(outbox.stats()), 200
+
+
+def get_cache_stats():
+    if not is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify({
+        "role": role_cache.stats(),
+        "metrics": metrics_cache.stats(),
+        "jwt": token_cache.stats(),
+        "menu_versions": menu_versions.stats(),
+        "menu_pages": menu_pages.stats(),
+        "restaurant_directory": restaurant_directory.stats(),
+    }), 200
+
+
+def get_audit_log_stats():
+    if not is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify({"transactions": pending_log.stats(), "background": audit_log.stats()}), 200
+
+
+def get_performance_stats():
+    if not is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify({
+        "queries": query_timings.as_dict(),
+        "routes": route_timings.as_dict(),
+        "compression": compression_stats.as_dict(),
+    }), 200
+
+
+def get_scheduler_stats():
+    if not is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(scheduler.stats()), 200
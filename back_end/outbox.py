@@ -0,0 +1,256 @@
+import itertools
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import OrderedDict
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# Outbound mail is queued by the request and delivered by background workers. Each worker keeps
+# its own authenticated SMTP session open between messages, sends whatever has piled up in one
+# go, and retries failed messages with exponential backoff.
+#
+# SMTP_PASSWORD has no default: without it outbound mail is disabled and every message is
+# refused. Set it to an empty string for a relay that doesn't authenticate.
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.office365.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+SMTP_SENDER = os.environ.get("SMTP_SENDER", "openmealio@outlook.com")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
+
+
+class SmtpSession:
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, sender=SMTP_SENDER, password=SMTP_PASSWORD,
+                 starttls=SMTP_STARTTLS, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.starttls = starttls
+        # servers drop idle sessions, so check with NOOP before reusing an old one
+        self.idle_timeout = idle_timeout
+        self.smtp = None
+        self.last_used = 0
+
+    # kept only once logged in, so a failed STARTTLS or login is retried on a new connection
+    def open(self):
+        smtp = smtplib.SMTP(self.host, self.port)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.password:
+                smtp.login(self.sender, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+
+    def ensure_open(self):
+        if self.smtp is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            try:
+                self.smtp.noop()
+            except smtplib.SMTPException:
+                self.close()
+        if self.smtp is None:
+            self.open()
+
+    def send(self, receivers, message):
+        self.ensure_open()
+        try:
+            self.smtp.sendmail(self.sender, receivers, message)
+        except smtplib.SMTPRecipientsRefused:
+            raise  # the session is fine, only these addresses aren't
+        except OSError:  # any other SMTPException or socket error: start over with a new session
+            self.close()
+            raise
+        finally:
+            self.last_used = time.monotonic()
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+        self.smtp = None
+
+
+class OutboundMessage:
+    def __init__(self, id, to_addr, subject, body):
+        self.id = id
+        self.to_addr = to_addr
+        self.subject = subject
+        self.body = body
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+        self.status = "queued"
+        self.error = None
+
+    def receivers(self):
+        return self.to_addr if type(self.to_addr) is list else [self.to_addr]
+
+    def as_string(self, sender):
+        msg = MIMEMultipart()
+        msg['From'] = sender
+        msg['To'] = ','.join(self.receivers())
+        msg['Subject'] = self.subject
+        msg.attach(MIMEText(self.body))
+        return msg.as_string()
+
+
+class Outbox:
+    def __init__(self, workers=2, max_queue=1000, batch_size=20, max_attempts=5, backoff=2.0,
+                 session_factory=SmtpSession, history=10000, enabled=True):
+        # False when there's no SMTP account to send from; send() then refuses every message
+        self.enabled = enabled
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # seconds before the first retry, doubled on every further attempt
+        self.backoff = backoff
+        self.session_factory = session_factory
+        self.history = history
+        self._queue = queue.Queue(max_queue)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._messages = OrderedDict()  # id -> OutboundMessage, oldest evicted past `history`
+        self._threads = []
+        self._running = False
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name="outbox-%s" % n, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._lock:
+            self._running = False
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    """
+    Queue an email for delivery.
+    Returns:
+        message id, or None if the queue is full or mail is disabled
+    """
+
+    def send(self, to_addr, subject, body):
+        if not self.enabled:
+            return None
+        self.start()
+        message = OutboundMessage(next(self._ids), to_addr, subject, body)
+        with self._lock:
+            self._messages[message.id] = message
+            while len(self._messages) > self.history:
+                self._messages.popitem(last=False)
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            message.status = "rejected"
+            return None
+        return message.id
+
+    def status(self, message_id):
+        with self._lock:
+            message = self._messages.get(message_id)
+        if message is None:
+            return None
+        return {"status": message.status, "attempts": message.attempts, "error": message.error}
+
+    def join(self):
+        self._queue.join()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        session = self.session_factory()
+        while True:
+            batch = self._next_batch()
+            stop = False
+            for message in batch:
+                if message is None:
+                    stop = True
+                else:
+                    self._deliver(session, message)
+                self._queue.task_done()
+            if stop:
+                session.close()
+                return
+
+    def _deliver(self, session, message):
+        message.attempts += 1
+        try:
+            session.send(message.receivers(), message.as_string(session.sender))
+        except Exception as e:
+            print("Error sending email #%s: %s" % (message.id, e.__class__))
+            message.error = str(e.__class__)
+            if message.attempts >= self.max_attempts:
+                message.status = "failed"
+                with self._lock:
+                    self._failed += 1
+                return
+            message.status = "retrying"
+            with self._lock:
+                self._retries += 1
+            delay = self.backoff * 2 ** (message.attempts - 1)
+            timer = threading.Timer(delay, self._requeue, (message,))
+            timer.daemon = True
+            timer.start()
+            return
+        latency = time.monotonic() - message.enqueued
+        message.status = "sent"
+        message.error = None
+        with self._lock:
+            self._sent += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+
+    def _requeue(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            message.status = "failed"
+            with self._lock:
+                self._failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "queued": self._queue.qsize(),
+                "sent": self._sent,
+                "failed": self._failed,
+                "retries": self._retries,
+                "avg_queue_latency": self._latency_total / self._sent if self._sent else 0,
+                "max_queue_latency": self._latency_max,
+            }
+
+
+outbox = Outbox(workers=int(os.environ.get("MAIL_WORKERS", 2)), enabled=SMTP_PASSWORD is not None)
+if not outbox.enabled:
+    print("WARNING: SMTP_PASSWORD is not set, outbound mail is disabled")
@@ -1,12 +1,91 @@
+import csv
 import datetime
+import functools
+import io
 
 import psycopg2
 import psycopg2.extras
+import psycopg2.errors
+import psycopg2.extensions
 import os
+import re
+import threading
+import time
+import weakref
 from datetime import datetime
 import pytz
 # Servers as wrapper for psycopg2 in the context of this project and provides error handling
-from flask import g
+from flask import g, has_app_context
+from pgpool import get_pool, request_connection, request_replica_connection, replica_failed, mark_primary
+from querystats import InstrumentedCursor, InstrumentedTupleCursor
+from ttlcache import TTLCache
+from auditlog import pending_log
+from metrics import METRIC_COUNTER_SCHEMA, METRIC_COUNTER_BACKFILL, METRIC_COUNTER_ROLLUP, METRIC_TOTALS, \
+    SingleFlightCache, metric_value
+from directory import RESTAURANT_DIRECTORY_SCHEMA
+from jsonprovider import RawJSON
+from collections import namedtuple
+
+# role_key(email) -> role memberships, dropped by every method that adds or removes a role row.
+# Only committed memberships of existing accounts are cached: an email without any role may be
+# signed up by another process at any moment.
+role_cache = TTLCache(maxsize=int(os.environ.get("ROLE_CACHE_SIZE", 4096)),
+                      ttl=float(os.environ.get("ROLE_CACHE_TTL", 60)))
+# metric_counter rows, shared by every /api/metric view for a few seconds
+metrics_cache = SingleFlightCache(ttl=float(os.environ.get("METRICS_CACHE_TTL", 5)))
+# restaurant id -> menu version, dropped by the menu writers in this process and re-read from
+# menu_version after a couple of seconds to pick up writes made by other processes
+menu_versions = TTLCache(maxsize=int(os.environ.get("MENU_VERSION_CACHE_SIZE", 4096)),
+                         ttl=float(os.environ.get("MENU_VERSION_TTL", 2)))
+SumRow = namedtuple("Record", ["sum"])
+CountRow = namedtuple("Record", ["count"])
+
+write_statement = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CREATE|ALTER|DROP|COPY|nextval|setval|pg_notify)\b",
+                             re.IGNORECASE)
+
+
+def role_key(email):
+    return email.lower()
+
+
+@functools.lru_cache(maxsize=1024)
+def is_write(query):
+    return write_statement.search(query) is not None
+
+
+# Cursor on the primary connection. A statement that may write sends the rest of the request's
+# reads to the primary too, so the request sees what it wrote.
+class PrimaryCursor(InstrumentedCursor):
+    def execute(self, query, vars=None):
+        if isinstance(query, str) and is_write(query) and has_app_context():
+            mark_primary()
+        return super().execute(query, vars)
+
+
+"""
+Mark a read-only PgInstance method to run on the request's replica connection (see pgpool.py),
+on the primary when there is none. A replica that fails mid-read is taken out of use and the
+read is repeated on the primary.
+"""
+
+
+def replica_read(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        replica = self.replica_connection()
+        if replica is None:
+            return method(self, *args, **kwargs)
+        primary = self.conn, self.curs
+        self.conn, self.curs = replica, replica.cursor(cursor_factory=InstrumentedCursor)
+        try:
+            return method(self, *args, **kwargs)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            replica_failed(e)
+        finally:
+            self.curs.close()
+            self.conn, self.curs = primary
+        return method(self, *args, **kwargs)
+    return wrapper
 
 
 class PgInstance:
@@ -15,49 +94,177 @@ class PgInstance:
         self.conn = None
         # Current cursor object, None if no cursor/connection
         self.curs = None
+        # True when conn belongs to the current Flask request and is released by its teardown
+        self.request_scoped = False
+        # role memberships read in the open transaction of a connection outside requests
+        self._pending_roles = {}
 
     """
-    Open connection and initialize cursor for PSQL database
+    Check out a pooled connection and initialize cursor for PSQL database.
+    Within a Flask request every PgInstance shares the request's connection; with
+    request_scoped=False it checks out one of its own, returned by disconnect(), for work
+    that outlives the app context it runs in (the scheduler under `flask run-scheduler`).
     Returns:
-        connection object and database cursor object, or error if connection failed
+        None, or error if no connection could be obtained
     """
 
-    def connect(self):
+    def connect(self, request_scoped=True):
         try:
-            if "DATABASE_URL" in os.environ:  # prod
-                self.conn = psycopg2.connect(
-                    os.environ["DATABASE_URL"], sslmode='require')
-            self.curs = self.conn.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
+            if request_scoped and has_app_context():
+                self.conn = request_connection()
+                self.request_scoped = True
+            else:
+                self.conn = get_pool().getconn()
+                self.request_scoped = False
+            self.curs = self.conn.cursor(cursor_factory=PrimaryCursor)
         except Exception as e:
             return e
 
+    """
+    Returns:
+        the replica connection for @replica_read methods, None to read from the primary
+    """
+
+    def replica_connection(self):
+        if not self.request_scoped or not has_app_context():
+            return None
+        return request_replica_connection()
+
     def commit(self):
         try:  # make changes persist
+            pending_log.write(self.curs)
             self.conn.commit()
         except Exception as e:
             return e
+        self.cache_pending_roles()
+
+    def rollback(self):
+        try:
+            pending_log.discard(self.conn)
+            self.pending_roles().clear()
+            self.conn.rollback()
+        except Exception as e:
+            return e
+
+    """
+    Returns:
+        dict of role_key -> role memberships read in the current transaction, shared by the
+        PgInstances of a request like its connection
+    """
+
+    def pending_roles(self):
+        if self.request_scoped and has_app_context():
+            if "pending_roles" not in g:
+                g.pending_roles = {}
+            return g.pending_roles
+        return self._pending_roles
+
+    def cache_pending_roles(self):
+        pending = self.pending_roles()
+        for key, roles in pending.items():
+            role_cache.set(key, roles)
+        pending.clear()
+
+    def forget_roles(self, email):
+        role_cache.pop(role_key(email))
+        self.pending_roles().pop(role_key(email), None)
 
     """
-    Close cursor and connection to PSQL database
+    Commit, close cursor and hand the connection back to the pool (request-scoped connections
+    are returned by the request teardown instead). When the commit fails the transaction is
+    rolled back and the connection discarded rather than pooled, so its slot and any
+    session-level locks it held are released either way.
     Returns:
-        None if successful disconnection, else Exception
+        None if successful disconnection, else error message
     """
 
     def disconnect(self):
+        if self.conn == None or self.curs == None:
+            return "No connection or cursor to disconnect from."
+        err = None
         try:  # make changes persist
+            pending_log.write(self.curs)
             self.conn.commit()
+            self.cache_pending_roles()
         except Exception as e:
-            return str(e)
-        if self.conn == None or self.curs == None:
-            return "No connection or cursor to disconnect from."
-        self.curs.close()
-        self.curs = None
-        self.conn.close()
-        self.conn = None
-        return None
+            err = str(e)
+            self.rollback()
+        finally:
+            try:
+                self.curs.close()
+            except Exception:
+                pass
+            if not self.request_scoped:
+                get_pool().putconn(self.conn, discard=err != None)
+            self.curs = None
+            self.conn = None
+        return err
+
+    # Hot lookups run as server-side prepared statements: parsed and planned once per
+    # connection, then executed by name. name -> SQL with %s placeholders.
+    prepared_statements = {
+        "customer_by_email": "SELECT * FROM customer WHERE email=%s",
+        "recipient_by_email": "SELECT * FROM recipient WHERE email=%s",
+        "restaurant_by_email": "SELECT * FROM restaurant WHERE email=%s",
+        "restaurant_id_by_email": "SELECT id FROM restaurant WHERE email = %s",
+        "verify_otp": "SELECT * FROM email_otp WHERE email = %s AND code = %s AND expiresat > NOW()",
+    }
+    # connection -> {name: True} for the statements prepared on it, False once a statement's
+    # plan went stale and it still has to be deallocated; connections the pool has just opened
+    # aren't in here, so their statements are prepared again on first use
+    prepared_on = weakref.WeakKeyDictionary()
+    prepared_on_lock = threading.Lock()
+    use_prepared = os.environ.get("PG_PREPARED", "1") == "1"
+
+    """
+    Run one of prepared_statements, sending PREPARE first on the first use of the statement on
+    this connection. Prepared statements live for the whole session and survive rollbacks, so
+    the name is recorded as soon as PREPARE succeeds, even if the EXECUTE after it fails.
+    An ALTER TABLE of a table the statement reads makes EXECUTE fail with "cached plan must
+    not change result type": the statement is then deallocated and prepared again, and run
+    again right away when nothing else ran in the transaction; otherwise the error is raised
+    and the next use prepares it afresh.
+    With PG_PREPARED=0 the SQL is executed directly instead.
+    """
+
+    def execute_prepared(self, name, params):
+        query = self.prepared_statements[name]
+        if not self.use_prepared:
+            self.curs.execute(query, params)
+            return
+        with PgInstance.prepared_on_lock:
+            prepared = PgInstance.prepared_on.setdefault(self.conn, {})
+        arguments = "({0})".format(", ".join(["%s"] * len(params))) if params else ""
+        idle = self.conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        if not prepared.get(name):
+            self.prepare_statement(name, query, params, prepared)
+        try:
+            self.curs.execute("EXECUTE {0} {1}".format(name, arguments), params)
+        except psycopg2.errors.FeatureNotSupported:
+            prepared[name] = False
+            if not idle:
+                raise
+            # nothing but the failed EXECUTE is lost by rolling back
+            self.conn.rollback()
+            self.prepare_statement(name, query, params, prepared)
+            self.curs.execute("EXECUTE {0} {1}".format(name, arguments), params)
+
+    def prepare_statement(self, name, query, params, prepared):
+        if name in prepared:
+            self.curs.execute("DEALLOCATE {0}".format(name))
+            del prepared[name]
+        numbered = iter(range(1, len(params) + 1))
+        statement = re.sub("%s", lambda match: "$%d" % next(numbered), query)
+        self.curs.execute("PREPARE {0} AS {1}".format(name, statement))
+        prepared[name] = True
 
     'restaurant.py routing helpers'
 
+    # NOTIFY restaurant_directory on every committed change to restaurant, see directory.py
+    def install_restaurant_directory_trigger(self):
+        self.curs.execute(RESTAURANT_DIRECTORY_SCHEMA)
+
+    @replica_read
     def get_all_restaurants(self):
         self.curs.execute("SELECT * FROM restaurant")
         return self.curs.fetchall()
@@ -71,24 +278,99 @@ class PgInstance:
 
     'customer.py routing helpers'
 
-    def get_all_customers(self):
-        self.curs.execute("SELECT * FROM customer;")
-        return self.curs.fetchall()
+    # passing limit returns one keyset page of rows with id > after, ordered by id
+    @replica_read
+    def get_all_customers(self, after=None, limit=None):
+        if limit != None:
+            return self.get_page("customer", after, limit)
+        return self.fetch_list("SELECT * FROM customer;")
+
+    @replica_read
+    def get_all_recipients(self, after=None, limit=None):
+        if limit != None:
+            return self.get_page("recipient", after, limit)
+        return self.fetch_list("SELECT * FROM recipient;")
+
+    @replica_read
+    def get_logger(self, after=None, limit=None):
+        if limit != None:
+            return self.get_page("logger", after, limit)
+        return self.fetch_list("SELECT * FROM logger;")
+
+    # Row type of fetch_list and stream_table: "namedtuple" like every other method, or "tuple"
+    # to skip building a namedtuple per row where the rows only go to jsonify, which encodes both
+    # as JSON arrays. get_all_* and get_feed return namedtuples for callers that read attributes;
+    # the streamed list endpoints (listing.stream_table) ask for tuples.
+    row_cursor_factories = {"namedtuple": InstrumentedCursor, "tuple": InstrumentedTupleCursor}
+
+    def list_cursor(self, name=None, row_mode="namedtuple"):
+        return self.conn.cursor(name=name, cursor_factory=self.row_cursor_factories[row_mode])
+
+    def fetch_list(self, query, params=None, row_mode="namedtuple"):
+        with self.list_cursor(row_mode=row_mode) as curs:
+            curs.execute(query, params)
+            return curs.fetchall()
+
+    # The *_json twins of the polled list methods (order history, donation claims, menus) have
+    # Postgres build the response body with json_agg and return it as RawJSON, which jsonify
+    # sends as is; views opt into them one by one. Rows stay JSON arrays like jsonify makes of
+    # the rows, but values are encoded by Postgres: numeric as numbers and timestamps in ISO 8601.
 
-    def get_all_recipients(self):
-        self.curs.execute("SELECT * FROM recipient;")
-        return self.curs.fetchall()
+    """
+    Run query and have Postgres encode the whole result as one JSON array of row arrays, in
+    order_by order (columns of query's result) when given
+    Returns:
+        RawJSON
+    """
+
+    def fetch_json(self, query, params=None, order_by=None):
+        self.curs.execute(self.json_query(query, order_by), params)
+        return RawJSON(getattr(self.curs.fetchone(), "body"))
+
+    @staticmethod
+    def json_query(query, order_by=None):
+        order = "" if order_by == None else " ORDER BY " + order_by
+        return "SELECT COALESCE(json_agg((SELECT json_agg(value) FROM json_each(row_to_json(result_row))){0}), '[]')::text \
+                       AS body FROM ({1}) result_row".format(order, query)
 
-    def get_logger(self):
-        self.curs.execute("SELECT * FROM logger;")
+    pageable_tables = ("customer", "recipient", "logger", "feed_item")
+
+    @replica_read
+    def get_page(self, table, after=None, limit=100):
+        if table not in self.pageable_tables:
+            raise ValueError("table %s can't be paged" % table)
+        self.curs.execute("SELECT * FROM {0} WHERE id > %s ORDER BY id LIMIT %s".format(table),
+                          (after or 0, limit))
         return self.curs.fetchall()
 
+    """
+    Read a whole table through a server-side cursor, chunk_size rows per round trip, so only
+    one chunk is in memory at a time. Must be consumed before disconnect().
+    Returns:
+        generator of lists of rows, ordered by id
+    """
+
+    def stream_table(self, table, chunk_size=1000, row_mode="namedtuple"):
+        if table not in self.pageable_tables:
+            raise ValueError("table %s can't be streamed" % table)
+        curs = self.list_cursor("stream_%s" % table, row_mode)
+        try:
+            curs.execute("SELECT * FROM {0} ORDER BY id".format(table))
+            while True:
+                rows = curs.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            curs.close()
+
     def get_customer(self, email):
         self.curs.execute(
             "SELECT * FROM customer WHERE email = %s", (email,))
         return self.curs.fetchone()
 
     def delete_customer(self, email):
+        self.forget_roles(email)
         self.curs.execute(
             "DELETE FROM recipient WHERE email = '{0}';".format(email))
         self.curs.execute(
@@ -114,7 +396,7 @@ class PgInstance:
     """
 
     def get_customer_by_email(self, email):
-        self.curs.execute("SELECT * FROM customer WHERE email=%s", (email,))
+        self.execute_prepared("customer_by_email", (email,))
         return self.curs.fetchone()  # We should never get more than one
 
     def get_donor_by_email(self, email):
@@ -122,7 +404,7 @@ class PgInstance:
         return self.curs.fetchone()  # We should never get more than one
 
     def get_restaurant_by_email(self, email):
-        self.curs.execute("SELECT * FROM restaurant WHERE email=%s", (email,))
+        self.execute_prepared("restaurant_by_email", (email,))
         return self.curs.fetchone()  # We should never get more than one
 
     def get_restaurant_by_id(self, id):
@@ -140,17 +422,40 @@ class PgInstance:
     """
 
     def is_eligible_email(self, email):
-        restaurant_row = self.get_restaurant_by_email(email)
-        recipient_row = self.get_recipient_by_email(email)
-        donor_row = self.get_donor_by_email(email)
-        if restaurant_row != None or recipient_row != None or donor_row != None:
-            return False
-        row = self.get_customer_by_email(email)
-        if row == None:
+        return self.eligible(self.get_role_memberships(email))
+
+    @staticmethod
+    def eligible(roles):
+        if roles.restaurant or roles.recipient or roles.donor:
             return False
-        return True
+        return roles.customer
+
+    """
+    Which of the customer/restaurant/recipient/donor/admin tables have a row for email,
+    resolved in a single query. Emails with any role are cached in role_cache once the
+    transaction that read them commits.
+    Returns:
+        named tuple of booleans
+    """
+
+    role_memberships_query = "SELECT EXISTS(SELECT 1 FROM customer WHERE email=%(email)s) AS customer, \
+                                     EXISTS(SELECT 1 FROM restaurant WHERE email=%(email)s) AS restaurant, \
+                                     EXISTS(SELECT 1 FROM recipient WHERE email=%(email)s) AS recipient, \
+                                     EXISTS(SELECT 1 FROM donor WHERE email=%(email)s) AS donor, \
+                                     EXISTS(SELECT 1 FROM admin WHERE email=%(email)s) AS admin"
+
+    def get_role_memberships(self, email):
+        found, roles = role_cache.lookup(role_key(email))
+        if found:
+            return roles
+        self.curs.execute(self.role_memberships_query, {"email": email})
+        roles = self.curs.fetchone()
+        if any(roles):
+            self.pending_roles()[role_key(email)] = roles
+        return roles
 
     def create_customer(self, email, name, phone, password_hash = None, verified = False):
+        self.forget_roles(email)
         row = self.get_customer_by_email(email)
         if row == None or getattr(row, "password") == None:
             if row != None and getattr(row, "password") == None:
@@ -172,6 +477,7 @@ class PgInstance:
 
     def create_donor(self, email, venmo):
         if self.is_eligible_email(email):
+            self.forget_roles(email)
             self.curs.execute(
                 "INSERT INTO donor (email, venmo) VALUES (%s, %s)", (email, venmo))
             return None
@@ -179,6 +485,7 @@ class PgInstance:
 
     def create_recipient(self, email, image_url = None):
         if self.is_eligible_email(email):
+            self.forget_roles(email)
             if (image_url == None):
                 self.curs.execute(
                     "INSERT INTO recipient (email) VALUES (%s)", (email,))
@@ -190,6 +497,7 @@ class PgInstance:
 
     def create_restaurant(self, email, address, restaurant_name):
         if self.is_eligible_email(email):
+            self.forget_roles(email)
             self.curs.execute(
                 "INSERT INTO restaurant (email, address1, restaurant_name) VALUES (%s, %s, %s)",
                 (email, address, restaurant_name)
@@ -197,6 +505,121 @@ class PgInstance:
             return None
         return "invalid email, already taken"
 
+    # role table -> columns filled from sign_up()'s role_fields, besides email
+    sign_up_role_columns = {
+        "recipient": ("image_url",),
+        "restaurant": ("address1", "restaurant_name"),
+        "donor": ("venmo",),
+    }
+
+    """
+    Create the customer and its recipient/restaurant/donor row in one statement.
+    Same rules as create_customer followed by create_<role>: a customer without a password
+    (left over from the OTP flow) is taken over, any other existing customer or role row
+    makes the email unavailable. Concurrent sign-ups for one email are settled by the
+    unique email constraints rather than by prior reads, and a refused sign-up is rolled
+    back to the savepoint taken just before it.
+    Returns:
+        (None, None) if successful, else (error, table that refused the email)
+    """
+
+    def sign_up(self, role, email, name, phone, password_hash, verified=False, **role_fields):
+        self.forget_roles(email)
+        self.curs.execute("SAVEPOINT sign_up; " + self.sign_up_query(role),
+                          dict(role_fields, email=email, name=name, phone=phone, password=password_hash, verified=verified))
+        err, err_source = self.sign_up_error(role, self.curs.fetchone())
+        if err_source != None:
+            self.curs.execute("ROLLBACK TO SAVEPOINT sign_up")  # don't keep a customer row without its role row
+        return err, err_source
+
+    """
+    Create recipients from rows of (line, email, name, phone, image_url) in one statement, like
+    sign_up_customer followed by a recipient row: customers without a password, who set one
+    through the OTP flow. The rows are loaded with COPY into a temporary table first. Emails
+    already used by a customer or role row are left alone.
+    Returns:
+        (number of recipients created, lines whose email was taken)
+    """
+
+    def import_recipients(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        self.curs.execute("CREATE TEMP TABLE recipient_import ( \
+                                line INTEGER, email TEXT, name TEXT, phone TEXT, image_url TEXT \
+                            ) ON COMMIT DROP")
+        self.curs.copy_expert("COPY recipient_import FROM STDIN WITH (FORMAT csv)", buffer)
+        self.curs.execute(
+            "WITH taken AS ( \
+                SELECT line, email FROM recipient_import i \
+                WHERE EXISTS (SELECT 1 FROM customer WHERE email = i.email) \
+                   OR EXISTS (SELECT 1 FROM restaurant WHERE email = i.email) \
+                   OR EXISTS (SELECT 1 FROM recipient WHERE email = i.email) \
+                   OR EXISTS (SELECT 1 FROM donor WHERE email = i.email) \
+            ), new_customer AS ( \
+                INSERT INTO customer (email, name, phone, verified) \
+                SELECT email, name, ARRAY[phone], FALSE FROM recipient_import \
+                WHERE line NOT IN (SELECT line FROM taken) \
+                RETURNING email \
+            ), new_recipient AS ( \
+                INSERT INTO recipient (email, image_url) \
+                SELECT email, image_url FROM recipient_import JOIN new_customer USING (email) \
+                RETURNING 1 \
+            ) \
+            SELECT (SELECT count(*) FROM new_recipient) AS imported, \
+                   ARRAY(SELECT line FROM taken ORDER BY line) AS taken_lines")
+        row = self.curs.fetchone()
+        for line, email, name, phone, image_url in rows:
+            self.forget_roles(email)
+        return getattr(row, "imported"), getattr(row, "taken_lines")
+
+    @classmethod
+    def sign_up_query(cls, role):
+        columns = cls.sign_up_role_columns[role]
+        return "WITH taken AS ( \
+                SELECT email FROM restaurant WHERE email = %(email)s \
+                UNION ALL SELECT email FROM recipient WHERE email = %(email)s \
+                UNION ALL SELECT email FROM donor WHERE email = %(email)s \
+            ), new_customer AS ( \
+                INSERT INTO customer (email, name, phone, password, verified) \
+                SELECT %(email)s, %(name)s, %(phone)s, %(password)s, %(verified)s \
+                WHERE NOT EXISTS (SELECT 1 FROM taken) \
+                ON CONFLICT (email) DO UPDATE \
+                SET name = EXCLUDED.name, phone = EXCLUDED.phone, \
+                    password = EXCLUDED.password, verified = EXCLUDED.verified \
+                WHERE customer.password IS NULL \
+                RETURNING id, email \
+            ), new_role AS ( \
+                INSERT INTO {role} (email, {columns}) \
+                SELECT email, {values} FROM new_customer \
+                ON CONFLICT (email) DO NOTHING \
+                RETURNING id \
+            ) \
+            SELECT (SELECT id FROM new_customer) AS customer_id, \
+                   (SELECT id FROM new_role) AS role_id, \
+                   EXISTS (SELECT 1 FROM taken) AS role_taken, \
+                   EXISTS (SELECT 1 FROM customer WHERE email = %(email)s AND password IS NOT NULL) AS customer_taken".format(
+            role=role,
+            columns=", ".join(columns),
+            values=", ".join("%({0})s".format(column) for column in columns))
+
+    """
+    Returns:
+        (None, None) if the sign_up_query row shows both rows were created, else
+        (error, table that refused the email)
+    """
+
+    @staticmethod
+    def sign_up_error(role, row):
+        err_source = None
+        if getattr(row, "customer_taken") or (getattr(row, "customer_id") == None and not getattr(row, "role_taken")):
+            err_source = "customer"
+        elif getattr(row, "role_id") == None:
+            err_source = role
+        if err_source != None:
+            return "invalid email, already taken", err_source
+        return None, None
+
     def update_customer_name(self, email, name):
         self.curs.execute(
             "UPDATE customer SET name=%s WHERE email=%s", (name, email))
@@ -239,7 +662,7 @@ class PgInstance:
         return self.curs.fetchone()
 
     def get_recipient_by_email(self, email):
-        self.curs.execute("SELECT * FROM recipient WHERE email=%s", (email,))
+        self.execute_prepared("recipient_by_email", (email,))
         return self.curs.fetchone()  # We should never get more than one
 
     def get_admin_by_email(self, email):
@@ -271,6 +694,65 @@ class PgInstance:
                            RETURNING *", (utc_now, ))
         return self.curs.fetchall()
 
+    """
+    Set-based version of cancel_day_old_donatin_claims followed by restaurant_recipient_refund
+    for each cancelled claim: cancels, refunds restaurants and recipients and writes the same
+    per-claim "cancel" log lines in one statement, whatever the number of claims.
+    Returns:
+        dict with counts, total amount refunded and elapsed seconds
+    """
+
+    cancel_and_refund_query = "WITH cancelled AS ( \
+            UPDATE donation_claim SET active = FALSE \
+            WHERE active = TRUE AND pickup_time + INTERVAL '1 days' < %(now)s \
+            RETURNING id, restaurant_id, recipient_email, COALESCE(amount, 0) AS amount \
+        ), refunded_restaurants AS ( \
+            UPDATE restaurant SET available_credits = restaurant.available_credits + total.amount \
+            FROM (SELECT restaurant_id, sum(amount) AS amount FROM cancelled GROUP BY restaurant_id) total \
+            WHERE restaurant.id = total.restaurant_id \
+            RETURNING restaurant.id, restaurant.email, restaurant.available_credits - total.amount AS credits_before \
+        ), refunded_recipients AS ( \
+            UPDATE recipient SET available_credits = recipient.available_credits + total.amount \
+            FROM (SELECT recipient_email, sum(amount) AS amount FROM cancelled GROUP BY recipient_email) total \
+            WHERE recipient.email = total.recipient_email \
+            RETURNING recipient.email, recipient.available_credits - total.amount AS credits_before \
+        ), running AS ( \
+            SELECT id, restaurant_id, recipient_email, amount, \
+                   sum(amount) OVER (PARTITION BY restaurant_id ORDER BY id) AS restaurant_refunded, \
+                   sum(amount) OVER (PARTITION BY recipient_email ORDER BY id) AS recipient_refunded \
+            FROM cancelled \
+        ), logged AS ( \
+            INSERT INTO logger (email, time, category, message) \
+            SELECT email, %(now)s, 'cancel', message FROM ( \
+                SELECT running.id, 0 AS side, refunded_restaurants.email, \
+                       format('cancel #%%s: restaurant credit: %%s -> %%s', running.id, \
+                              refunded_restaurants.credits_before + running.restaurant_refunded - running.amount, \
+                              refunded_restaurants.credits_before + running.restaurant_refunded) AS message \
+                FROM running JOIN refunded_restaurants ON refunded_restaurants.id = running.restaurant_id \
+                UNION ALL \
+                SELECT running.id, 1, refunded_recipients.email, \
+                       format('cancel #%%s: recipient credit: %%s -> %%s', running.id, \
+                              refunded_recipients.credits_before + running.recipient_refunded - running.amount, \
+                              refunded_recipients.credits_before + running.recipient_refunded) \
+                FROM running JOIN refunded_recipients ON refunded_recipients.email = running.recipient_email \
+                ORDER BY 1, 2 \
+            ) entries \
+            RETURNING 1 \
+        ) \
+        SELECT (SELECT count(*) FROM cancelled) AS claims_cancelled, \
+               (SELECT COALESCE(sum(amount), 0) FROM cancelled) AS amount_refunded, \
+               (SELECT count(*) FROM refunded_restaurants) AS restaurants_refunded, \
+               (SELECT count(*) FROM refunded_recipients) AS recipients_refunded, \
+               (SELECT count(*) FROM logged) AS log_entries"
+
+    def cancel_and_refund_day_old_donation_claims(self):
+        start = time.perf_counter()
+        utc_now = datetime.now(pytz.timezone("UTC"))
+        self.curs.execute(self.cancel_and_refund_query, {"now": utc_now})
+        report = self.curs.fetchone()._asdict()
+        report["seconds"] = time.perf_counter() - start
+        return report
+
     def cancel_order(self, order_id, canceled_by = None):
         if (canceled_by):
             self.curs.execute("UPDATE donation_claim SET active = FALSE, canceled_by = %s where id = %s",(canceled_by, order_id))
@@ -298,6 +780,95 @@ class PgInstance:
                             WHERE new_recipients.available_credits IS NOT NULL;")
         return self.curs.fetchall()
 
+    """
+    refresh_recipeint_credits for recipients with after_id < id <= the chunk_size-th id past it,
+    so only that range is locked until the caller commits.
+    Returns:
+        (last id in the range or None if there are no more recipients, recipients in the range,
+         changed rows)
+    """
+
+    def refresh_recipient_credits_range(self, after_id, chunk_size):
+        self.curs.execute("SELECT max(id) AS last_id, count(*) AS scanned FROM ( \
+                                SELECT id FROM recipient WHERE id > %s ORDER BY id LIMIT %s \
+                            ) chunk", (after_id, chunk_size))
+        chunk = self.curs.fetchone()
+        last_id = getattr(chunk, "last_id")
+        if last_id == None:
+            return None, 0, []
+        self.curs.execute("UPDATE recipient SET available_credits = credit_limit \
+                            FROM (SELECT id, available_credits FROM recipient \
+                                  WHERE id > %s AND id <= %s FOR UPDATE) old_recipients \
+                            WHERE recipient.id = old_recipients.id \
+                            AND recipient.available_credits != recipient.credit_limit \
+                            RETURNING recipient.email, \
+                                      old_recipients.available_credits AS previous_credits, \
+                                      recipient.available_credits, \
+                                      recipient.credit_limit", (after_id, last_id))
+        return last_id, getattr(chunk, "scanned"), self.curs.fetchall()
+
+    'job_progress: checkpoints of resumable jobs, see credit_refresh.py'
+
+    # run once per database (flask install-job-runs), not by the jobs: the ALTER locks the table
+    def create_job_progress_table(self):
+        self.curs.execute("CREATE TABLE IF NOT EXISTS job_progress ( \
+                                job TEXT PRIMARY KEY, \
+                                last_id INTEGER NOT NULL, \
+                                updated TIMESTAMPTZ NOT NULL DEFAULT NOW()); \
+                           ALTER TABLE job_progress ADD COLUMN IF NOT EXISTS cycle BIGINT")
+
+    """
+    Returns:
+        last id checkpointed by job in cycle, None if it has no checkpoint of that cycle
+    """
+
+    def get_job_progress(self, job, cycle):
+        self.curs.execute("SELECT last_id FROM job_progress WHERE job = %s AND cycle = %s", (job, cycle))
+        row = self.curs.fetchone()
+        return None if row == None else getattr(row, "last_id")
+
+    def set_job_progress(self, job, last_id, cycle):
+        self.curs.execute("INSERT INTO job_progress (job, last_id, cycle) VALUES (%s, %s, %s) \
+                            ON CONFLICT (job) DO UPDATE \
+                            SET last_id = EXCLUDED.last_id, cycle = EXCLUDED.cycle, updated = NOW()",
+                          (job, last_id, cycle))
+
+    def clear_job_progress(self, job):
+        self.curs.execute("DELETE FROM job_progress WHERE job = %s", (job,))
+
+    'job_run: history of scheduled job runs, see scheduler.py'
+
+    def create_job_run_table(self):
+        self.curs.execute("CREATE TABLE IF NOT EXISTS job_run ( \
+                                id SERIAL PRIMARY KEY, \
+                                job TEXT NOT NULL, \
+                                started TIMESTAMPTZ NOT NULL, \
+                                seconds DOUBLE PRECISION NOT NULL, \
+                                rows_affected INTEGER, \
+                                error TEXT); \
+                           CREATE INDEX IF NOT EXISTS job_run_job_started ON job_run (job, started)")
+
+    """
+    Session-level advisory lock held by whichever connection runs job, on any instance
+    Returns:
+        True if taken, False if another session holds it
+    """
+
+    def try_job_lock(self, job):
+        self.curs.execute("SELECT pg_try_advisory_lock(hashtext('job_run'), hashtext(%s)) AS locked", (job,))
+        return getattr(self.curs.fetchone(), "locked")
+
+    def release_job_lock(self, job):
+        self.curs.execute("SELECT pg_advisory_unlock(hashtext('job_run'), hashtext(%s))", (job,))
+
+    def get_last_job_run(self, job):
+        self.curs.execute("SELECT max(started) AS started FROM job_run WHERE job = %s AND error IS NULL", (job,))
+        return getattr(self.curs.fetchone(), "started")
+
+    def record_job_run(self, job, started, seconds, rows_affected, error=None):
+        self.curs.execute("INSERT INTO job_run (job, started, seconds, rows_affected, error) \
+                            VALUES (%s, %s, %s, %s, %s)", (job, started, seconds, rows_affected, error))
+
     def restaurant_credit_cancel(self, restaurant_id, amount):
         self.curs.execute("UPDATE restaurant SET available_credits=available_credits + %s \
                             WHERE id=%s", (amount, restaurant_id))
@@ -353,14 +924,17 @@ class PgInstance:
                           (feed_item_type, msg, amount))
         return self.curs.fetchone()
 
+    @replica_read
     def get_feed_limited(self):
         self.curs.execute(
             "SELECT * FROM feed_item ORDER BY created ASC LIMIT 7")
         return self.curs.fetchall()
 
-    def get_feed(self):
-        self.curs.execute("SELECT * FROM feed_item")
-        return self.curs.fetchall()
+    @replica_read
+    def get_feed(self, after=None, limit=None):
+        if limit != None:
+            return self.get_page("feed_item", after, limit)
+        return self.fetch_list("SELECT * FROM feed_item")
 
     def get_all_donations(self):
         self.curs.execute("SELECT * FROM donation")
@@ -381,8 +955,7 @@ class PgInstance:
             "INSERT INTO email_otp (email, code, expiresAt) VALUES (%s, %s, %s)", (email, code, expiresAt))
 
     def verify_otp(self, email, otp):
-        self.curs.execute(
-            "SELECT * FROM email_otp WHERE email = %s AND code = %s AND expiresat > NOW()", (email, otp))
+        self.execute_prepared("verify_otp", (email, otp))
         row = self.curs.fetchone()
         if row is None:
             return False
@@ -411,30 +984,116 @@ class PgInstance:
             "SELECT * FROM donation_claim WHERE restaurant_id = %s AND active=TRUE", (restaurant_id,))
         return self.curs.fetchall()
 
+    def get_active_donation_claims_json(self, restaurant_id):
+        return self.fetch_json(
+            "SELECT * FROM donation_claim WHERE restaurant_id = %s AND active=TRUE", (restaurant_id,))
+
     def get_inactive_donation_claims(self, restaurant_id):
         self.curs.execute(
             "SELECT * FROM donation_claim WHERE restaurant_id = %s AND active=FALSE", (restaurant_id,))
         return self.curs.fetchall()
 
+    def get_inactive_donation_claims_json(self, restaurant_id):
+        return self.fetch_json(
+            "SELECT * FROM donation_claim WHERE restaurant_id = %s AND active=FALSE", (restaurant_id,))
+
+    """
+    Create the metric_counter table and the triggers that maintain it, then count everything
+    once. Run once per database (flask install-metric-counters); safe to re-run.
+    """
+
+    def install_metric_counters(self):
+        self.curs.execute(METRIC_COUNTER_SCHEMA)
+        self.curs.execute(METRIC_COUNTER_BACKFILL)
+
+    # set once metric_counter_delta has been seen, so the check isn't repeated on every load
+    metric_counters_installed = False
+
+    def has_metric_counters(self):
+        if not PgInstance.metric_counters_installed:
+            self.curs.execute("SELECT to_regclass('metric_counter_delta') IS NOT NULL AS installed")
+            PgInstance.metric_counters_installed = getattr(self.curs.fetchone(), "installed")
+        return PgInstance.metric_counters_installed
+
+    # changes left in metric_counter_delta past which the read that finds them rolls them up
+    metric_rollup_threshold = int(os.environ.get("METRIC_ROLLUP_THRESHOLD", 10000))
+
+    """
+    All metric counters, from metrics_cache or a single read of metric_counter and the changes
+    not rolled up yet, which are rolled up when there are metric_rollup_threshold of them
+    Returns:
+        dict of metric name to value
+    """
+
+    def get_metric_counters(self):
+        def load():
+            counters, pending = self.read_metric_counters()
+            if pending >= self.metric_rollup_threshold:
+                self.try_roll_up_metric_counters()
+            return counters
+        return metrics_cache.get(load)
+
+    metric_counters_query = "SELECT name, sum(value) AS value, count(*) FILTER (WHERE pending) AS pending FROM ( \
+                                 SELECT name, value, FALSE AS pending FROM metric_counter \
+                                 UNION ALL SELECT name, delta, TRUE FROM metric_counter_delta) counters \
+                             GROUP BY name"
+
+    """
+    Returns:
+        (dict of metric name to value, number of changes not rolled up yet), counted from the
+        tables until the counters are installed
+    """
+
+    @replica_read
+    def read_metric_counters(self):
+        if not self.has_metric_counters():
+            self.curs.execute(METRIC_TOTALS)
+            return {getattr(row, "name"): getattr(row, "value") for row in self.curs.fetchall()}, 0
+        self.curs.execute(self.metric_counters_query)
+        rows = self.curs.fetchall()
+        return {getattr(row, "name"): getattr(row, "value") for row in rows}, sum(getattr(row, "pending") for row in rows)
+
+    """
+    Fold the changes appended to metric_counter_delta into metric_counter
+    Returns:
+        number of changes moved
+    """
+
+    def roll_up_metric_counters(self):
+        if not self.has_metric_counters():
+            return 0
+        self.curs.execute(METRIC_COUNTER_ROLLUP)
+        return getattr(self.curs.fetchone(), "moved")
+
+    # roll_up_metric_counters within the caller's transaction, which a failed roll-up leaves usable
+    def try_roll_up_metric_counters(self):
+        self.curs.execute("SAVEPOINT metric_rollup")
+        try:
+            self.roll_up_metric_counters()
+        except psycopg2.Error as e:
+            print("ERROR: metric roll-up failed: %s" % e)
+            self.curs.execute("ROLLBACK TO SAVEPOINT metric_rollup")
+            return
+        self.curs.execute("RELEASE SAVEPOINT metric_rollup")
+
+    def get_metric(self, name):
+        return metric_value(self.get_metric_counters(), name)
+
+    # get_num_* return a one-column row like the aggregate queries they replaced
     def get_num_meals(self):
-        self.curs.execute("SELECT sum(json_array_length(meal_items)) FROM donation_claim")
-        return self.curs.fetchone()
+        return SumRow(self.get_metric("num_meals"))
 
     def get_num_restaurants(self):
-        self.curs.execute("SELECT COUNT(*) FROM restaurant")
-        return self.curs.fetchone()
+        return CountRow(self.get_metric("num_restaurants"))
 
     def get_num_donors(self):
-        self.curs.execute("SELECT COUNT(*) FROM donor")
-        return self.curs.fetchone()
+        return CountRow(self.get_metric("num_donors"))
 
     def get_num_recipients(self):
-        self.curs.execute("SELECT COUNT(*) FROM recipient where approved=True")
-        return self.curs.fetchone()
+        return CountRow(self.get_metric("num_recipients"))
     
     def get_num_children(self):
-        self.curs.execute("SELECT sum(COALESCE(num_children_18,0) + COALESCE(num_children_13,0))  FROM recipient where approved=True")
-        return self.curs.fetchone()
+        return SumRow(self.get_metric("num_children"))
 
     # SHOULD BE USED ONLY IN TESTING MODULES. DO NOT USE IN LIVE CODE.
     def insert_test_data(self, query):
@@ -472,9 +1131,14 @@ class PgInstance:
                           (email,))
         return self.curs.fetchall()
 
+    # each row a one-element array holding the order object, like get_past_orders_by_recipient
+    def get_past_orders_by_recipient_json(self, email):
+        self.curs.execute("SELECT COALESCE(json_agg(json_build_array(row_to_json(row)) ORDER BY created DESC), '[]')::text \
+                                AS body FROM donation_claim row WHERE recipient_email = %s", (email,))
+        return RawJSON(getattr(self.curs.fetchone(), "body"))
+
     def get_restaurant_id_from_user_info(self):
-        self.curs.execute(
-            "SELECT id FROM restaurant WHERE email = %s", (g.email,))
+        self.execute_prepared("restaurant_id_by_email", (g.email,))
         return getattr(self.curs.fetchone(), "id")
 
     def get_restaurant_id_from_email(self, email):
@@ -504,35 +1168,108 @@ class PgInstance:
         return self.curs.fetchall()
 
     def add_menu_item(self, menu_item):
+        restaurant_id = self.get_restaurant_id_from_user_info()
         self.curs.execute("INSERT INTO menu_item (restaurant_id, name, description, imageUrl, baseCost, "
                           "category, customizations, available) "
                           "VALUES (%s, %s, %s, %s, %s, %s, %s, True) RETURNING id",
-                          (self.get_restaurant_id_from_user_info(), menu_item["name"], menu_item["description"],
+                          (restaurant_id, menu_item["name"], menu_item["description"],
                            menu_item["imageUrl"], menu_item["baseCost"], menu_item["category"], []))
-        return self.curs.fetchone()
+        row = self.curs.fetchone()
+        self.bump_menu_version(restaurant_id)
+        return row
+
+    """
+    add_menu_item for many items of one restaurant, in multi-row inserts of page_size items.
+    items are (name, description, image_url, base_cost, category) tuples.
+    Returns:
+        number of items added
+    """
+
+    def import_menu_items(self, restaurant_id, items, page_size=1000):
+        psycopg2.extras.execute_values(
+            self.curs,
+            "INSERT INTO menu_item (restaurant_id, name, description, imageUrl, baseCost, category, customizations, available) \
+             VALUES %s",
+            [(restaurant_id, name, description, image_url, base_cost, category, [], True)
+             for name, description, image_url, base_cost, category in items],
+            page_size=page_size)
+        self.bump_menu_version(restaurant_id)
+        return len(items)
 
     def delete_menu_item(self, menu_item_id):
+        restaurant_id = self.get_restaurant_id_from_user_info()
         self.curs.execute("DELETE FROM menu_item WHERE restaurant_id = %s AND id = %s",
-                          (self.get_restaurant_id_from_user_info(), menu_item_id, ))
+                          (restaurant_id, menu_item_id, ))
+        self.bump_menu_version(restaurant_id)
 
     def update_menu_item(self, menu_item_id, updated_menu_item):
+        restaurant_id = self.get_restaurant_id_from_user_info()
         self.curs.execute("UPDATE menu_item SET name = %s, description = %s, imageUrl = %s, baseCost = %s, "
                           "category = %s, customizations = %s, available = %s "
                           "WHERE restaurant_id = %s AND id = %s",
                           (updated_menu_item["name"], updated_menu_item["description"], updated_menu_item["imageUrl"],
                            updated_menu_item["baseCost"], updated_menu_item["category"], updated_menu_item[
                                'customizations'], updated_menu_item['available'],
-                           self.get_restaurant_id_from_user_info(), menu_item_id))
+                           restaurant_id, menu_item_id))
+        self.bump_menu_version(restaurant_id)
+
+    def create_menu_version_table(self):
+        self.curs.execute("CREATE TABLE IF NOT EXISTS menu_version ( \
+                                restaurant_id INTEGER PRIMARY KEY, \
+                                version BIGINT NOT NULL)")
+
+    # set once menu_version has been seen, so the check isn't repeated on every menu read or write
+    menu_versions_installed = False
+
+    def has_menu_version_table(self):
+        if not PgInstance.menu_versions_installed:
+            self.curs.execute("SELECT to_regclass('menu_version') IS NOT NULL AS installed")
+            PgInstance.menu_versions_installed = getattr(self.curs.fetchone(), "installed")
+        return PgInstance.menu_versions_installed
+
+    """
+    Version of a restaurant's menu, moved forward by every menu_item writer above; menus
+    that were never written are at version 0.
+    Returns:
+        int, from menu_versions when read in the last MENU_VERSION_TTL seconds, or None
+        until `flask install-menu-versions` has been run
+    """
+
+    def get_menu_version(self, restaurant_id):
+        found, version = menu_versions.lookup(restaurant_id)
+        if found:
+            return version
+        if not self.has_menu_version_table():
+            return None
+        self.curs.execute("SELECT version FROM menu_version WHERE restaurant_id = %s", (restaurant_id,))
+        row = self.curs.fetchone()
+        version = 0 if row == None else getattr(row, "version")
+        menu_versions.set(restaurant_id, version)
+        return version
+
+    def bump_menu_version(self, restaurant_id):
+        menu_versions.pop(restaurant_id)
+        if not self.has_menu_version_table():
+            return
+        self.curs.execute("INSERT INTO menu_version (restaurant_id, version) VALUES (%s, 1) \
+                            ON CONFLICT (restaurant_id) DO UPDATE SET version = menu_version.version + 1",
+                          (restaurant_id,))
 
     # def get_all_menu_items_for_restaurant(self):
     #     self.curs.execute("SELECT * FROM menu_item WHERE restaurant_id = %s", (self.get_restaurant_id_from_user_info(),))
     #     return self.curs.fetchall()
 
+    @replica_read
     def get_all_menu_items(self, restaurant_id, bottom=0):
         self.curs.execute(
             "SELECT * FROM menu_item WHERE restaurant_id = %s AND id > %s LIMIT 49", (restaurant_id, bottom))
         return self.curs.fetchall()
 
+    @replica_read
+    def get_all_menu_items_json(self, restaurant_id, bottom=0):
+        return self.fetch_json(
+            "SELECT * FROM menu_item WHERE restaurant_id = %s AND id > %s LIMIT 49", (restaurant_id, bottom))
+
     def get_menu_item_price(self, restaurant_id, item_id):
         try:
             self.curs.execute(
@@ -557,14 +1294,14 @@ class PgInstance:
                           (itemid, rest_id, menu_item["name"], menu_item["description"],
                            menu_item["imageUrl"], menu_item["baseCost"], menu_item["category"], []))
         id = self.curs.fetchone()
+        self.bump_menu_version(rest_id)
         self.commit()
         self.curs.execute("SELECT * FROM menu_item")
         print(self.curs.fetchall())
         return id
 
     def get_distribution_total(self):
-        self.curs.execute("SELECT SUM(distributed_credits) FROM distribution")
-        return self.curs.fetchone()
+        return SumRow(self.get_metric("distribution_total"))
 
     def create_distribution(self, distributed_credits, restaurants_json):
         self.curs.execute("INSERT INTO distribution (distributed_credits, restaurants) VALUES (%s, %s)",
@@ -579,25 +1316,23 @@ class PgInstance:
         return self.curs.fetchone()
 
     def get_role(self, email):
-        restaurant_row = self.get_restaurant_by_email(email)
-        if restaurant_row != None:
+        return self.role_name(self.get_role_memberships(email))
+
+    @staticmethod
+    def role_name(roles):
+        if roles.restaurant:
             return "Business"
-        recipient_row = self.get_recipient_by_email(email)
-        if recipient_row != None:
+        if roles.recipient:
             return "Recipient"
-        donor_row = self.get_donor_by_email(email)
-        if donor_row != None:
+        if roles.donor:
             return "Donor"
-        admin_row = self.get_admin_by_email(email)
-        if admin_row != None:
+        if roles.admin:
             return "Admin"
         return None
 
+    # written with the transaction's other audit entries when it commits, see auditlog.py
     def log(self, email, category, message):
-        utc_tz = pytz.timezone("UTC")
-        utc_now = datetime.now(utc_tz)
-        self.curs.execute("INSERT INTO logger (email, time, category, message) VALUES (%s, %s, %s, %s)",
-                          (email, utc_now, category, message))
+        pending_log.add(self.conn, email, category, message)
 
 
     def restaurant_recipient_refund(self, order):
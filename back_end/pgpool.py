@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+from flask import g
+
+# Bounded, thread-safe pool of psycopg2 connections shared by every PgInstance in the process.
+# Inside a Flask request a single connection is checked out on first use, kept on `g` and
+# handed back by the teardown hook registered with init_app().
+#
+# With DATABASE_REPLICA_URL set, a second pool of autocommit connections to a read replica
+# serves the PgInstance methods marked @replica_read. A request reads from the primary instead
+# once it has written (so it sees its own writes), after mark_primary(), and while the replica
+# is failing, for DB_REPLICA_RETRY_AFTER seconds after each failure.
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PgPool:
+    def __init__(self, dsn=None, max_size=10, timeout=5.0, factory=None, **connect_kwargs):
+        self.dsn = dsn
+        self.max_size = max_size
+        # seconds a caller waits for a free connection before PoolTimeout
+        self.timeout = timeout
+        self.factory = factory or psycopg2.connect
+        self.connect_kwargs = connect_kwargs
+        self._idle = deque()
+        self._size = 0  # connections opened and not yet discarded
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+
+    """
+    Check out a connection, opening a new one if the pool is below max_size, otherwise
+    blocking until one is returned.
+    Returns:
+        psycopg2 connection, raises PoolTimeout if none became free within timeout
+    """
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waited = False
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn = self._idle.pop()
+                    if not conn.closed:
+                        self._checkouts += 1
+                        return conn
+                    self._size -= 1
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if not waited:
+                    waited = True
+                    self._waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout("no database connection available after %ss" % timeout)
+                self._cond.wait(remaining)
+        try:
+            conn = self.factory(self.dsn, **self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._checkouts += 1
+        return conn
+
+    """
+    Return a connection to the pool. Any open transaction is rolled back so the next
+    borrower starts clean; broken connections are closed and their slot freed.
+    """
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn = self._idle.pop()
+                self._size -= 1
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "timeout": self.timeout,
+                "size": self._size,
+                "in_use": self._size - len(self._idle),
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+replica_url = os.environ.get("DATABASE_REPLICA_URL")
+_replica_pool = None
+_replica_down_until = 0.0
+replica_retry_after = float(os.environ.get("DB_REPLICA_RETRY_AFTER", 30))
+replica_stats = {"reads": 0, "primary_reads": 0, "failures": 0}
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PgPool(os.environ["DATABASE_URL"],
+                               max_size=int(os.environ.get("DB_POOL_SIZE", 10)),
+                               timeout=float(os.environ.get("DB_POOL_TIMEOUT", 5)),
+                               sslmode='require')
+    return _pool
+
+
+def connect_autocommit(dsn, **kwargs):
+    conn = psycopg2.connect(dsn, **kwargs)
+    conn.autocommit = True  # no transaction held open on the replica between reads
+    return conn
+
+
+def get_replica_pool():
+    global _replica_pool
+    if _replica_pool is None and replica_url:
+        with _pool_lock:
+            if _replica_pool is None:
+                _replica_pool = PgPool(replica_url,
+                                       max_size=int(os.environ.get("DB_REPLICA_POOL_SIZE", 10)),
+                                       timeout=float(os.environ.get("DB_REPLICA_POOL_TIMEOUT", 1)),
+                                       factory=connect_autocommit,
+                                       connect_timeout=int(os.environ.get("DB_REPLICA_CONNECT_TIMEOUT", 2)),
+                                       sslmode='require')
+    return _replica_pool
+
+
+def request_connection():
+    if "pg_conn" not in g:
+        g.pg_conn = get_pool().getconn()
+    return g.pg_conn
+
+
+"""
+Send the rest of the request's replica reads to the primary
+"""
+
+
+def mark_primary():
+    g.db_primary = True
+
+
+"""
+Returns:
+    the request's replica connection, or None when this read should go to the primary
+"""
+
+
+def request_replica_connection():
+    pool = get_replica_pool()
+    if pool is None:
+        return None
+    if g.get("db_primary") or time.monotonic() < _replica_down_until:
+        replica_stats["primary_reads"] += 1
+        return None
+    if "pg_replica_conn" not in g:
+        try:
+            g.pg_replica_conn = pool.getconn()
+        except Exception as e:
+            replica_failed(e)
+            replica_stats["primary_reads"] += 1
+            return None
+    replica_stats["reads"] += 1
+    return g.pg_replica_conn
+
+
+"""
+Stop using the replica for replica_retry_after seconds, discarding the request's connection
+"""
+
+
+def replica_failed(error):
+    global _replica_down_until
+    print("ERROR: read replica unavailable, reading from the primary: %s" % error)
+    replica_stats["failures"] += 1
+    _replica_down_until = time.monotonic() + replica_retry_after
+    conn = g.pop("pg_replica_conn", None)
+    if conn is not None:
+        get_replica_pool().putconn(conn, discard=True)
+
+
+def release_request_connection(exc=None):
+    conn = g.pop("pg_conn", None)
+    if conn is not None:
+        get_pool().putconn(conn)
+    conn = g.pop("pg_replica_conn", None)
+    if conn is not None:
+        get_replica_pool().putconn(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_request_connection)
@@ -0,0 +1,140 @@
+import bisect
+import os
+import sys
+import threading
+import time
+
+import psycopg2.extensions
+import psycopg2.extras
+from flask import g, has_app_context, request
+
+# In-process query and route timings. Every PgInstance cursor is an InstrumentedCursor, which
+# files each execute() under the PgInstance method that issued it; init_app() adds per-route
+# request latency and, with SERVER_TIMING set, a Server-Timing header showing db time.
+
+# upper bounds of the latency histogram buckets, in milliseconds
+buckets_ms = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+
+class Timing:
+    __slots__ = ("count", "errors", "rows", "total", "max", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * len(buckets_ms)
+
+    def add(self, seconds, rows, error):
+        self.count += 1
+        self.errors += error
+        self.rows += max(rows, 0)
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[bisect.bisect_left(buckets_ms, seconds * 1000)] += 1
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "avg_ms": self.total / self.count * 1000 if self.count else 0,
+            "max_ms": self.max * 1000,
+            "histogram": {str(bound): n for bound, n in zip(buckets_ms, self.histogram) if n},
+        }
+
+
+class TimingTable:
+    def __init__(self):
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, rows=0, error=False):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = Timing()
+            timing.add(seconds, rows, error)
+
+    def as_dict(self):
+        with self._lock:
+            return {name: timing.as_dict() for name, timing in sorted(self._timings.items())}
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+
+
+query_timings = TimingTable()
+route_timings = TimingTable()
+
+
+# PgInstance helpers (and cursor subclasses) that execute on behalf of their caller; timings go
+# to the caller instead
+wrapper_names = {"execute_prepared", "fetch_list", "fetch_json", "execute", "execute_values", "fetchone", "fetchall"}
+
+
+class InstrumentedMixin:
+    def execute(self, query, vars=None):
+        frame = sys._getframe(1)
+        while frame.f_code.co_name in wrapper_names:
+            frame = frame.f_back
+        caller = frame.f_code.co_name
+        start = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            record_query(caller, time.perf_counter() - start, 0, True)
+            raise
+        record_query(caller, time.perf_counter() - start, self.rowcount, False)
+        return result
+
+
+class InstrumentedCursor(InstrumentedMixin, psycopg2.extras.NamedTupleCursor):
+    pass
+
+
+# plain tuples, for large reads where building a namedtuple per row shows up
+class InstrumentedTupleCursor(InstrumentedMixin, psycopg2.extensions.cursor):
+    pass
+
+
+def record_query(name, seconds, rows, error):
+    query_timings.add(name, seconds, rows, error)
+    if has_app_context():
+        g.db_time = g.get("db_time", 0.0) + seconds
+        g.db_queries = g.get("db_queries", 0) + 1
+
+
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+# after_request is skipped when a view raises, so timings are recorded on teardown and this
+# only adds the header
+def add_server_timing(response):
+    if "request_start" not in g:
+        return response
+    g.response_status = response.status_code
+    if os.environ.get("SERVER_TIMING") == "1":
+        response.headers.add("Server-Timing", "db;dur=%.2f;desc=\"%s queries\"" % (
+            g.get("db_time", 0.0) * 1000, g.get("db_queries", 0)))
+        response.headers.add("Server-Timing", "app;dur=%.2f" % ((time.perf_counter() - g.request_start) * 1000))
+    return response
+
+
+def record_request(exc):
+    if "request_start" not in g:
+        return
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    error = exc is not None or g.get("response_status", 500) >= 500
+    route_timings.add("%s %s" % (request.method, route), elapsed, 0, error)
+
+
+def init_app(app):
+    app.before_request(start_request_timer)
+    app.after_request(add_server_timing)
+    app.teardown_request(record_request)
@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from credit_refresh import CreditRefreshJob, commit, refresh_interval
+from pg.pginstance import PgInstance
+
+# Runs the maintenance jobs inside the app instead of from an external cron. Time is cut into
+# slots of each job's interval (counted from the epoch, so every instance agrees on them) and a
+# job runs once per slot: the instance whose timer fires first takes the job's advisory lock,
+# sees in job_run that nobody finished a run in this slot yet, runs it and records it. Other
+# instances either fail to take the lock or find the run recorded, so claims are never
+# cancelled and refunded twice. A failed run is recorded with its error and retried after
+# retry_delay, and so is a run whose commit fails. job_run and job_progress are created by
+# `flask install-job-runs`.
+
+
+class Job:
+    def __init__(self, name, interval, run):
+        self.name = name
+        self.interval = interval
+        # run(db) does the work on a connected PgInstance and returns the number of rows affected
+        self.run = run
+        self.next_run = 0
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_seconds = None
+        self.last_rows = None
+        self.last_error = None
+
+    def slot(self, now):
+        return int(now // self.interval)
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "next_run": self.next_run,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "last_started": self.last_started,
+            "last_seconds": self.last_seconds,
+            "last_rows": self.last_rows,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    def __init__(self, connect=PgInstance, clock=time.time, retry_delay=60.0, tick=30.0):
+        self.connect = connect
+        self.clock = clock
+        self.retry_delay = retry_delay
+        # longest sleep between checks, so a stop or a newly added job is noticed
+        self.tick = tick
+        self.jobs = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, name, interval, run):
+        self.jobs[name] = Job(name, interval, run)
+        return self.jobs[name]
+
+    """
+    Run every job whose next_run has come.
+    Returns:
+        {job name: "ran", "skipped", "failed" or an error connecting}
+    """
+
+    def run_pending(self):
+        results = {}
+        for job in list(self.jobs.values()):
+            if self.clock() >= job.next_run:
+                results[job.name] = self.run_job(job)
+        return results
+
+    def run_job(self, job):
+        now = self.clock()
+        db = self.connect()
+        # not the app context's connection: `flask run-scheduler` never leaves its app context,
+        # so a connection kept there would be reused after it died
+        err = db.connect(request_scoped=False)
+        if err is not None:
+            print("ERROR: scheduler could not connect for %s: %s" % (job.name, err))
+            job.next_run = now + self.retry_delay
+            return str(err)
+        try:
+            return self._run_locked(db, job, now)
+        except Exception as e:
+            print("ERROR: scheduler could not run %s: %s" % (job.name, e))
+            job.failures += 1
+            job.next_run = now + self.retry_delay
+            return str(e)
+        finally:
+            db.disconnect()
+
+    def _run_locked(self, db, job, now):
+        locked = db.try_job_lock(job.name)
+        commit(db)
+        if not locked:
+            job.skipped += 1
+            job.next_run = now + self.retry_delay  # check the other instance's run was recorded
+            return "skipped"
+        try:
+            last = db.get_last_job_run(job.name)
+            if last != None and job.slot(last.timestamp()) >= job.slot(now):
+                job.skipped += 1
+                job.next_run = (job.slot(now) + 1) * job.interval
+                return "skipped"
+            started = datetime.fromtimestamp(now, timezone.utc)
+            start = time.perf_counter()
+            try:
+                rows, error = job.run(db), None
+                commit(db)
+            except Exception as e:
+                db.rollback()
+                rows, error = None, "%s: %s" % (type(e).__name__, e)
+            seconds = time.perf_counter() - start
+            db.record_job_run(job.name, started, seconds, rows, error)
+            commit(db)
+        finally:
+            db.rollback()
+            db.release_job_lock(job.name)
+            db.commit()
+
+        job.last_started, job.last_seconds, job.last_rows, job.last_error = now, seconds, rows, error
+        if error != None:
+            print("ERROR: scheduled job %s failed: %s" % (job.name, error))
+            job.failures += 1
+            job.next_run = now + self.retry_delay
+            return "failed"
+        job.runs += 1
+        job.next_run = (job.slot(now) + 1) * job.interval
+        return "ran"
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run_forever, name="scheduler", daemon=True)
+                    self._thread.start()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                print("ERROR: scheduler: %s" % e)
+            next_run = min([job.next_run for job in self.jobs.values()] or [self.clock() + self.tick])
+            self._stop.wait(min(max(next_run - self.clock(), 0.1), self.tick))
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+
+def cancel_stale_claims(db):
+    report = db.cancel_and_refund_day_old_donation_claims()
+    print(report)
+    return report["claims_cancelled"]
+
+
+def roll_up_metric_counters(db):
+    return db.roll_up_metric_counters()
+
+
+def refresh_credits(db):
+    job = CreditRefreshJob(db)
+    for _ in job.run():
+        pass
+    print(job.report)
+    return job.report["updated"]
+
+
+scheduler = Scheduler()
+scheduler.add("cancel_stale_claims", float(os.environ.get("CANCEL_STALE_CLAIMS_INTERVAL", 3600)),
+              cancel_stale_claims)
+scheduler.add("roll_up_metric_counters", float(os.environ.get("METRIC_ROLLUP_INTERVAL", 300)),
+              roll_up_metric_counters)
+scheduler.add("refresh_credits", refresh_interval, refresh_credits)
+
+
+def start_scheduler():
+    scheduler.start()
+
+
+"""
+With SCHEDULER=1 the scheduler thread starts with the first request handled by the process
+(not at import, which may happen in a parent process that forks the workers)
+"""
+
+
+def init_app(app):
+    if os.environ.get("SCHEDULER", "0") == "1":
+        app.before_request(start_scheduler)
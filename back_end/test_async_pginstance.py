@@ -0,0 +1,88 @@
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+import async_pgpool
+from async_pginstance import AsyncPgInstance
+from pg.pginstance import role_cache
+
+Roles = namedtuple("Row", ["customer", "restaurant", "recipient", "donor", "admin"])
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+        self.rowcount = 1
+
+    async def execute(self, query, params=None, prepare=None):
+        self.statements.append(query)
+
+    async def fetchone(self):
+        return self.rows.pop(0)
+
+    async def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows, fail_commit=False):
+        self.rows = rows
+        self.fail_commit = fail_commit
+        self.closed = False
+
+    def cursor(self, row_factory=None):
+        return FakeCursor(self.rows)
+
+    async def commit(self):
+        if self.fail_commit:
+            raise ConnectionError("server closed the connection unexpectedly")
+
+    async def rollback(self):
+        pass
+
+    async def close(self):
+        self.closed = True
+
+
+def make_pool(*connections):
+    connections = list(connections)
+
+    async def connect(dsn, **kwargs):
+        return connections.pop(0)
+    return async_pgpool.AsyncPgPool(max_size=1, timeout=0.05, factory=connect)
+
+
+def test_roles_cached_once_committed(monkeypatch):
+    role_cache.clear()
+    diner = Roles(True, False, True, False, False)
+    monkeypatch.setattr(async_pgpool, "_pool", make_pool(FakeConnection([diner])))
+
+    async def run():
+        db = AsyncPgInstance()
+        assert await db.connect() == None
+        assert await db.get_role("Diner@Example.com") == "Recipient"
+        assert len(role_cache) == 0
+        assert await db.disconnect() == None
+        assert role_cache.lookup("diner@example.com") == (True, diner)
+    asyncio.run(run())
+    role_cache.clear()
+
+
+def test_failed_commit_discards_connection(monkeypatch):
+    role_cache.clear()
+    lost = FakeConnection([Roles(True, False, False, False, False)], fail_commit=True)
+    pool = make_pool(lost, FakeConnection([]))
+    monkeypatch.setattr(async_pgpool, "_pool", pool)
+
+    async def run():
+        db = AsyncPgInstance()
+        await db.connect()
+        await db.get_role_memberships("diner@example.com")
+        assert await db.disconnect() == "server closed the connection unexpectedly"
+        assert (db.conn, db.curs) == (None, None)
+        assert await async_pgpool.get_pool().getconn() is not lost
+    asyncio.run(run())
+    assert lost.closed
+    assert len(role_cache) == 0
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from psycopg import pq
+from async_pgpool import AsyncPgPool
+from pgpool import PoolTimeout
+
+
+class FakeInfo:
+    transaction_status = pq.TransactionStatus.IDLE
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.info = FakeInfo()
+        self.rollbacks = 0
+
+    async def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = pq.TransactionStatus.IDLE
+
+    async def close(self):
+        self.closed = True
+
+
+async def connect(dsn, **kwargs):
+    return FakeConnection()
+
+
+def make_pool():
+    return AsyncPgPool(max_size=2, timeout=0.05, factory=connect)
+
+
+def test_reuses_returned_connection():
+    async def run():
+        pool = make_pool()
+        conn = await pool.getconn()
+        await pool.putconn(conn)
+        assert await pool.getconn() is conn
+        assert pool.stats()["size"] == 1
+    asyncio.run(run())
+
+
+def test_bounded_with_timeout():
+    async def run():
+        pool = make_pool()
+        await pool.getconn()
+        await pool.getconn()
+        with pytest.raises(PoolTimeout):
+            await pool.getconn()
+        stats = pool.stats()
+        assert stats["in_use"] == 2
+        assert stats["waits"] == 1
+        assert stats["timeouts"] == 1
+    asyncio.run(run())
+
+
+def test_waiter_gets_released_connection():
+    async def run():
+        pool = make_pool()
+        first = await pool.getconn()
+        await pool.getconn()
+        waiter = asyncio.ensure_future(pool.getconn(timeout=1))
+        await asyncio.sleep(0.01)
+        await pool.putconn(first)
+        assert await waiter is first
+    asyncio.run(run())
+
+
+def test_rolls_back_and_discards():
+    async def run():
+        pool = make_pool()
+        conn = await pool.getconn()
+        conn.info.transaction_status = pq.TransactionStatus.INTRANS
+        await pool.putconn(conn)
+        assert conn.rollbacks == 1
+        assert pool.stats()["idle"] == 1
+
+        conn = await pool.getconn()
+        conn.closed = True
+        await pool.putconn(conn)
+        stats = pool.stats()
+        assert stats["size"] == 0
+        assert stats["idle"] == 0
+    asyncio.run(run())
+
+
+def test_waiters_served_in_order():
+    async def run():
+        pool = make_pool()
+        first = await pool.getconn()
+        second = await pool.getconn()
+        waiters = [asyncio.ensure_future(pool.getconn(timeout=1)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        await pool.putconn(first)
+        await pool.putconn(second)
+        assert [await waiter for waiter in waiters] == [first, second]
+        assert pool.stats()["waiting"] == 0
+    asyncio.run(run())
+
+
+def test_discarded_slot_goes_to_waiter():
+    async def run():
+        pool = make_pool()
+        first = await pool.getconn()
+        await pool.getconn()
+        waiter = asyncio.ensure_future(pool.getconn(timeout=1))
+        await asyncio.sleep(0.01)
+        await pool.putconn(first, discard=True)
+        conn = await waiter
+        assert conn is not first and first.closed
+        assert pool.stats()["size"] == 2
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+from auditlog import AuditLogWriter, PendingLog
+
+
+class MemoryWriter(AuditLogWriter):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.fail = False
+
+    def write(self, entries):
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        self.batches.append(entries)
+
+
+def test_flushes_in_batches_of_max_entries():
+    writer = MemoryWriter(max_entries=3, flush_interval=0)
+    for n in range(7):
+        writer.add("john.doe@example.com", "cancel", "cancel #%s" % n)
+    assert [len(batch) for batch in writer.batches] == [3, 3]
+    assert writer.pending() == 1
+    writer.flush()
+    assert writer.written == 7
+    assert writer.flushes == 3
+
+
+def test_failed_flush_keeps_entries():
+    writer = MemoryWriter(max_entries=100, flush_interval=0, max_buffered=2)
+    writer.fail = True
+    for n in range(3):
+        writer.add("john.doe@example.com", "cancel", "cancel #%s" % n)
+    assert writer.flush() is not None
+    assert writer.pending() == 2
+    assert writer.dropped == 1
+    writer.fail = False
+    writer.flush()
+    assert [entry[3] for entry in writer.batches[0]] == ["cancel #1", "cancel #2"]
+
+
+def test_timer_flush():
+    writer = MemoryWriter(max_entries=100, flush_interval=0.01)
+    writer.add("john.doe@example.com", "cancel", "cancel #1")
+    writer._timer.join()
+    assert writer.written == 1
+
+
+class FakeConnection:
+    pass
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+
+class MemoryPendingLog(PendingLog):
+    def __init__(self):
+        super().__init__()
+        self.inserted = []
+
+    def insert(self, curs, entries):
+        self.inserted.append((curs.connection, entries))
+
+
+def test_entries_written_with_their_transaction():
+    log = MemoryPendingLog()
+    committed, rolled_back = FakeConnection(), FakeConnection()
+    log.add(committed, "john.doe@example.com", "cancel", "cancel #1: restaurant credit")
+    log.add(rolled_back, "jane.doe@example.com", "cancel", "cancel #2: restaurant credit")
+    log.add(committed, "john.doe@example.com", "cancel", "cancel #1: recipient credit")
+    log.discard(rolled_back)
+    log.write(FakeCursor(rolled_back))
+    log.write(FakeCursor(committed))
+    assert len(log.inserted) == 1
+    conn, entries = log.inserted[0]
+    assert conn is committed
+    assert [entry[3] for entry in entries] == ["cancel #1: restaurant credit", "cancel #1: recipient credit"]
+    assert log.stats() == {"pending": 0, "written": 2, "inserts": 1, "discarded": 1}
@@ -0,0 +1,110 @@
+import pytest
+from flask import Flask
+
+import bulkimport
+
+
+class FakeDb:
+    recipients = []
+    menu_items = []
+    taken = set()
+    fail = False
+
+    def connect(self):
+        return None
+
+    def disconnect(self):
+        return None
+
+    def rollback(self):
+        return None
+
+    def import_recipients(self, rows):
+        FakeDb.recipients = rows
+        taken_lines = [row[0] for row in rows if row[1] in FakeDb.taken]
+        return len(rows) - len(taken_lines), taken_lines
+
+    def get_restaurant(self, restaurant_id):
+        return (restaurant_id,) if restaurant_id == 7 else None
+
+    def import_menu_items(self, restaurant_id, items):
+        if FakeDb.fail:
+            raise RuntimeError('duplicate key value violates unique constraint "menu_item_pkey"')
+        FakeDb.menu_items = items
+        return len(items)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(bulkimport, "PgInstance", FakeDb)
+    monkeypatch.setattr(bulkimport, "is_admin", lambda: True)
+    FakeDb.recipients, FakeDb.menu_items, FakeDb.taken, FakeDb.fail = [], [], set(), False
+    app = Flask(__name__)
+    app.add_url_rule("/recipients", view_func=bulkimport.import_recipients, methods=["POST"])
+    app.add_url_rule("/menu/<restaurant_id>", view_func=bulkimport.import_menu_items, methods=["POST"])
+    return app.test_client()
+
+
+def test_recipients_from_csv(client):
+    FakeDb.taken = {"taken@example.com"}
+    body = "\ufeffemail,name,phone,imageURL\n" \
+           "One@Example.com,One,4155551234,https://example.com/1.png\n" \
+           "not-an-email,Two,4155551234,\n" \
+           "one@example.com,Again,4155551234,\n" \
+           "taken@example.com,Taken,4155551234,\n"
+    res = client.post("/recipients", data=body, content_type="text/csv")
+    assert res.status_code == 200
+    report = res.get_json()
+    assert report["imported"] == 1
+    assert report["rejected"] == 3
+    assert report["errors"] == [
+        {"line": 3, "errors": {"email": "must be valid"}},
+        {"line": 4, "errors": {"row": "repeats an earlier row"}},
+        {"line": 5, "errors": {"email": "is already registered"}},
+    ]
+    assert FakeDb.recipients == [
+        (2, "one@example.com", "One", "4155551234", "https://example.com/1.png"),
+        (5, "taken@example.com", "Taken", "4155551234", None),
+    ]
+
+
+def test_menu_items_from_ndjson(client):
+    body = '{"name": "Pad Thai", "baseCost": 12.5, "category": "Noodles"}\n' \
+           '\n' \
+           'not json\n' \
+           '{"name": ["Curry"], "baseCost": 10}\n' \
+           '{"name": "Soup", "baseCost": -1}\n'
+    res = client.post("/menu/7", data=body, content_type="application/x-ndjson")
+    report = res.get_json()
+    assert report["imported"] == 1
+    assert [error["line"] for error in report["errors"]] == [3, 4, 5]
+    assert report["errors"][2]["errors"] == {"baseCost": "must be a number of at least 0"}
+    assert FakeDb.menu_items == [("Pad Thai", None, None, "12.5", "Noodles")]
+
+
+def test_refused_requests(client, monkeypatch):
+    assert client.post("/menu/8", data="name,baseCost\nSoup,3\n", content_type="text/csv").status_code == 404
+    assert client.post("/menu/7", data="{}", content_type="application/json").status_code == 415
+    monkeypatch.setattr(bulkimport, "import_max_rows", 1)
+    assert client.post("/menu/7", data="name,baseCost\nSoup,3\nRice,2\n", content_type="text/csv").status_code == 413
+    monkeypatch.setattr(bulkimport, "is_admin", lambda: False)
+    assert client.post("/recipients", data="", content_type="text/csv").status_code == 401
+
+
+def test_unreadable_bodies(client):
+    res = client.post("/recipients", data=b"email,name,phone\none@example.com,One,4155551234\n\xff,Two,4155551234\n",
+                      content_type="text/csv")
+    assert res.status_code == 400
+    assert res.get_json() == {"error": "line 3: is not valid UTF-8", "line": 3}
+    res = client.post("/menu/7", data='name,baseCost\nSoup,3\n"Rice" x,2\n', content_type="text/csv")
+    assert res.status_code == 400
+    assert res.get_json()["line"] == 3
+    res = client.post("/menu/7", data=b'{"name": "Soup", "baseCost": 3}\n\xc3(\n', content_type="application/x-ndjson")
+    assert res.get_json() == {"error": "line 2: is not valid UTF-8", "line": 2}
+
+
+def test_failed_import_hides_database_error(client):
+    FakeDb.fail = True
+    res = client.post("/menu/7", data="name,baseCost\nSoup,3\n", content_type="text/csv")
+    assert res.status_code == 500
+    assert res.get_json() == {"error": "import failed, nothing was imported"}
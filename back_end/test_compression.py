@@ -0,0 +1,105 @@
+import gzip
+import json
+
+from flask import Flask, Response, jsonify, stream_with_context
+
+import compression
+
+rows = [[i, "diner%s@example.com" % i, "2020-05-01"] for i in range(200)]
+
+
+def make_client():
+    app = Flask(__name__)
+    compression.init_app(app)
+    closed = []
+
+    @app.route("/list")
+    def get_list():
+        return jsonify(rows)
+
+    @app.route("/tagged")
+    def get_tagged():
+        response = jsonify(rows)
+        response.set_etag("directory-0123456789abcdef")
+        return response
+
+    @app.route("/small")
+    def get_small():
+        return jsonify([1])
+
+    @app.route("/stream")
+    def get_stream():
+        def generate():
+            try:
+                yield "["
+                yield ",".join(json.dumps(row) for row in rows)
+                yield "]"
+            finally:
+                closed.append(1)
+        return Response(stream_with_context(generate()), mimetype="application/json")
+
+    return app.test_client(), closed
+
+
+def test_gzip_when_accepted():
+    client, _ = make_client()
+    res = client.get("/list", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in res.headers["Vary"]
+    assert json.loads(gzip.decompress(res.data)) == rows
+
+
+def test_uncompressed_without_accept_encoding_or_below_threshold():
+    client, _ = make_client()
+    res = client.get("/list")
+    assert "Content-Encoding" not in res.headers
+    assert res.get_json() == rows
+    res = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in res.headers
+    res = client.get("/list", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in res.headers
+
+
+def test_streamed_body_compressed():
+    client, closed = make_client()
+    res = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(res.data)) == rows
+    assert closed == [1]
+
+
+def test_brotli_preferred(monkeypatch):
+    class FakeBrotli:
+        class Compressor:
+            def __init__(self, quality):
+                self.parts = []
+
+            def process(self, data):
+                self.parts.append(data)
+                return b""
+
+            def finish(self):
+                return b"br:" + b"".join(self.parts)
+
+    monkeypatch.setattr(compression, "brotli", FakeBrotli)
+    client, _ = make_client()
+    res = client.get("/list", headers={"Accept-Encoding": "gzip, br"})
+    assert res.headers["Content-Encoding"] == "br"
+    assert json.loads(res.data[3:]) == rows
+    res = client.get("/list", headers={"Accept-Encoding": "gzip, br;q=0.5"})
+    assert res.headers["Content-Encoding"] == "gzip"
+
+
+def test_compressed_once_per_etag(monkeypatch):
+    compressed = []
+    compress = compression.compress
+    monkeypatch.setattr(compression, "compress", lambda data, encoding: compressed.append(1) or compress(data, encoding))
+    monkeypatch.setattr(compression, "compressed_bodies", compression.TTLCache())
+    client, _ = make_client()
+    for _ in range(3):
+        res = client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+        assert json.loads(gzip.decompress(res.data)) == rows
+        assert res.headers["ETag"] == 'W/"directory-0123456789abcdef"'
+    client.get("/list", headers={"Accept-Encoding": "gzip"})
+    client.get("/list", headers={"Accept-Encoding": "gzip"})
+    assert len(compressed) == 3
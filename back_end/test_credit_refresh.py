@@ -0,0 +1,58 @@
+import credit_refresh
+from credit_refresh import CreditRefreshJob
+
+WEEK = 7 * 24 * 3600.0
+
+
+class FakeDb:
+    def __init__(self, recipient_ids):
+        self.recipient_ids = recipient_ids
+        self.progress = {}
+        self.ranges = []
+
+    def commit(self):
+        return None
+
+    def get_job_progress(self, job, cycle):
+        last_id, saved_cycle = self.progress.get(job, (None, None))
+        return last_id if saved_cycle == cycle else None
+
+    def set_job_progress(self, job, last_id, cycle):
+        self.progress[job] = (last_id, cycle)
+
+    def clear_job_progress(self, job):
+        self.progress.pop(job, None)
+
+    def refresh_recipient_credits_range(self, after_id, chunk_size):
+        ids = [id for id in self.recipient_ids if id > after_id][:chunk_size]
+        if not ids:
+            return None, 0, []
+        self.ranges.append((after_id, ids[-1]))
+        return ids[-1], len(ids), [("r%s@example.com" % id, 0, 10, 10) for id in ids]
+
+
+def interrupted_run(db, now):
+    run = CreditRefreshJob(db, chunk_size=2, clock=lambda: now).run()
+    next(run)  # first range committed
+    run.close()
+
+
+def test_resumes_in_same_cycle(monkeypatch):
+    monkeypatch.setattr(credit_refresh, "refresh_interval", WEEK)
+    db = FakeDb([1, 2, 3, 4, 5])
+    interrupted_run(db, 10 * WEEK + 60)
+    job = CreditRefreshJob(db, chunk_size=2, clock=lambda: 10 * WEEK + 3600)
+    assert len(list(job.run())) == 3
+    assert job.report["resumed_from"] == 2
+    assert db.ranges == [(0, 2), (2, 4), (4, 5)]
+    assert db.progress == {}
+
+
+def test_checkpoint_of_earlier_cycle_ignored(monkeypatch):
+    monkeypatch.setattr(credit_refresh, "refresh_interval", WEEK)
+    db = FakeDb([1, 2, 3, 4, 5])
+    interrupted_run(db, 10 * WEEK + 60)
+    job = CreditRefreshJob(db, chunk_size=2, clock=lambda: 11 * WEEK + 60)
+    assert len(list(job.run())) == 5
+    assert job.report["resumed_from"] == None
+    assert db.ranges[1:] == [(0, 2), (2, 4), (4, 5)]
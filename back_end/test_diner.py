@@ -1,5 +1,4 @@
 import os
-import subprocess
 import sys
 
 import pytest
@@ -15,8 +14,7 @@ headers = {
 
 
 @pytest.fixture
-def client():
-    subprocess.run(['sh', 'pg/seed-local-tables.sh'])
+def client(db_transaction):
     return app.test_client()
 
 ''' 
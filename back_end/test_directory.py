@@ -0,0 +1,71 @@
+from flask import Flask, jsonify
+
+import directory
+from directory import NotifyCache
+
+
+def listening_cache(**kwargs):
+    cache = NotifyCache("test", **kwargs)
+    cache.listening = True
+    return cache
+
+
+def test_hit_until_invalidated():
+    cache = listening_cache()
+    loads = []
+    loader = lambda: loads.append(1) or len(loads)
+    assert cache.get(loader) == 1
+    assert cache.get(loader) == 1
+    cache.invalidate()
+    assert cache.get(loader) == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_bypassed_without_listener():
+    cache = NotifyCache("test")
+    loads = []
+    loader = lambda: loads.append(1) or len(loads)
+    assert [cache.get(loader) for _ in range(3)] == [1, 2, 3]
+
+
+def test_load_overlapping_invalidation_not_stored():
+    cache = listening_cache()
+
+    def loader():
+        cache.invalidate()  # a NOTIFY arrives while the directory is being read
+        return "old"
+
+    assert cache.get(loader) == "old"
+    assert cache.get(lambda: "new") == "new"
+
+
+def test_expires_after_max_age():
+    now = [0.0]
+    cache = listening_cache(max_age=60, clock=lambda: now[0])
+    assert cache.get(lambda: "first") == "first"
+    now[0] = 61
+    assert cache.get(lambda: "second") == "second"
+
+
+def test_cached_directory_serves_serialized_page(monkeypatch):
+    cache = listening_cache()
+    monkeypatch.setattr(directory, "restaurant_directory", cache)
+    calls = []
+
+    def get_restaurants():
+        calls.append(1)
+        return jsonify([[1, "One"]])
+
+    app = Flask(__name__)
+    app.add_url_rule("/api/restaurant", view_func=directory.cached_directory(get_restaurants))
+    client = app.test_client()
+    assert client.get("/api/restaurant").get_json() == [[1, "One"]]
+    res = client.get("/api/restaurant")
+    assert res.get_json() == [[1, "One"]]
+    assert res.mimetype == "application/json"
+    assert len(calls) == 1
+    etag = res.headers["ETag"]
+    res = client.get("/api/restaurant", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.headers["ETag"] == etag
+    assert len(calls) == 1
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import hashing
+from hashing import HashExecutor, HashingBusy
+
+
+def test_hash_and_verify():
+    password_hash = hashing.hash_password("mYp@55worD", rounds=4)
+    assert hashing.verify_password("mYp@55worD", password_hash)
+    assert not hashing.verify_password("wrong", password_hash)
+    # never forked from this multi-threaded process
+    assert hashing.executor._executor._mp_context.get_start_method() in ("forkserver", "spawn")
+
+
+def test_needs_rehash_when_cost_changes():
+    password_hash = hashing.hash_password("mYp@55worD", rounds=4)
+    assert not hashing.needs_rehash(password_hash, rounds=4)
+    assert hashing.needs_rehash(password_hash, rounds=5)
+
+
+def test_rejects_when_queue_full():
+    release = threading.Event()
+    executor = HashExecutor(workers=1, max_pending=1, admit_timeout=0.01,
+                            executor_factory=ThreadPoolExecutor)
+    future = executor.submit(release.wait)
+    with pytest.raises(HashingBusy):
+        executor.submit(release.wait)
+    release.set()
+    future.result()
+    assert executor.run(len, "abc") == 3
+    assert executor.stats()["rejected"] == 1
+    executor.shutdown()
+
+
+def test_run_async():
+    executor = HashExecutor(workers=1, executor_factory=ThreadPoolExecutor)
+    assert asyncio.run(executor.run_async(len, "abc")) == 3
+    assert executor.stats()["completed"] == 1
+    executor.shutdown()
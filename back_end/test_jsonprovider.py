@@ -0,0 +1,66 @@
+import json
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+from werkzeug.http import http_date as werkzeug_http_date
+
+from jsonprovider import FastJSONProvider, PassThroughJSONProvider, RawJSON, http_date
+
+
+def make_app():
+    app = Flask(__name__)
+    app.json = PassThroughJSONProvider(app)
+    return app
+
+
+def test_raw_body_sent_as_is():
+    with make_app().app_context():
+        response = jsonify(RawJSON('[[1, "One"]]'))
+        assert response.get_data(as_text=True) == '[[1, "One"]]'
+        assert response.mimetype == "application/json"
+
+
+def test_raw_value_nested():
+    with make_app().app_context():
+        response = jsonify({"claims": RawJSON("[[1, 12.5]]"), "count": 1})
+        assert response.get_json() == {"claims": [[1, 12.5]], "count": 1}
+
+
+def test_other_values_unchanged():
+    with make_app().app_context():
+        assert jsonify([[1, "One"]]).get_json() == [[1, "One"]]
+
+
+def test_fast_provider_matches_json_module():
+    pytest.importorskip("orjson")
+    Row = namedtuple("Row", "id email amount created")
+    rows = [Row(1, "a@example.com", Decimal("12.50"), datetime(2020, 5, 1, 12, 30, tzinfo=timezone.utc))]
+    payload = {"next": None, "items": rows, "count": 1}
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    with app.app_context():
+        fast = jsonify(payload).get_data()
+        assert app.json.loads(app.json.dumps(rows)) == json.loads(DefaultJSONProvider(app).dumps(rows))
+    app.json = DefaultJSONProvider(app)
+    with app.app_context():
+        assert fast == jsonify(payload).get_data()
+
+
+def test_fast_provider_passes_raw_through():
+    pytest.importorskip("orjson")
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    with app.app_context():
+        assert jsonify(RawJSON("[[1, 2]]")).get_data(as_text=True) == "[[1, 2]]"
+        assert jsonify({"rows": RawJSON("[[1, 2]]")}).get_json() == {"rows": [[1, 2]]}
+
+
+def test_http_date_matches_werkzeug():
+    values = [datetime(2021, 1, 1, 23, 30, tzinfo=timezone(timedelta(hours=-7))), datetime(1999, 12, 31, 23, 59, 59),
+              date(2020, 2, 29)]
+    assert [http_date(value) for value in values] == [werkzeug_http_date(value) for value in values]
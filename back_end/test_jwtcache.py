@@ -0,0 +1,43 @@
+import datetime
+
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from jwt import ExpiredSignatureError
+
+import jwtcache
+
+
+@pytest.fixture
+def jwt_app():
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "test-secret-key-of-at-least-32-bytes"
+    JWTManager(app)
+    jwtcache.token_cache.clear()
+    with app.app_context():
+        yield app
+
+
+def test_second_decode_is_cached(jwt_app):
+    token = create_access_token(identity="john.doe@example.com",
+                                expires_delta=datetime.timedelta(minutes=360))
+    hits = jwtcache.token_cache.hits
+    first = jwtcache.decode_cached(token)
+    assert jwtcache.decode_cached(token) is first
+    assert jwtcache.token_cache.hits == hits + 1
+
+
+def test_entry_does_not_outlive_token(jwt_app):
+    token = create_access_token(identity="john.doe@example.com",
+                                expires_delta=datetime.timedelta(seconds=1))
+    jwtcache.decode_cached(token)
+    expires, _ = jwtcache.token_cache._data[token]
+    assert expires - jwtcache.token_cache.clock() <= 1
+
+
+def test_expired_token_rejected(jwt_app):
+    token = create_access_token(identity="john.doe@example.com",
+                                expires_delta=datetime.timedelta(seconds=-1))
+    with pytest.raises(ExpiredSignatureError):
+        jwtcache.decode_cached(token)
+    assert len(jwtcache.token_cache) == 0
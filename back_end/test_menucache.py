@@ -0,0 +1,95 @@
+import pytest
+from flask import Flask, jsonify
+
+import menucache
+from pg.pginstance import menu_versions
+
+
+class FakeDb:
+    versions = {}
+    reads = 0
+
+    def connect(self):
+        return None
+
+    def disconnect(self):
+        return None
+
+    def get_menu_version(self, restaurant_id):
+        FakeDb.reads += 1
+        if FakeDb.versions == None:  # menu_version not installed
+            return None
+        version = FakeDb.versions.get(restaurant_id, 0)
+        menu_versions.set(restaurant_id, version)
+        return version
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(menucache, "PgInstance", FakeDb)
+    FakeDb.versions = {}
+    FakeDb.reads = 0
+    menu_versions.clear()
+    menucache.menu_pages.clear()
+    calls = []
+
+    def get_all_menu_items(restaurant_id):
+        calls.append(restaurant_id)
+        if restaurant_id == "404":
+            return jsonify({"error": "no such restaurant"}), 404
+        return jsonify([[len(calls), "Pad Thai"]])
+
+    app = Flask(__name__)
+    app.add_url_rule("/api/menu/<restaurant_id>", view_func=menucache.cached_menu(get_all_menu_items))
+    client = app.test_client()
+    client.view_calls = calls
+    return client
+
+
+def test_serves_cached_page_with_etag(client):
+    first = client.get("/api/menu/7")
+    second = client.get("/api/menu/7")
+    assert first.status_code == second.status_code == 200
+    assert first.get_json() == second.get_json() == [[1, "Pad Thai"]]
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert client.view_calls == ["7"]
+    assert FakeDb.reads == 1
+
+
+def test_not_modified_for_current_etag(client):
+    etag = client.get("/api/menu/7").headers["ETag"]
+    res = client.get("/api/menu/7", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.data == b""
+    assert res.headers["ETag"] == etag
+
+
+def test_version_bump_changes_page_and_etag(client):
+    before = client.get("/api/menu/7")
+    FakeDb.versions[7] = 1
+    menu_versions.pop(7)
+    res = client.get("/api/menu/7", headers={"If-None-Match": before.headers["ETag"]})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != before.headers["ETag"]
+    assert res.get_json() == [[2, "Pad Thai"]]
+
+
+def test_pages_keyed_by_query_string(client):
+    client.get("/api/menu/7")
+    client.get("/api/menu/7?bottom=49")
+    assert client.view_calls == ["7", "7"]
+
+
+def test_errors_not_cached(client):
+    assert client.get("/api/menu/404").status_code == 404
+    assert client.get("/api/menu/404").status_code == 404
+    assert client.view_calls == ["404", "404"]
+
+
+def test_uncached_without_menu_versions(client):
+    FakeDb.versions = None
+    first = client.get("/api/menu/7")
+    second = client.get("/api/menu/7")
+    assert first.get_json() == [[1, "Pad Thai"]]
+    assert second.get_json() == [[2, "Pad Thai"]]
+    assert "ETag" not in second.headers
@@ -0,0 +1,67 @@
+import threading
+import time
+from decimal import Decimal
+
+from metrics import SingleFlightCache, metric_value
+
+
+def test_refreshes_once_per_ttl():
+    now = [0]
+    cache = SingleFlightCache(ttl=5, clock=lambda: now[0])
+    loads = []
+    load = lambda: loads.append(1) or len(loads)
+    assert cache.get(load) == 1
+    assert cache.get(load) == 1
+    now[0] = 6
+    assert cache.get(load) == 2
+    assert cache.stats()["refreshes"] == 2
+
+
+def test_concurrent_callers_share_one_load():
+    cache = SingleFlightCache(ttl=60)
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"num_meals": 4}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(slow_load))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"num_meals": 4}] * 8
+
+
+def test_stale_value_served_during_refresh():
+    cache = SingleFlightCache(ttl=60)
+    cache.get(lambda: "old")
+    cache.invalidate()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_load():
+        started.set()
+        release.wait()
+        return "new"
+
+    refresher = threading.Thread(target=cache.get, args=(slow_load,))
+    refresher.start()
+    started.wait()
+    assert cache.get(lambda: "unexpected") == "old"
+    release.set()
+    refresher.join()
+    assert cache.get(lambda: "unexpected") == "new"
+
+
+def test_values_typed_like_the_aggregates():
+    counters = {"num_meals": Decimal(0), "claims_with_meals": Decimal(0), "num_recipients": Decimal(2),
+                "num_children": Decimal(5), "distribution_total": Decimal("12.50"), "distributions": Decimal(3)}
+    assert metric_value(counters, "num_meals") == None  # sum over no claims
+    assert metric_value(counters, "num_recipients") == 2 and type(metric_value(counters, "num_recipients")) is int
+    assert type(metric_value(counters, "num_children")) is int
+    assert metric_value(counters, "distribution_total") == Decimal("12.50")
+    counters["distributions"] = Decimal(0)
+    assert metric_value(counters, "distribution_total") == None
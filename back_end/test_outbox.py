@@ -0,0 +1,75 @@
+import smtplib
+import time
+from functools import partial
+
+from outbox import Outbox, SmtpSession
+from benchmarks.smtp_standin import SmtpStandIn
+
+
+def test_delivers_over_persistent_session():
+    with SmtpStandIn() as server:
+        box = Outbox(workers=1, session_factory=partial(SmtpSession, "127.0.0.1", server.port,
+                                                        starttls=False, password=None))
+        ids = [box.send("john.doe@example.com", "Welcome to OpenMeal!", "otp %s" % n) for n in range(10)]
+        box.join()
+        box.stop()
+    assert len(server.messages) == 10
+    assert server.sessions == 1
+    assert all(box.status(message_id)["status"] == "sent" for message_id in ids)
+
+
+def test_failed_login_is_retried_on_a_new_session():
+    with SmtpStandIn() as server:
+        server.failing_logins = 1
+        box = Outbox(workers=1, backoff=0.01, session_factory=partial(SmtpSession, "127.0.0.1", server.port,
+                                                                      starttls=False, password="secret"))
+        first = box.send("john.doe@example.com", "Welcome to OpenMeal!", "otp 1")
+        assert wait_for_status(box, first, "sent")
+        second = box.send("jane.doe@example.com", "Welcome to OpenMeal!", "otp 2")
+        assert wait_for_status(box, second, "sent")
+        box.stop()
+    assert box.status(first)["attempts"] == 2
+    assert box.status(second)["attempts"] == 1
+    assert (server.sessions, server.logins, len(server.messages)) == (2, 1, 2)
+
+
+class FlakySession:
+    sender = "openmealio@outlook.com"
+    failures = 2
+
+    def send(self, receivers, message):
+        if FlakySession.failures:
+            FlakySession.failures -= 1
+            raise smtplib.SMTPServerDisconnected()
+
+    def close(self):
+        pass
+
+
+def wait_for_status(box, message_id, status):
+    for _ in range(200):
+        if box.status(message_id)["status"] == status:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_retries_with_backoff_then_gives_up():
+    box = Outbox(workers=1, backoff=0.01, max_attempts=3, session_factory=FlakySession)
+    message_id = box.send("john.doe@example.com", "subject", "body")
+    assert wait_for_status(box, message_id, "sent")
+    assert box.status(message_id)["attempts"] == 3
+    assert box.stats()["retries"] == 2
+
+    FlakySession.failures = 5
+    message_id = box.send("john.doe@example.com", "subject", "body")
+    assert wait_for_status(box, message_id, "failed")
+    assert box.stats()["failed"] == 1
+    box.stop()
+
+
+def test_disabled_outbox_refuses_mail():
+    box = Outbox(workers=1, session_factory=FlakySession, enabled=False)
+    assert box.send("john.doe@example.com", "subject", "body") is None
+    assert box.stats()["enabled"] is False
+    assert box._threads == []
@@ -0,0 +1,199 @@
+from collections import namedtuple
+
+import psycopg2.errors
+import psycopg2.extensions
+import pytest
+
+import pgpool
+from conftest import TestPool
+from metrics import METRIC_COUNTER_ROLLUP, METRIC_TOTALS
+from pg.pginstance import PgInstance, metrics_cache, role_cache
+
+
+class FakeConnection:
+    status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self, cursor_factory=None):
+        curs = FakeCursor()
+        curs.connection = self
+        return curs
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def get_transaction_status(self):
+        return self.status
+
+
+class FakeCursor:
+    def __init__(self, rows=()):
+        self.statements = []
+        self.prepared = set()
+        self.cancel_next_execute = False
+        # statements whose table was altered after they were prepared
+        self.stale = set()
+        self.rows = list(rows)
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        if query.startswith("PREPARE"):
+            name = query.split()[1]
+            if name in self.prepared:
+                raise psycopg2.errors.DuplicatePreparedStatement("prepared statement \"%s\" already exists" % name)
+            self.prepared.add(name)
+        elif query.startswith("DEALLOCATE"):
+            name = query.split()[1]
+            self.prepared.remove(name)
+            self.stale.discard(name)
+        elif query.startswith("EXECUTE") and query.split()[1] in self.stale:
+            raise psycopg2.errors.FeatureNotSupported("cached plan must not change result type")
+        elif self.cancel_next_execute:
+            self.cancel_next_execute = False
+            raise psycopg2.errors.QueryCanceled("canceling statement due to statement timeout")
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    # rows up to the next None, which ends a result set
+    def fetchall(self):
+        end = self.rows.index(None) if None in self.rows else len(self.rows)
+        rows, self.rows = self.rows[:end], self.rows[end + 1:]
+        return rows
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(PgInstance, "use_prepared", True)
+    db = PgInstance()
+    db.conn, db.curs = FakeConnection(), FakeCursor()
+    db.curs.connection = db.conn
+    return db
+
+
+def test_prepares_once_per_connection(db):
+    db.execute_prepared("verify_otp", ("john.doe@example.com", "123456"))
+    db.execute_prepared("verify_otp", ("john.doe@example.com", "654321"))
+    assert db.curs.statements == [
+        "PREPARE verify_otp AS SELECT * FROM email_otp WHERE email = $1 AND code = $2 AND expiresat > NOW()",
+        "EXECUTE verify_otp (%s, %s)",
+        "EXECUTE verify_otp (%s, %s)",
+    ]
+
+
+def test_failed_execute_keeps_statement_prepared(db):
+    db.curs.cancel_next_execute = True
+    with pytest.raises(psycopg2.errors.QueryCanceled):
+        db.execute_prepared("customer_by_email", ("john.doe@example.com",))
+    db.execute_prepared("customer_by_email", ("john.doe@example.com",))
+    assert db.curs.statements == [
+        "PREPARE customer_by_email AS SELECT * FROM customer WHERE email=$1",
+        "EXECUTE customer_by_email (%s)",
+        "EXECUTE customer_by_email (%s)",
+    ]
+
+
+
+def test_stale_plan_prepared_again(db):
+    db.execute_prepared("customer_by_email", ("john.doe@example.com",))
+    db.curs.stale.add("customer_by_email")
+    db.execute_prepared("customer_by_email", ("john.doe@example.com",))
+    assert db.curs.statements == [
+        "PREPARE customer_by_email AS SELECT * FROM customer WHERE email=$1",
+        "EXECUTE customer_by_email (%s)",
+        "EXECUTE customer_by_email (%s)",
+        "DEALLOCATE customer_by_email",
+        "PREPARE customer_by_email AS SELECT * FROM customer WHERE email=$1",
+        "EXECUTE customer_by_email (%s)",
+    ]
+
+
+def test_stale_plan_inside_transaction_raised_then_prepared_again(db):
+    db.execute_prepared("verify_otp", ("john.doe@example.com", "123456"))
+    db.curs.stale.add("verify_otp")
+    db.conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    with pytest.raises(psycopg2.errors.FeatureNotSupported):
+        db.execute_prepared("verify_otp", ("john.doe@example.com", "123456"))
+    db.conn.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    db.execute_prepared("verify_otp", ("john.doe@example.com", "123456"))
+    assert db.curs.statements[3:] == [
+        "DEALLOCATE verify_otp",
+        "PREPARE verify_otp AS SELECT * FROM email_otp WHERE email = $1 AND code = $2 AND expiresat > NOW()",
+        "EXECUTE verify_otp (%s, %s)",
+    ]
+
+def test_metrics_counted_from_tables_until_installed(db, monkeypatch):
+    monkeypatch.setattr(PgInstance, "metric_counters_installed", False)
+    metrics_cache.invalidate()
+    Row = namedtuple("Record", ["installed", "name", "value"])
+    db.curs.rows = [Row(False, None, None), Row(None, "num_donors", 3)]
+    assert db.get_num_donors().count == 3
+    assert db.curs.statements == ["SELECT to_regclass('metric_counter_delta') IS NOT NULL AS installed",
+                                  METRIC_TOTALS]
+    metrics_cache.invalidate()
+
+
+def test_metric_changes_rolled_up_past_threshold(db, monkeypatch):
+    monkeypatch.setattr(PgInstance, "metric_counters_installed", True)
+    monkeypatch.setattr(PgInstance, "metric_rollup_threshold", 3)
+    metrics_cache.invalidate()
+    Row = namedtuple("Record", ["name", "value", "pending"])
+    db.curs.rows = [Row("num_donors", 4, 2), Row("num_restaurants", 1, 1), None, namedtuple("Record", ["moved"])(3)]
+    assert db.get_num_donors().count == 4
+    assert db.curs.statements == [PgInstance.metric_counters_query, "SAVEPOINT metric_rollup",
+                                  METRIC_COUNTER_ROLLUP, "RELEASE SAVEPOINT metric_rollup"]
+    metrics_cache.invalidate()
+    db.curs.rows, db.curs.statements = [Row("num_donors", 4, 0), Row("num_restaurants", 1, 2)], []
+    assert db.get_num_restaurants().count == 1
+    assert db.curs.statements == [PgInstance.metric_counters_query]
+    metrics_cache.invalidate()
+
+
+def test_menu_edits_without_menu_versions(db, monkeypatch):
+    monkeypatch.setattr(PgInstance, "menu_versions_installed", False)
+    Row = namedtuple("Record", ["installed"])
+    db.curs.rows = [Row(False), Row(False)]
+    db.bump_menu_version(7)
+    assert db.get_menu_version(7) == None
+    assert db.curs.statements == ["SELECT to_regclass('menu_version') IS NOT NULL AS installed"] * 2
+
+
+def test_roles_cached_after_commit(db):
+    role_cache.clear()
+    Roles = namedtuple("Record", ["customer", "restaurant", "recipient", "donor", "admin"])
+    nobody, diner = Roles(False, False, False, False, False), Roles(True, False, True, False, False)
+    db.curs.rows = [nobody, diner, diner, diner]
+    assert db.get_role_memberships("New@Example.com") == nobody
+    assert db.get_role_memberships("New@Example.com") == diner  # no roles isn't cached
+    db.rollback()
+    assert db.get_role_memberships("new@example.com") == diner  # nor what a rolled-back transaction read
+    assert len(role_cache) == 0
+    assert db.commit() == None
+    assert db.get_role_memberships("NEW@example.com") == diner
+    assert len(db.curs.statements) == 3
+    db.forget_roles("new@example.com")
+    assert db.get_role_memberships("new@example.com") == diner
+    assert len(db.curs.statements) == 4
+    role_cache.clear()
+
+
+class LostConnection(FakeConnection):
+    def commit(self):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+def test_failed_commit_releases_connection(monkeypatch):
+    pool = TestPool(LostConnection())
+    monkeypatch.setattr(pgpool, "_pool", pool)
+    for _ in range(3):
+        db = PgInstance()
+        assert db.connect() == None
+        assert db.disconnect() == "server closed the connection unexpectedly"
+        assert (db.conn, db.curs) == (None, None)
+    assert pool.stats()["in_use"] == 0
+    assert pool.stats()["discards"] == 3
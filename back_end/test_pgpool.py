@@ -0,0 +1,67 @@
+import threading
+
+import psycopg2.extensions
+import pytest
+from pgpool import PgPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool():
+    return PgPool(max_size=2, timeout=0.05, factory=lambda dsn, **kwargs: FakeConnection())
+
+
+def test_reuses_returned_connection(pool):
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert pool.stats()["size"] == 1
+
+
+def test_bounded_with_timeout(pool):
+    pool.getconn()
+    pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    stats = pool.stats()
+    assert stats["in_use"] == 2
+    assert stats["waits"] == 1
+    assert stats["timeouts"] == 1
+
+
+def test_waiter_gets_released_connection(pool):
+    first = pool.getconn()
+    pool.getconn()
+    threading.Timer(0.01, pool.putconn, (first,)).start()
+    assert pool.getconn(timeout=1) is first
+
+
+def test_rolls_back_and_discards(pool):
+    conn = pool.getconn()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert pool.stats()["idle"] == 1
+
+    conn = pool.getconn()
+    conn.closed = 2
+    pool.putconn(conn)
+    stats = pool.stats()
+    assert stats["size"] == 0
+    assert stats["idle"] == 0
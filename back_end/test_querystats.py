@@ -0,0 +1,49 @@
+import pytest
+from flask import Flask
+
+import querystats
+
+
+def test_histogram_buckets():
+    table = querystats.TimingTable()
+    table.add("get_customer", 0.0005, rows=1)
+    table.add("get_customer", 0.003, rows=1)
+    table.add("get_customer", 0.2, error=True)
+    stats = table.as_dict()["get_customer"]
+    assert stats["count"] == 3
+    assert stats["errors"] == 1
+    assert stats["rows"] == 2
+    assert stats["histogram"] == {"1": 1, "5": 1, "250": 1}
+
+
+def test_route_latency_and_server_timing(monkeypatch):
+    monkeypatch.setenv("SERVER_TIMING", "1")
+    querystats.route_timings.reset()
+    app = Flask(__name__)
+    querystats.init_app(app)
+
+    @app.route("/api/restaurant/<restaurant_id>")
+    def restaurant_get(restaurant_id):
+        querystats.record_query("get_restaurant", 0.004, 1, False)
+        return "{}"
+
+    res = app.test_client().get("/api/restaurant/1")
+    assert res.headers.getlist("Server-Timing")[0] == 'db;dur=4.00;desc="1 queries"'
+    assert querystats.route_timings.as_dict()["GET /api/restaurant/<restaurant_id>"]["count"] == 1
+
+
+def test_route_latency_recorded_when_view_raises():
+    querystats.route_timings.reset()
+    app = Flask(__name__)
+    app.config["PROPAGATE_EXCEPTIONS"] = True  # no error response, so no after_request
+    querystats.init_app(app)
+
+    @app.route("/api/claim")
+    def claim():
+        querystats.record_query("claim_donation", 0.002, 0, True)
+        raise ConnectionError("server closed the connection unexpectedly")
+
+    with pytest.raises(ConnectionError):
+        app.test_client().get("/api/claim")
+    stats = querystats.route_timings.as_dict()["GET /api/claim"]
+    assert (stats["count"], stats["errors"]) == (1, 1)
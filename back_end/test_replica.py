@@ -0,0 +1,99 @@
+import os
+
+import pytest
+from flask import Flask
+
+import pgpool
+from conftest import server_dsn
+from pg.pginstance import PgInstance, is_write
+
+# Routing tests need a second database standing in for the replica, e.g. another local server:
+#     TEST_REPLICA_DATABASE_URL=postgresql://localhost:5433/postgres pytest test_replica.py
+# Each pool keeps one connection with a temporary feed_item table shadowing the real one, so
+# every read shows which database answered it.
+replica_dsn = os.environ.get("TEST_REPLICA_DATABASE_URL")
+needs_replica = pytest.mark.skipif(replica_dsn == None, reason="TEST_REPLICA_DATABASE_URL not set")
+
+
+def marked_pool(dsn, name, **kwargs):
+    pool = pgpool.PgPool(dsn, max_size=1, **kwargs)
+    conn = pool.getconn()
+    with conn.cursor() as curs:
+        curs.execute("CREATE TEMP TABLE feed_item (id SERIAL PRIMARY KEY, msg TEXT)")
+        curs.execute("INSERT INTO feed_item (msg) VALUES (%s)", (name,))
+    conn.commit()
+    pool.putconn(conn)
+    return pool
+
+
+@pytest.fixture
+def app(monkeypatch):
+    primary = marked_pool(server_dsn(), "primary")
+    replica = marked_pool(replica_dsn, "replica", factory=pgpool.connect_autocommit)
+    monkeypatch.setattr(pgpool, "_pool", primary)
+    monkeypatch.setattr(pgpool, "_replica_pool", replica)
+    monkeypatch.setattr(pgpool, "_replica_down_until", 0.0)
+    app = Flask(__name__)
+    pgpool.init_app(app)
+    yield app
+    primary.closeall()
+    replica.closeall()
+
+
+def feed(db):
+    return [getattr(row, "msg") for row in db.get_feed()]
+
+
+@needs_replica
+def test_reads_go_to_replica(app):
+    with app.test_request_context():
+        db = PgInstance()
+        db.connect()
+        assert feed(db) == ["replica"]
+        db.disconnect()
+
+
+@needs_replica
+def test_reads_own_writes_after_write(app):
+    with app.test_request_context():
+        db = PgInstance()
+        db.connect()
+        db.insert_test_data("INSERT INTO feed_item (msg) VALUES ('written')")
+        assert feed(db) == ["primary", "written"]
+        db.rollback()
+        db.disconnect()
+    with app.test_request_context():
+        db = PgInstance()
+        db.connect()
+        assert feed(db) == ["replica"]
+        db.disconnect()
+
+
+@needs_replica
+def test_primary_outside_requests(app):
+    db = PgInstance()
+    db.connect()
+    assert feed(db) == ["primary"]
+    db.disconnect()
+
+
+@needs_replica
+def test_falls_back_while_replica_down(app, monkeypatch):
+    failures = pgpool.replica_stats["failures"]
+    monkeypatch.setattr(pgpool, "_replica_pool", pgpool.PgPool("postgresql://localhost:1/none", max_size=1,
+                                                               connect_timeout=1))
+    with app.test_request_context():
+        db = PgInstance()
+        db.connect()
+        assert feed(db) == ["primary"]
+        assert feed(db) == ["primary"]
+        db.disconnect()
+    assert pgpool.replica_stats["failures"] == failures + 1
+
+
+def test_is_write():
+    assert is_write("INSERT INTO logger (email) VALUES (%s)")
+    assert is_write("WITH cancelled AS (UPDATE donation_claim SET active = FALSE RETURNING id) SELECT 1")
+    assert is_write("SELECT * FROM donation_claim WHERE id = %s FOR UPDATE")
+    assert not is_write("SELECT * FROM feed_item ORDER BY created ASC LIMIT 7")
+    assert not is_write("SELECT last_updated, deleted_count FROM job_progress")
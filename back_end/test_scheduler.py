@@ -0,0 +1,230 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extensions
+from flask import Flask
+
+import pgpool
+from scheduler import Scheduler
+
+HOUR = 3600.0
+
+
+class FakeDatabase:
+    # job_run and advisory locks shared by the instances of a test
+
+    def __init__(self):
+        self.runs = []
+        self.locks = set()
+        self.failing_commits = 0
+
+
+class FakeDb:
+    def __init__(self, database):
+        self.database = database
+        self.held = set()
+
+    def connect(self, request_scoped=True):
+        return None
+
+    def disconnect(self):
+        self.database.locks -= self.held
+        return None
+
+    def commit(self):
+        if self.database.failing_commits:
+            self.database.failing_commits -= 1
+            return ConnectionError("server closed the connection unexpectedly")
+        return None
+
+    def rollback(self):
+        return None
+
+    def try_job_lock(self, job):
+        if job in self.database.locks:
+            return False
+        self.database.locks.add(job)
+        self.held.add(job)
+        return True
+
+    def release_job_lock(self, job):
+        self.database.locks.discard(job)
+        self.held.discard(job)
+
+    def get_last_job_run(self, job):
+        started = [run[1] for run in self.database.runs if run[0] == job and run[4] == None]
+        return max(started) if started else None
+
+    def record_job_run(self, job, started, seconds, rows_affected, error=None):
+        self.database.runs.append((job, started, seconds, rows_affected, error))
+
+
+def make_scheduler(database, now):
+    return Scheduler(connect=lambda: FakeDb(database), clock=lambda: now[0], retry_delay=60)
+
+
+def test_runs_once_per_interval():
+    database = FakeDatabase()
+    now = [10 * HOUR + 5]
+    scheduler = make_scheduler(database, now)
+    calls = []
+    scheduler.add("cancel", HOUR, lambda db: calls.append(1) or 3)
+    assert scheduler.run_pending() == {"cancel": "ran"}
+    now[0] += 600
+    assert scheduler.run_pending() == {}
+    now[0] = 11 * HOUR
+    assert scheduler.run_pending() == {"cancel": "ran"}
+    assert len(calls) == 2
+    job, started, seconds, rows, error = database.runs[0]
+    assert (job, rows, error) == ("cancel", 3, None)
+    assert started == datetime.fromtimestamp(10 * HOUR + 5, timezone.utc)
+    assert scheduler.stats()["cancel"]["runs"] == 2
+
+
+def test_one_instance_runs_each_slot():
+    database = FakeDatabase()
+    now = [10 * HOUR + 5]
+    calls = []
+    instances = [make_scheduler(database, now) for _ in range(3)]
+    for instance in instances:
+        instance.add("cancel", HOUR, lambda db: calls.append(1) or 0)
+    results = [instance.run_pending()["cancel"] for instance in instances]
+    assert results == ["ran", "skipped", "skipped"]
+    assert len(calls) == 1
+
+
+def test_skipped_while_locked_elsewhere():
+    database = FakeDatabase()
+    database.locks.add("cancel")
+    now = [10 * HOUR]
+    scheduler = make_scheduler(database, now)
+    scheduler.add("cancel", HOUR, lambda db: 0)
+    assert scheduler.run_pending() == {"cancel": "skipped"}
+    now[0] += 30
+    assert scheduler.run_pending() == {}
+    database.locks.clear()
+    now[0] += 30
+    assert scheduler.run_pending() == {"cancel": "ran"}
+
+
+def test_failed_run_recorded_and_retried():
+    database = FakeDatabase()
+    now = [10 * HOUR]
+    scheduler = make_scheduler(database, now)
+    attempts = []
+
+    def flaky(db):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("connection reset")
+        return 5
+
+    scheduler.add("refresh", HOUR, flaky)
+    assert scheduler.run_pending() == {"refresh": "failed"}
+    assert database.runs[0][4] == "RuntimeError: connection reset"
+    assert not database.locks
+    now[0] += 60
+    assert scheduler.run_pending() == {"refresh": "ran"}
+    stats = scheduler.stats()["refresh"]
+    assert (stats["failures"], stats["runs"], stats["last_rows"]) == (1, 1, 5)
+
+
+def test_failed_commit_is_a_failed_run():
+    database = FakeDatabase()
+    now = [10 * HOUR]
+    scheduler = make_scheduler(database, now)
+
+    def cancel(db):
+        if not database.runs:
+            database.failing_commits = 1
+        return 4
+
+    scheduler.add("cancel", HOUR, cancel)
+    assert scheduler.run_pending() == {"cancel": "failed"}
+    assert database.runs[0][3:] == (None, "ConnectionError: server closed the connection unexpectedly")
+    now[0] += 60
+    assert scheduler.run_pending() == {"cancel": "ran"}
+    assert database.runs[1][3:] == (4, None)
+
+
+class FakeServer:
+    # job_run on a database whose connections can be dropped, served through a real PgPool
+
+    def __init__(self):
+        self.runs = []
+        self.connections = []
+
+    def connect(self, dsn, **kwargs):
+        self.connections.append(FakeServerConnection(self))
+        return self.connections[-1]
+
+
+class FakeServerConnection:
+    def __init__(self, server):
+        self.server = server
+        self.closed = 0
+        self.dropped = False
+
+    def cursor(self, cursor_factory=None):
+        return FakeServerCursor(self)
+
+    def check(self):
+        if self.closed:
+            raise psycopg2.InterfaceError("connection already closed")
+
+    def commit(self):
+        self.check()
+
+    def rollback(self):
+        self.check()
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeServerCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.row = None
+
+    def execute(self, query, params=None):
+        self.connection.check()
+        if self.connection.dropped:
+            self.connection.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        if "pg_try_advisory_lock" in query:
+            self.row = namedtuple("Record", ["locked"])(True)
+        elif "max(started)" in query:
+            started = [run[1] for run in self.connection.server.runs]
+            self.row = namedtuple("Record", ["started"])(max(started) if started else None)
+        elif query.startswith("INSERT INTO job_run"):
+            self.connection.server.runs.append(params)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+def test_new_connection_after_the_old_one_dies(monkeypatch):
+    server = FakeServer()
+    pool = pgpool.PgPool(max_size=1, timeout=0.05, factory=server.connect)
+    monkeypatch.setattr(pgpool, "_pool", pool)
+    now = [10 * HOUR]
+    scheduler = Scheduler(clock=lambda: now[0], retry_delay=60)
+    scheduler.add("cancel", HOUR, lambda db: 2)
+    with Flask(__name__).app_context():  # like `flask run-scheduler`
+        assert scheduler.run_pending() == {"cancel": "ran"}
+        server.connections[0].dropped = True
+        now[0] = 11 * HOUR
+        assert scheduler.run_pending() == {"cancel": "server closed the connection unexpectedly"}
+        now[0] += 60
+        assert scheduler.run_pending() == {"cancel": "ran"}
+    assert len(server.connections) == 2
+    assert [run[3] for run in server.runs] == [2, 2]
+    assert pool.stats()["in_use"] == 0
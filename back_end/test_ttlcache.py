@@ -0,0 +1,38 @@
+from ttlcache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_expires_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set("john.doe@example.com", "Recipient")
+    assert cache.lookup("john.doe@example.com") == (True, "Recipient")
+    clock.now = 11
+    assert cache.lookup("john.doe@example.com") == (False, None)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_caches_falsy_values_and_pop():
+    cache = TTLCache()
+    cache.set("missing@example.com", None)
+    assert cache.lookup("missing@example.com") == (True, None)
+    cache.pop("missing@example.com")
+    assert cache.lookup("missing@example.com") == (False, None)
@@ -0,0 +1,51 @@
+from validation import customer_schema, diner_schema, restaurant_schema, parse_us_phone
+
+diner = {
+    "name": "John Doe",
+    "email": "john.doe@example.com",
+    "phone": "4155551234",
+    "password": "mYp@55worD",
+    "imageURL": "https://picsum.photos/seed/picsum/200/300",
+}
+restaurant = {
+    "restaurantName": "Open Kitchen",
+    "restaurantAddress": "1 Market St, San Francisco, CA",
+    "name": "John Doe",
+    "email": "john.doe@example.com",
+    "phone": "4155551234",
+}
+
+
+def test_valid_diner():
+    assert diner_schema.errors(diner) == []
+
+
+def test_diner_errors_in_order():
+    body = {**diner, "email": "john.doe", "phone": "", "imageURL": ""}
+    assert diner_schema.errors(body) == ["Invalid Email", "Invalid phone number", "No image provided"]
+
+
+def test_missing_fields_are_invalid():
+    assert customer_schema.errors_by_field({}) == {
+        "email": "must be valid",
+        "name": "must be between 1 and 72 characters",
+        "phone": "must be valid",
+    }
+
+
+def test_restaurant_address_checked():
+    assert restaurant_schema.errors(restaurant) == []
+    assert restaurant_schema.errors({**restaurant, "restaurantAddress": ""}) == ["Must be a valid US address"]
+
+
+def test_phone_lookups_cached():
+    parse_us_phone.cache_clear()
+    customer_schema.errors(diner)
+    customer_schema.errors(diner)
+    assert parse_us_phone.cache_info().hits == 1
+
+
+def test_phone_of_wrong_type():
+    assert customer_schema.errors_by_field({**diner, "phone": ["4155551234"]}) == {"phone": "must be valid"}
+    assert customer_schema.errors_by_field({**diner, "phone": {"number": "4155551234"}}) == {"phone": "must be valid"}
+    assert customer_schema.errors_by_field({**diner, "phone": 4155551234}) == {}
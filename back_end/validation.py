@@ -0,0 +1,126 @@
+import functools
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+import phonenumbers
+from validate_email import validate_email
+
+# Declarative request validation shared by the sign-up handlers. A Schema is an ordered list of
+# fields, each with a check and the message reported when it fails; handlers validate the
+# request body before opening a database connection.
+
+password_pattern = re.compile(r'[A-Za-z0-9@#$%^&+=]{8,32}')
+
+
+def length(low, high):
+    def check(value):
+        return isinstance(value, str) and low <= len(value) <= high
+    return check
+
+
+def required(value):
+    return bool(value)
+
+
+def is_email(value):
+    return isinstance(value, str) and bool(validate_email(value))
+
+
+def is_password(value):
+    return isinstance(value, str) and password_pattern.match(value) is not None
+
+
+def optional(check):
+    def check_optional(value):
+        return value == None or value == "" or check(value)
+    return check_optional
+
+
+def is_amount(value):
+    if isinstance(value, bool):
+        return False
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        return False
+    return amount.is_finite() and amount >= 0
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_us_phone(value):
+    try:
+        return phonenumbers.is_valid_number(phonenumbers.parse("+1" + str(value), None))
+    except phonenumbers.NumberParseException:
+        return False
+
+
+def is_us_phone(value):
+    # JSON lists and objects aren't phone numbers, and can't be keys of the parse cache
+    return isinstance(value, (str, int)) and parse_us_phone(value)
+
+
+Field = namedtuple("Field", ["name", "check", "message"])
+
+
+class Schema:
+    def __init__(self, *fields):
+        self.fields = fields
+
+    """
+    Returns:
+        messages of the failed fields, in declaration order
+    """
+
+    def errors(self, data):
+        data = data or {}
+        return [field.message for field in self.fields if not field.check(data.get(field.name))]
+
+    """
+    Returns:
+        dict of failed field name to message
+    """
+
+    def errors_by_field(self, data):
+        data = data or {}
+        return {field.name: field.message for field in self.fields if not field.check(data.get(field.name))}
+
+
+diner_schema = Schema(
+    Field("email", is_email, "Invalid Email"),
+    Field("name", length(1, 72), "Name must be between 1 and 72 characters"),
+    Field("phone", is_us_phone, "Invalid phone number"),
+    Field("password", is_password, "Invalid password"),
+    Field("imageURL", required, "No image provided"),
+)
+
+customer_schema = Schema(
+    Field("email", is_email, "must be valid"),
+    Field("name", length(1, 72), "must be between 1 and 72 characters"),
+    Field("phone", is_us_phone, "must be valid"),
+)
+
+restaurant_schema = Schema(
+    Field("restaurantName", length(1, 72), "Restaurant Name must be between 1 and 72 characters"),
+    # better address validation?
+    Field("restaurantAddress", length(1, 72), "Must be a valid US address"),
+    Field("name", length(1, 72), "Name must be between 1 and 72 characters"),
+    Field("email", is_email, "Invalid Email"),
+    Field("phone", is_us_phone, "Invalid phone number"),
+)
+
+# rows of the bulk imports (bulkimport.py), from CSV columns or NDJSON keys of the same names
+recipient_import_schema = Schema(
+    Field("email", is_email, "must be valid"),
+    Field("name", length(1, 72), "must be between 1 and 72 characters"),
+    Field("phone", is_us_phone, "must be valid"),
+    Field("imageURL", optional(length(1, 2048)), "must be at most 2048 characters"),
+)
+
+menu_item_import_schema = Schema(
+    Field("name", length(1, 72), "must be between 1 and 72 characters"),
+    Field("description", optional(length(1, 1000)), "must be at most 1000 characters"),
+    Field("imageUrl", optional(length(1, 2048)), "must be at most 2048 characters"),
+    Field("baseCost", is_amount, "must be a number of at least 0"),
+    Field("category", optional(length(1, 72)), "must be at most 72 characters"),
+)